@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+""" Compare the old response decoding path, json.loads(r.text), with codec.loads(r.content)
+for every codec installed here.
+
+Pass recorded response bodies (e.g. saved servers/detail or cloudvolumes/detail
+responses) as arguments; without them synthetic listings are generated. """
+
+import optparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ecs_api'))
+
+from requests.models import Response
+import codec
+from synthetic import servers_detail, volumes_detail
+
+
+def response(body):
+    """ A requests.Response as the session would return it. Huawei endpoints send
+    'application/json' without a charset, so r.text has to guess the encoding. """
+    r = Response()
+    r._content = body
+    r.status_code = 200
+    r.headers['Content-Type'] = 'application/json'
+    return r
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [response.json...]')
+    parser.add_option('--servers', type='int', default=2000)
+    parser.add_option('--volumes', type='int', default=5000)
+    parser.add_option('--repeat', type='int', default=3)
+    opts, files = parser.parse_args()
+
+    if files:
+        bodies = [(os.path.basename(f), open(f, 'rb').read()) for f in files]
+    else:
+        bodies = [('servers/detail x%d' % opts.servers, json.dumps(servers_detail(opts.servers))),
+                  ('cloudvolumes/detail x%d' % opts.volumes, json.dumps(volumes_detail(opts.volumes)))]
+
+    for label, body in bodies:
+        print('%s (%.1f MB)' % (label, len(body) / 1e6))
+        # A fresh Response per run, since r.text caches nothing but the encoding guess.
+        old = best_of(lambda: json.loads(response(body).text), opts.repeat)
+        print('  %-28s %8.1f ms' % ('json.loads(r.text)', old * 1000))
+        for name in codec.available():
+            codec.use(name)
+            new = best_of(lambda: codec.loads(response(body).content), opts.repeat)
+            print('  %-28s %8.1f ms  x%.1f' % ('%s.loads(r.content)' % name, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
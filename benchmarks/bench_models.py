@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Memory held by a synthetic 100k-server inventory kept as the decoded dicts the API
+returns, next to the same inventory kept as models.Server objects (with and without
+the serialized raw JSON).
+
+Every case runs in a forked child so the measurements do not share an allocator.
+Each server is decoded from its own JSON text, as it would be from a response, so
+repeated values are separate string objects until the models intern them. """
+
+import optparse
+import json
+import time
+import gc
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ecs_api'))
+
+import codec
+from models import Server
+from synthetic import server
+
+
+def rss():
+    """ Resident set size of this process in bytes. """
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def decoded(n):
+    for i in range(n):
+        yield codec.loads(json.dumps(server(i)))
+
+
+CASES = [
+    ('dicts', lambda n: list(decoded(n))),
+    ('models', lambda n: [Server(s) for s in decoded(n)]),
+    ('models-no-raw', lambda n: [Server(s, keep_raw=False) for s in decoded(n)]),
+]
+
+
+def measure(build, n):
+    """ Build the inventory in a child process; return (bytes held, seconds). """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        gc.collect()
+        before = rss()
+        start = time.time()
+        inventory = build(n)
+        elapsed = time.time() - start
+        gc.collect()
+        os.write(write_fd, json.dumps([rss() - before, elapsed, len(inventory)]))
+        os._exit(0)
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    held, elapsed, _ = json.loads(data)
+    return held, elapsed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--servers', type='int', default=100000)
+    opts, _ = parser.parse_args()
+
+    print('%d servers, codec %s' % (opts.servers, codec.name))
+    baseline = None
+    for name, build in CASES:
+        held, elapsed = measure(build, opts.servers)
+        baseline = baseline or held
+        print('%-14s %8.1f MB  %6d bytes/server  %5.2fx  (built in %.1f s)' % (
+            name, held / 1048576.0, held // opts.servers, float(baseline) / held, elapsed))
+
+
+if __name__ == '__main__':
+    main()
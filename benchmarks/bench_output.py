@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Render a synthetic 50k-volume listing with the evs-list columns in every output
+format, next to the per-line % formatting the list commands used before. """
+
+import optparse
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ecs_api'))
+
+from output import make_writer, FORMATS
+from synthetic import volume
+
+COLUMNS = [("ID", "id"), ("Name", "name"), ("Size", "size"), ("Type", "volume_type"),
+           ("AZ", "availability_zone"), ("Status", "status")]
+
+
+def legacy(volumes, fp):
+    fp.write('%-36s\t%-40s\t%-5s\t%-10s\t%-10s\t%-10s\n' % ("ID", "Name", "Size", "Type", "AZ", "Status"))
+    for volume in volumes:
+        fp.write('%-36s\t%-40s\t%-5s\t%-10s\t%-10s\t%-10s\n' %
+                 (volume["id"], volume["name"], volume["size"], volume["volume_type"],
+                  volume["availability_zone"], volume["status"]))
+
+
+def render(fmt, volumes, fp):
+    writer = make_writer(fmt, fp, COLUMNS)
+    writer.writerows(volumes)
+    writer.close()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rows', type='int', default=50000)
+    parser.add_option('--repeat', type='int', default=3)
+    opts, _ = parser.parse_args()
+
+    volumes = [volume(i) for i in range(opts.rows)]
+    cases = [('legacy', lambda fp: legacy(volumes, fp))]
+    cases += [(fmt, lambda fp, fmt=fmt: render(fmt, volumes, fp)) for fmt in FORMATS]
+    with open(os.devnull, 'w') as fp:
+        for name, case in cases:
+            best = None
+            for _ in range(opts.repeat):
+                start = time.time()
+                case(fp)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print('%-8s %8.1f ms  %10.0f rows/s' % (name, best * 1000, opts.rows / best))
+
+
+if __name__ == '__main__':
+    main()
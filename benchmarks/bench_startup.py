@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" Measure how long the ecs console script takes to start.
+
+Scenarios:
+  help         cold 'ecs help', which must not import the HTTP stack
+  task-status  'ecs task-status' against the local fake IAM/ECS server, i.e. one
+               token request and one API call
+
+Each scenario is run --runs times in a fresh interpreter and the median wall time is
+compared with its threshold; the script exits with status 1 on a regression.
+"""
+
+import subprocess
+import optparse
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY = 'import sys; from ecs_api.ecs import main; main(sys.argv)'
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakecloud import FakeCloud, FakeServer
+
+# Median milliseconds above which a scenario counts as a regression.
+THRESHOLDS = {
+    'help': 150,
+    'task-status': 600,
+}
+
+
+def run_cli(args, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        p = subprocess.Popen([sys.executable, '-c', ENTRY] + args, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        times.append((time.time() - start) * 1000)
+        if p.returncode:
+            raise RuntimeError("ecs %s failed (%d): %s" % (' '.join(args), p.returncode, err))
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=10)
+    parser.add_option('--scale', type='float', default=1.0, help='Multiply all thresholds')
+    opts, _ = parser.parse_args()
+
+    home = tempfile.mkdtemp()
+    cloud = FakeCloud()
+    server = FakeServer(cloud).start()
+    env = dict(os.environ, HOME=home, PYTHONPATH=ROOT, **server.env())
+    with cloud.lock:
+        job_id = cloud._new_job('bench', [], lambda subject: None)['job_id']
+    try:
+        results = {
+            'help': run_cli(['help'], env, opts.runs),
+            'task-status': run_cli(['task-status', job_id], env, opts.runs),
+        }
+    finally:
+        server.stop()
+        shutil.rmtree(home)
+
+    failed = False
+    for name, median in sorted(results.items()):
+        limit = THRESHOLDS[name] * opts.scale
+        status = median > limit and 'REGRESSION' or 'ok'
+        failed = failed or median > limit
+        print('%-12s %8.1f ms  (threshold %.0f ms)  %s' % (name, median, limit, status))
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
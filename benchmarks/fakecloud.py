@@ -0,0 +1,767 @@
+#!/usr/bin/env python
+""" A local stand-in for the Huawei Cloud IAM, ECS, EVS and VPC endpoints used by ECSApi.
+
+It keeps servers, volumes, NICs, elastic IPs and jobs in memory. Jobs run for a
+configurable time and then take effect: creating, starting, stopping, resizing or
+deleting servers, attaching disks, and so on. Latency, throttling (429 with
+Retry-After) and server errors can be injected to exercise the client's retry
+and concurrency code on an isolated machine.
+
+Use it from a benchmark:
+
+    cloud = FakeCloud(servers=1000, latency=Latency.parse('lognormal:20:0.5'))
+    with FakeServer(cloud) as server:
+        env = server.env()          # ECS_ENDPOINT, credentials, ECS_NO_AGENT
+
+or run it standalone and point the CLI at it:
+
+    python benchmarks/fakecloud.py --port 8080 --servers 1000 --latency uniform:10:50
+    ECS_ENDPOINT=http://127.0.0.1:8080/ ECS_PROJECT=cn-east-2 ... ecs list
+
+Every project name and region is served from the same state, and requests to
+/_fake/stats return the request counts per route and status. """
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from urlparse import urlparse, parse_qs
+from StringIO import StringIO
+import SocketServer
+import threading
+import bisect
+import optparse
+import logging
+import random
+import json
+import gzip
+import time
+import sys
+import re
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ecs_api'))
+
+from ratelimit import TokenBucket
+from synthetic import server as synthetic_server, volume as synthetic_volume, uuid, AZS, FLAVORS
+
+PROJECT_ID = u"0123456789abcdef0123456789abcdef"
+
+
+def isotime(timestamp=None):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp or time.time()))
+
+
+class Latency(object):
+    """ Distribution of the delay added to each response, in milliseconds.
+
+    Specs: '20' or 'const:20', 'uniform:LOW:HIGH', 'normal:MEAN:STDDEV' and
+    'lognormal:MEDIAN:SIGMA' (a long tail, like real API latency). """
+
+    def __init__(self, kind='const', a=0.0, b=0.0):
+        self.kind = kind
+        self.a = float(a)
+        self.b = float(b)
+
+    @classmethod
+    def parse(cls, spec):
+        parts = str(spec).split(':')
+        if len(parts) == 1:
+            return cls('const', parts[0])
+        if parts[0] not in ('const', 'uniform', 'normal', 'lognormal'):
+            raise ValueError("Unknown latency distribution '%s'" % parts[0])
+        return cls(*parts)
+
+    def sample(self):
+        """ One delay in seconds. """
+        if self.kind == 'uniform':
+            ms = random.uniform(self.a, self.b)
+        elif self.kind == 'normal':
+            ms = random.gauss(self.a, self.b)
+        elif self.kind == 'lognormal':
+            ms = self.a * random.lognormvariate(0, self.b) if self.a else 0
+        else:
+            ms = self.a
+        return max(ms, 0) / 1000.0
+
+    def __repr__(self):
+        return '%s:%g:%g' % (self.kind, self.a, self.b)
+
+
+class FakeError(Exception):
+    def __init__(self, status, code, message):
+        super(FakeError, self).__init__(message)
+        self.status = status
+        self.body = {'error': {'code': code, 'message': message}}
+
+
+class FakeCloud(object):
+    """ The state behind the fake endpoints and the fault injection settings.
+
+    latency       Latency added to every response
+    job_duration  seconds a job stays RUNNING before it takes effect
+    rate          requests per second served before answering 429 (0 = unlimited)
+    throttle_rate probability of a spurious 429 on any request
+    error_rate    probability of answering error_status instead
+    job_fail_rate probability of each sub-job (one server, NIC, ...) failing """
+
+    def __init__(self, servers=0, volumes=0, publicips=0, latency=None, job_duration=2.0, rate=0,
+                 throttle_rate=0.0, error_rate=0.0, error_status=500, retry_after=1, job_fail_rate=0.0,
+                 token_ttl=86400, gzip=False):
+        self.latency = latency or Latency()
+        self.job_duration = job_duration
+        self.bucket = TokenBucket(rate) if rate else None
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.job_fail_rate = job_fail_rate
+        self.token_ttl = token_ttl
+        self.gzip = gzip
+        self.lock = threading.RLock()
+        self.stats = {}
+        self.tokens = {}
+        self.servers = {}
+        self.deleted = []
+        self.nics = {}
+        self.volumes = {}
+        self.publicips = {}
+        self.jobs = {}
+        self.next_id = 0
+        self._sorted = {}
+        for i in range(servers):
+            self._add_server(synthetic_server(i, PROJECT_ID))
+        for i in range(volumes):
+            self._add_volume(synthetic_volume(i))
+        for i, server_id in enumerate(sorted(self.servers)[:publicips]):
+            port_id = self.nics[server_id][0]['port_id']
+            self.publicips[uuid(4, i)] = {
+                'id': uuid(4, i), 'status': 'ACTIVE', 'type': '5_bgp', 'port_id': port_id,
+                'public_ip_address': '122.112.%d.%d' % (i // 250 % 250, i % 250 + 2),
+                'private_ip_address': self.nics[server_id][0]['fixed_ips'][0]['ip_address'],
+                'bandwidth_size': 5, 'tenant_id': PROJECT_ID, 'create_time': isotime()}
+
+    # state helpers, called with self.lock held
+
+    def _id(self, kind):
+        self.next_id += 1
+        return uuid(kind, 0x10000000 + self.next_id)
+
+    def sorted(self, kind):
+        """ The records of a collection ('servers', 'volumes', 'publicips') sorted by ID,
+        with the list of IDs, cached until the collection changes. """
+        if kind not in self._sorted:
+            items = sorted(getattr(self, kind).values(), key=lambda item: item['id'])
+            self._sorted[kind] = items, [item['id'] for item in items]
+        return self._sorted[kind]
+
+    def _changed(self, kind):
+        self._sorted.pop(kind, None)
+
+    def _add_server(self, server):
+        self.servers[server['id']] = server
+        self._changed('servers')
+        fixed = [a for addresses in server.get('addresses', {}).values() for a in addresses
+                 if a.get('OS-EXT-IPS:type') != 'floating']
+        self.nics[server['id']] = [{
+            'port_state': 'ACTIVE', 'net_id': net_id, 'port_id': uuid(5, int(server['id'][:8], 16)),
+            'mac_addr': a.get('OS-EXT-IPS-MAC:mac_addr'),
+            'fixed_ips': [{'subnet_id': '960f27f3-37b3-4a39-8746-2746acb991a2', 'ip_address': a['addr']}]}
+            for net_id, addresses in server.get('addresses', {}).items() for a in addresses if a in fixed]
+
+    def _add_volume(self, volume):
+        self.volumes[volume['id']] = volume
+        self._changed('volumes')
+
+    def _touch(self, server):
+        server['updated'] = isotime()
+
+    def _new_job(self, job_type, subjects, effect, rollback=None, entities=None):
+        """ Register a job over subjects (server IDs, volume IDs, ...). When it comes due,
+        effect(subject) is called for each subject whose sub-job did not fail and may return
+        the sub-job entities; rollback(subject), if given, for each one that failed. """
+        job_id = self._id(6)
+        self.jobs[job_id] = {
+            'job_id': job_id, 'job_type': job_type, 'status': 'RUNNING', 'begin_time': isotime(),
+            'end_time': '', 'error_code': None, 'fail_reason': None, 'entities': entities or {},
+            '_due': time.time() + self.job_duration, '_subjects': list(subjects), '_effect': effect,
+            '_rollback': rollback}
+        return {'job_id': job_id}
+
+    def advance(self):
+        """ Complete the jobs that have come due. """
+        now = time.time()
+        with self.lock:
+            for job in self.jobs.values():
+                if job['status'] != 'RUNNING' or job['_due'] > now:
+                    continue
+                sub_jobs = []
+                for subject in job['_subjects']:
+                    try:
+                        if random.random() < self.job_fail_rate:
+                            raise FakeError(500, 'Common.0500', 'injected failure')
+                        entities = job['_effect'](subject) or {}
+                    except FakeError as e:
+                        sub_jobs.append({'status': 'FAIL', 'job_type': job['job_type'], 'entities': {},
+                                         'fail_reason': str(e)})
+                        if job['_rollback']:
+                            job['_rollback'](subject)
+                        continue
+                    sub_jobs.append({'status': 'SUCCESS', 'job_type': job['job_type'], 'entities': entities})
+                failed = [s for s in sub_jobs if s['status'] == 'FAIL']
+                job['status'] = 'FAIL' if failed and len(failed) == len(sub_jobs) else 'SUCCESS'
+                job['end_time'] = isotime()
+                job['entities'] = dict(job['entities'], sub_jobs=sub_jobs)
+                if failed:
+                    job['fail_reason'] = '%d of %d sub-jobs failed' % (len(failed), len(sub_jobs))
+
+    def server(self, server_id):
+        try:
+            return self.servers[server_id]
+        except KeyError:
+            raise FakeError(404, 'Ecs.0114', 'Instance %s could not be found' % server_id)
+
+    def volume(self, volume_id):
+        try:
+            return self.volumes[volume_id]
+        except KeyError:
+            raise FakeError(404, 'EVS.0001', 'Volume %s could not be found' % volume_id)
+
+    # IAM
+
+    def issue_token(self, body):
+        project = body['auth']['scope']['project']['name']
+        token = 'fake-%s' % self._id(7)
+        self.tokens[token] = (time.time() + self.token_ttl, project)
+        expires = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(time.time() + self.token_ttl))
+        return {'token': {'expires_at': expires, 'issued_at': isotime(),
+                          'project': {'id': PROJECT_ID, 'name': project}}}, token
+
+    def check_token(self, token):
+        expires, _ = self.tokens.get(token, (0, None))
+        if expires < time.time():
+            raise FakeError(401, 'APIGW.0301', 'Incorrect IAM authentication information')
+
+
+def _page(items, query, key, extra=None, ids=None):
+    """ Apply limit/marker pagination to a list sorted by id; ids is its list of IDs
+    when already at hand. """
+    start = 0
+    marker = query.get('marker')
+    if marker:
+        start = bisect.bisect_right(ids if ids is not None else [item['id'] for item in items], marker)
+    limit = query.get('limit')
+    items = items[start:start + int(limit)] if limit else items[start:]
+    result = {key: items}
+    result.update(extra or {})
+    return result
+
+
+def _public(job):
+    return dict((k, v) for k, v in job.items() if not k.startswith('_'))
+
+
+class Routes(object):
+    """ Request handlers; each takes (cloud, match, query, body) and returns (status, body). """
+
+    # ECS servers
+
+    @staticmethod
+    def list_servers(cloud, match, query, body):
+        servers, ids = cloud.sorted('servers')
+        if 'name' in query:
+            pattern = re.compile(query['name'])
+            servers, ids = [s for s in servers if pattern.search(s['name'])], None
+        since = query.get('changes-since')
+        if since:
+            servers = [s for s in servers if s['updated'] >= since]
+            servers += [s for s in cloud.deleted if s['updated'] >= since]
+            servers, ids = sorted(servers, key=lambda s: s['id']), None
+        page = _page(servers, query, 'servers', ids=ids)
+        if match.group('detail') is None:
+            page['servers'] = [{'id': s['id'], 'name': s['name'], 'links': s.get('links', [])}
+                               for s in page['servers']]
+        return 200, page
+
+    @staticmethod
+    def rename_server(cloud, match, query, body):
+        server = cloud.server(match.group('id'))
+        server['name'] = body['server']['name']
+        cloud._touch(server)
+        return 200, {'server': server}
+
+    @staticmethod
+    def create_servers(cloud, match, query, body):
+        spec = body['server']
+        count = int(spec.get('count', 1))
+        if count > 100:
+            raise FakeError(400, 'Ecs.0005', 'count must be at most 100')
+        server_ids, floating = [], {}
+        for n in range(count):
+            server_id = cloud._id(1)
+            i = int(server_id[:8], 16)
+            server = synthetic_server(i, PROJECT_ID)
+            # servers created in a batch get a -0001 style suffix
+            name = spec.get('name', 'server') + (count > 1 and '-%04d' % (n + 1) or '')
+            server.update({'id': server_id, 'name': name, 'status': 'BUILD',
+                           'flavor': {'id': spec.get('flavorRef', FLAVORS[0])},
+                           'image': {'id': spec.get('imageRef')}, 'key_name': spec.get('key_name'),
+                           'OS-EXT-AZ:availability_zone': spec.get('availability_zone', AZS[0]),
+                           'os-extended-volumes:volumes_attached': [], 'created': isotime(),
+                           'updated': isotime()})
+            # the EIP, if one was requested, is bound once the server is up
+            floating[server_id] = dict((net_id, [a for a in addresses if a.get('OS-EXT-IPS:type') == 'floating'])
+                                       for net_id, addresses in server['addresses'].items())
+            server['addresses'] = dict((net_id, [a for a in addresses if a.get('OS-EXT-IPS:type') != 'floating'])
+                                       for net_id, addresses in server['addresses'].items())
+            cloud._add_server(server)
+            server_ids.append(server_id)
+
+        def effect(server_id):
+            server = cloud.server(server_id)
+            server['status'] = 'ACTIVE'
+            disks = [spec.get('root_volume') or {}] + (spec.get('data_volumes') or [])
+            for index, disk in enumerate(disks):
+                volume_id = cloud._id(2)
+                volume = synthetic_volume(int(volume_id[:8], 16))
+                volume.update({'id': volume_id, 'name': '%s-volume-%04d' % (server['name'], index),
+                               'size': disk.get('size', 40), 'volume_type': disk.get('volumetype', 'SATA'),
+                               'status': 'in-use', 'bootable': index and 'false' or 'true',
+                               'availability_zone': server['OS-EXT-AZ:availability_zone'],
+                               'attachments': [{'server_id': server_id, 'device': '/dev/sd%s' % 'abcdefghij'[index],
+                                                'attachment_id': cloud._id(3)}],
+                               'created_at': isotime(), 'updated_at': isotime()})
+                cloud._add_volume(volume)
+                server['os-extended-volumes:volumes_attached'].append({'id': volume_id})
+            if spec.get('publicip'):
+                for net_id, addresses in floating.pop(server_id).items():
+                    server['addresses'][net_id].extend(addresses)
+            cloud._touch(server)
+            return {'server_id': server_id}
+
+        def rollback(server_id):
+            cloud.servers.pop(server_id, None)
+            cloud.nics.pop(server_id, None)
+            cloud._changed('servers')
+        return 200, cloud._new_job('createServer', server_ids, effect, rollback)
+
+    @staticmethod
+    def delete_servers(cloud, match, query, body):
+        server_ids = [s['id'] for s in body['servers']]
+        delete_volume = body.get('delete_volume')
+
+        def effect(server_id):
+            server = cloud.servers.pop(server_id, None)
+            if server is None:
+                raise FakeError(404, 'Ecs.0114', 'Instance %s could not be found' % server_id)
+            cloud._changed('servers')
+            cloud.nics.pop(server_id, None)
+            for volume in cloud.volumes.values():
+                if any(a['server_id'] == server_id for a in volume['attachments']):
+                    if delete_volume:
+                        del cloud.volumes[volume['id']]
+                        cloud._changed('volumes')
+                    else:
+                        volume['attachments'] = []
+                        volume['status'] = 'available'
+            cloud.deleted.append({'id': server_id, 'name': server['name'], 'status': 'DELETED',
+                                  'updated': isotime()})
+            return {'server_id': server_id}
+        return 200, cloud._new_job('deleteServer', server_ids, effect)
+
+    @staticmethod
+    def server_action(cloud, match, query, body):
+        (action, spec), = body.items()
+        status = {'os-start': 'ACTIVE', 'os-stop': 'SHUTOFF', 'reboot': 'ACTIVE'}.get(action)
+        if status is None:
+            raise FakeError(400, 'Ecs.0005', 'Unknown action %s' % action)
+
+        def effect(server_id):
+            server = cloud.server(server_id)
+            server['status'] = status
+            cloud._touch(server)
+            return {'server_id': server_id}
+        return 200, cloud._new_job('batchActionServers', [s['id'] for s in spec['servers']], effect)
+
+    @staticmethod
+    def resize_server(cloud, match, query, body):
+        server = cloud.server(match.group('id'))
+
+        def effect(server_id):
+            server['flavor'] = {'id': body['resize']['flavorRef']}
+            cloud._touch(server)
+            return {'server_id': server_id}
+        return 200, cloud._new_job('resizeServer', [server['id']], effect)
+
+    @staticmethod
+    def get_job(cloud, match, query, body):
+        cloud.advance()
+        try:
+            return 200, _public(cloud.jobs[match.group('id')])
+        except KeyError:
+            raise FakeError(404, 'Common.0011', 'Job %s could not be found' % match.group('id'))
+
+    @staticmethod
+    def quota(cloud, match, query, body):
+        servers = cloud.servers.values()
+        return 200, {'absolute': {
+            'maxTotalInstances': 1000, 'totalInstancesUsed': len(servers),
+            'maxTotalCores': 4000, 'totalCoresUsed': 2 * len(servers),
+            'maxTotalRAMSize': 16384000, 'totalRAMUsed': 4096 * len(servers),
+            'maxTotalKeypairs': 100, 'maxServerMeta': 50}}
+
+    # NICs
+
+    @staticmethod
+    def list_nics(cloud, match, query, body):
+        cloud.server(match.group('id'))
+        return 200, {'interfaceAttachments': cloud.nics.get(match.group('id'), [])}
+
+    @staticmethod
+    def add_nics(cloud, match, query, body):
+        server_id = match.group('id')
+        cloud.server(server_id)
+
+        def effect(nic):
+            port_id = cloud._id(5)
+            mac_addr = 'fa:16:3e:00:%s:%s' % (port_id[4:6], port_id[6:8])
+            ip_address = '192.168.%d.%d' % (int(port_id[4:6], 16), int(port_id[6:8], 16))
+            net_id = '3a4250b1-9256-4b04-8607-dd220c6ae991'
+            cloud.nics.setdefault(server_id, []).append({
+                'port_state': 'ACTIVE', 'net_id': net_id, 'port_id': port_id, 'mac_addr': mac_addr,
+                'fixed_ips': [{'subnet_id': nic.get('subnet_id'), 'ip_address': ip_address}]})
+            server = cloud.server(server_id)
+            server['addresses'].setdefault(net_id, []).append({
+                'addr': ip_address, 'version': 4, 'OS-EXT-IPS:type': 'fixed', 'OS-EXT-IPS-MAC:mac_addr': mac_addr})
+            cloud._touch(server)
+            return {'nic_id': port_id}
+        return 200, cloud._new_job('attachServerNic', body['nics'], effect)
+
+    @staticmethod
+    def delete_nics(cloud, match, query, body):
+        server_id = match.group('id')
+        cloud.server(server_id)
+
+        def effect(port_id):
+            nics = cloud.nics.get(server_id, [])
+            if not any(nic['port_id'] == port_id for nic in nics):
+                raise FakeError(404, 'Ecs.0021', 'Port %s could not be found' % port_id)
+            cloud.nics[server_id] = [nic for nic in nics if nic['port_id'] != port_id]
+            return {'nic_id': port_id}
+        return 200, cloud._new_job('detachServerNic', [nic['id'] for nic in body['nics']], effect)
+
+    # volumes
+
+    @staticmethod
+    def list_attachments(cloud, match, query, body):
+        server_id = match.group('id')
+        cloud.server(server_id)
+        attachments = [{'id': v['id'], 'volumeId': v['id'], 'serverId': server_id, 'device': a['device']}
+                       for v in cloud.volumes.values() for a in v['attachments'] if a['server_id'] == server_id]
+        return 200, {'volumeAttachments': attachments}
+
+    @staticmethod
+    def attach_volume(cloud, match, query, body):
+        server = cloud.server(match.group('id'))
+        spec = body['volumeAttachment']
+        volume = cloud.volume(spec['volumeId'])
+
+        def effect(volume_id):
+            volume['attachments'] = [{'server_id': server['id'], 'device': spec.get('device'),
+                                      'attachment_id': cloud._id(3)}]
+            volume['status'] = 'in-use'
+            volume['updated_at'] = isotime()
+            server['os-extended-volumes:volumes_attached'].append({'id': volume_id})
+            cloud._touch(server)
+            return {'volume_id': volume_id}
+        return 200, cloud._new_job('attachVolume', [volume['id']], effect)
+
+    @staticmethod
+    def detach_volume(cloud, match, query, body):
+        server = cloud.server(match.group('id'))
+        volume = cloud.volume(match.group('volume'))
+
+        def effect(volume_id):
+            volume['attachments'] = []
+            volume['status'] = 'available'
+            volume['updated_at'] = isotime()
+            server['os-extended-volumes:volumes_attached'] = [
+                v for v in server['os-extended-volumes:volumes_attached'] if v['id'] != volume_id]
+            cloud._touch(server)
+            return {'volume_id': volume_id}
+        return 200, cloud._new_job('detachVolume', [volume['id']], effect)
+
+    @staticmethod
+    def list_volumes(cloud, match, query, body):
+        volumes, ids = cloud.sorted('volumes')
+        return 200, _page(volumes, query, 'volumes', {'count': len(volumes)}, ids)
+
+    @staticmethod
+    def create_volumes(cloud, match, query, body):
+        spec = body['volume']
+
+        def effect(n):
+            volume_id = cloud._id(2)
+            volume = synthetic_volume(int(volume_id[:8], 16))
+            volume.update({'id': volume_id, 'name': spec.get('name'), 'size': spec.get('size'),
+                           'volume_type': spec.get('volume_type'), 'status': 'available', 'attachments': [],
+                           'availability_zone': spec.get('availability_zone'),
+                           'metadata': spec.get('metadata', {}), 'created_at': isotime(), 'updated_at': isotime()})
+            cloud._add_volume(volume)
+            return {'volume_id': volume_id}
+        return 200, cloud._new_job('createVolume', range(int(spec.get('count', 1))), effect)
+
+    @staticmethod
+    def delete_volume(cloud, match, query, body):
+        volume = cloud.volume(match.group('id'))
+        if volume['attachments']:
+            raise FakeError(400, 'EVS.2024', 'Volume %s is in use' % volume['id'])
+
+        def effect(volume_id):
+            cloud.volumes.pop(volume_id, None)
+            cloud._changed('volumes')
+            return {'volume_id': volume_id}
+        return 200, cloud._new_job('deleteVolume', [volume['id']], effect)
+
+    # metadata
+
+    @staticmethod
+    def flavors(cloud, match, query, body):
+        return 200, {'flavors': [{'id': f, 'name': f, 'vcpus': str(2 ** i), 'ram': 4096 * 2 ** i, 'disk': '0'}
+                                 for i, f in enumerate(FLAVORS)]}
+
+    @staticmethod
+    def images(cloud, match, query, body):
+        images = [{'id': uuid(8, i), 'name': 'RHEL-7.%d' % i, 'status': 'active', '__os_version': 'RHEL 7.%d' % i,
+                   'min_disk': 40, 'created_at': '2017-0%d-01T00:00:00Z' % (i + 1)} for i in range(5)]
+        return 200, _page(images, query, 'images')
+
+    @staticmethod
+    def vpcs(cloud, match, query, body):
+        return 200, {'vpcs': [{'id': '3a4250b1-9256-4b04-8607-dd220c6ae991', 'name': 'vpc-default',
+                               'cidr': '192.168.0.0/16', 'status': 'OK'}]}
+
+    @staticmethod
+    def subnets(cloud, match, query, body):
+        return 200, {'subnets': [{'id': '960f27f3-37b3-4a39-8746-2746acb991a2', 'name': 'subnet-default',
+                                  'cidr': '192.168.0.0/16', 'vpc_id': query.get('vpc_id'), 'status': 'ACTIVE'}]}
+
+    @staticmethod
+    def publicips(cloud, match, query, body):
+        publicips, ids = cloud.sorted('publicips')
+        return 200, _page(publicips, query, 'publicips', ids=ids)
+
+    @staticmethod
+    def security_groups(cloud, match, query, body):
+        return 200, {'security_groups': [{'id': '088dcd24-3a1d-45b2-bafe-370eec5dffab', 'name': 'default',
+                                          'vpc_id': '3a4250b1-9256-4b04-8607-dd220c6ae991'}]}
+
+    @staticmethod
+    def availability_zones(cloud, match, query, body):
+        return 200, {'availabilityZoneInfo': [{'zoneName': az, 'zoneState': {'available': True}} for az in AZS]}
+
+    @staticmethod
+    def keypairs(cloud, match, query, body):
+        return 200, {'keypairs': [{'keypair': {'name': 'wshi', 'fingerprint': 'fa:ke', 'public_key': 'ssh-rsa AAAA'}}]}
+
+    @staticmethod
+    def projects(cloud, match, query, body):
+        projects = set(project for _, project in cloud.tokens.values())
+        if 'name' in query:
+            projects = [query['name']]
+        return 200, {'projects': [{'id': PROJECT_ID, 'name': p, 'enabled': True} for p in sorted(projects)]}
+
+
+P = r'/v[12]/(?P<project>[^/]+)'
+
+ROUTES = [
+    ('GET', P + r'/servers(?P<detail>/detail)?$', Routes.list_servers),
+    ('PUT', P + r'/servers/(?P<id>[^/]+)$', Routes.rename_server),
+    ('POST', P + r'/cloudservers$', Routes.create_servers),
+    ('POST', P + r'/cloudservers/delete$', Routes.delete_servers),
+    ('POST', P + r'/cloudservers/action$', Routes.server_action),
+    ('GET', P + r'/cloudservers/limits$', Routes.quota),
+    ('POST', P + r'/cloudservers/(?P<id>[^/]+)/resize$', Routes.resize_server),
+    ('POST', P + r'/cloudservers/(?P<id>[^/]+)/nics$', Routes.add_nics),
+    ('POST', P + r'/cloudservers/(?P<id>[^/]+)/nics/delete$', Routes.delete_nics),
+    ('POST', P + r'/cloudservers/(?P<id>[^/]+)/attachvolume$', Routes.attach_volume),
+    ('DELETE', P + r'/cloudservers/(?P<id>[^/]+)/detachvolume/(?P<volume>[^/]+)$', Routes.detach_volume),
+    ('GET', P + r'/jobs/(?P<id>[^/]+)$', Routes.get_job),
+    ('GET', P + r'/servers/(?P<id>[^/]+)/os-interface$', Routes.list_nics),
+    ('GET', P + r'/servers/(?P<id>[^/]+)/os-volume_attachments$', Routes.list_attachments),
+    ('GET', P + r'/cloudvolumes/detail$', Routes.list_volumes),
+    ('POST', P + r'/cloudvolumes$', Routes.create_volumes),
+    ('DELETE', P + r'/cloudvolumes/(?P<id>[^/]+)$', Routes.delete_volume),
+    ('GET', P + r'/flavors$', Routes.flavors),
+    ('GET', r'/v2/cloudimages$', Routes.images),
+    ('GET', P + r'/vpcs$', Routes.vpcs),
+    ('GET', P + r'/subnets$', Routes.subnets),
+    ('GET', P + r'/publicips$', Routes.publicips),
+    ('GET', P + r'/security-groups$', Routes.security_groups),
+    ('GET', P + r'/os-availability-zone$', Routes.availability_zones),
+    ('GET', P + r'/os-keypairs$', Routes.keypairs),
+    ('GET', r'/v3/auth/projects$', Routes.projects),
+    ('GET', r'/v3/projects$', Routes.projects),
+]
+ROUTES = [(method, re.compile(pattern), handler) for method, pattern, handler in ROUTES]
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body)
+        headers = dict(headers or {})
+        if self.server.cloud.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1) as fp:
+                fp.write(data)
+            data = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _count(self, route, status):
+        stats = self.server.cloud.stats
+        key = '%s %s' % (self.command, route)
+        with self.server.cloud.lock:
+            counts = stats.setdefault(key, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def _handle(self):
+        cloud = self.server.cloud
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else ''
+        url = urlparse(self.path)
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+
+        if url.path == '/_fake/stats':
+            return self._reply(200, cloud.stats)
+
+        delay = cloud.latency.sample()
+        if delay:
+            time.sleep(delay)
+
+        route, status, body, headers = url.path, 500, None, {}
+        try:
+            if cloud.bucket is not None and cloud.bucket.try_acquire():
+                raise FakeError(429, 'APIGW.0308', 'The throttling threshold has been reached')
+            if random.random() < cloud.throttle_rate:
+                raise FakeError(429, 'APIGW.0308', 'The throttling threshold has been reached')
+            if random.random() < cloud.error_rate:
+                raise FakeError(cloud.error_status, 'Common.0500', 'Injected error')
+
+            if url.path == '/v3/auth/tokens':
+                route = url.path
+                if self.command == 'POST':
+                    with cloud.lock:
+                        body, token = cloud.issue_token(json.loads(raw))
+                    status, headers = 201, {'X-Subject-Token': token}
+                else:
+                    cloud.check_token(self.headers.get('X-Auth-Token'))
+                    subject = self.headers.get('X-Subject-Token')
+                    cloud.check_token(subject)
+                    expires, project = cloud.tokens[subject]
+                    status, body = 200, {'token': {'expires_at': isotime(expires),
+                                                   'project': {'id': PROJECT_ID, 'name': project}}}
+                return
+            cloud.check_token(self.headers.get('X-Auth-Token'))
+            for method, pattern, handler in ROUTES:
+                match = pattern.match(url.path)
+                if match and method == self.command:
+                    route = pattern.pattern
+                    with cloud.lock:
+                        status, body = handler(cloud, match, query, json.loads(raw) if raw else None)
+                    return
+            raise FakeError(404, 'Common.0404', 'No route for %s %s' % (self.command, url.path))
+        except FakeError as e:
+            status, body = e.status, e.body
+            if e.status == 429:
+                headers['Retry-After'] = str(cloud.retry_after)
+        except Exception as e:
+            logging.exception("Fake endpoint failed")
+            status, body = 500, {'error': {'code': 'Common.0500', 'message': str(e)}}
+        finally:
+            self._count(route, status)
+            self._reply(status, body, headers)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, *args):
+        logging.debug("fakecloud: " + args[0] % args[1:])
+
+
+class FakeServer(SocketServer.ThreadingMixIn, HTTPServer):
+    """ Serves a FakeCloud over HTTP on a background thread. """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, cloud=None, address=('127.0.0.1', 0)):
+        HTTPServer.__init__(self, address, FakeHandler)
+        self.cloud = cloud or FakeCloud()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % self.server_address
+
+    def env(self, project='cn-east-2'):
+        """ Environment pointing the ecs CLI (or ECSApi) at this server. """
+        return {'ECS_ENDPOINT': self.url, 'ECS_PROJECT': project, 'ECS_DOMAIN': 'fake', 'ECS_USERNAME': 'fake',
+                'ECS_PASSWORD': 'fake', 'ECS_NO_AGENT': '1'}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fakecloud')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--servers', type='int', default=100)
+    parser.add_option('--volumes', type='int', default=300)
+    parser.add_option('--publicips', type='int', default=10)
+    parser.add_option('--latency', default='0', help='const:MS, uniform:LOW:HIGH, normal:MEAN:SD or '
+                                                      'lognormal:MEDIAN:SIGMA, in milliseconds')
+    parser.add_option('--job-duration', type='float', default=2.0)
+    parser.add_option('--rate', type='float', default=0, help='Requests per second before answering 429')
+    parser.add_option('--throttle-rate', type='float', default=0.0, help='Probability of a spurious 429')
+    parser.add_option('--error-rate', type='float', default=0.0, help='Probability of an injected error')
+    parser.add_option('--error-status', type='int', default=500)
+    parser.add_option('--job-fail-rate', type='float', default=0.0)
+    parser.add_option('--gzip', action='store_true', help='Compress responses for clients accepting gzip')
+    parser.add_option('-d', '--debug', action='store_true')
+    opts, _ = parser.parse_args()
+    logging.basicConfig(level=opts.debug and logging.DEBUG or logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    cloud = FakeCloud(opts.servers, opts.volumes, opts.publicips, Latency.parse(opts.latency), opts.job_duration,
+                      opts.rate, opts.throttle_rate, opts.error_rate, opts.error_status,
+                      job_fail_rate=opts.job_fail_rate, gzip=opts.gzip)
+    server = FakeServer(cloud, (opts.host, opts.port))
+    logging.info("Fake IAM/ECS endpoint on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+""" Benchmark suite covering request building, response decoding, table rendering and
+end-to-end request throughput against the local fake IAM/ECS server.
+
+    python benchmarks/suite.py --save baseline.json      # record a baseline
+    python benchmarks/suite.py --compare baseline.json   # exit 1 on regressions
+
+Every case reports one or more metrics. Metrics ending in _ms are lower-is-better,
+rps is higher-is-better. In compare mode a metric counts as a regression when it is
+worse than the baseline by more than --tolerance (a fraction, 0.25 by default).
+Baselines only compare meaningfully on the machine that recorded them. """
+
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+import platform
+import optparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'ecs_api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The client keeps its token and caches under $HOME; keep the benchmarks away from the real ones.
+HOME = tempfile.mkdtemp(prefix='ecs-bench-')
+os.environ['HOME'] = HOME
+
+import codec
+from output import make_writer
+from streaming import iter_array
+from synthetic import servers_detail, volumes_detail, volume, uuid
+from fakecloud import FakeCloud, FakeServer, Latency
+
+EVS_COLUMNS = [("ID", "id"), ("Name", "name"), ("Size", "size"), ("Type", "volume_type"),
+               ("AZ", "availability_zone"), ("Status", "status")]
+IMAGE_COLUMNS = [("ID", "id"), ("Name", "name"), ("OS Version", "__os_version"), ("Created_date", "created_at")]
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100.0), len(samples) - 1)]
+
+
+def payload_api():
+    """ An ECSApi that serializes request bodies as ECSSession.post would, without sending them. """
+    from ecs_api import ECSApi
+
+    class PayloadApi(ECSApi):
+        def __init__(self):
+            self.base_url = "https://ecs.cn-east-2.myhuaweicloud.com/"
+            self.project_id = "0123456789abcdef0123456789abcdef"
+            self.keypair, self.vm_name, self.az, self.flavor_ref = "wshi", "avocado_cloud", "cn-east-2a", "s1.medium"
+            self.image_ref = self.vpc_id = self.subnet_id = self.sg_id = "726802ee-a5c6-4b2e-9a2f-66f24f205313"
+
+        def make_request(self, endpoint, action, data=None, retry=None):
+            return codec.dumps(data)
+    return PayloadApi()
+
+
+def bench_payload(opts):
+    api = payload_api()
+    ids = [uuid(1, i) for i in range(opts.ids)]
+    cases = {
+        'create_ecss': lambda: api.create_ecss(),
+        'add_nics': lambda: api.add_nics(ids[0], opts.ids),
+        'delete_ecss': lambda: api.delete_ecss(ids),
+        'stop_ecss': lambda: api.stop_ecss(ids),
+    }
+    results = {}
+    for name, func in sorted(cases.items()):
+        # create_ecss builds a single server, so it is repeated to get a measurable time
+        loops = name == 'create_ecss' and opts.ids or 1
+        results['payload.%s' % name] = {
+            'time_ms': best_of(lambda: [func() for _ in range(loops)], opts.repeat) * 1000}
+    return results
+
+
+def bench_decode(opts):
+    bodies = {
+        'servers_detail': json.dumps(servers_detail(opts.servers)),
+        'volumes_detail': json.dumps(volumes_detail(opts.volumes)),
+    }
+    results = {}
+    for name, body in sorted(bodies.items()):
+        key = name.split('_')[0]
+        chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+        results['decode.%s' % name] = {
+            'time_ms': best_of(lambda: codec.loads(body), opts.repeat) * 1000,
+            'stream_ms': best_of(lambda: sum(1 for _ in iter_array(chunks, key)), opts.repeat) * 1000,
+        }
+    return results
+
+
+def bench_render(opts):
+    volumes = [volume(i) for i in range(opts.rows)]
+    images = [{'id': uuid(8, i), 'name': 'RHEL-7.%d-%d' % (i % 10, i), '__os_version': 'RHEL 7.%d' % (i % 10),
+               'created_at': '2017-03-01T08:00:00Z'} for i in range(opts.rows)]
+
+    def render(records, columns, fmt):
+        writer = make_writer(fmt, StringIO(), columns)
+        writer.writerows(records)
+        writer.close()
+
+    results = {}
+    for fmt in ('table', 'csv'):
+        results['render.evs_list.%s' % fmt] = {
+            'time_ms': best_of(lambda: render(volumes, EVS_COLUMNS, fmt), opts.repeat) * 1000}
+        results['render.images.%s' % fmt] = {
+            'time_ms': best_of(lambda: render(images, IMAGE_COLUMNS, fmt), opts.repeat) * 1000}
+    return results
+
+
+def bench_e2e(opts):
+    """ Requests against the fake server through the real ECSApi: connection pool, token
+    handling, rate limiter and decoding included. The client rate limits are lifted so
+    the client's own overhead is what gets measured. """
+    cloud = FakeCloud(servers=opts.servers, job_duration=0, latency=Latency.parse(opts.latency))
+    server = FakeServer(cloud).start()
+    os.environ.update(server.env())
+    from ecs_api import ECSApi
+    from ratelimit import rate_limiter
+    from pool import pool_manager
+    for endpoint_class in ('iam', 'query', 'action'):
+        rate_limiter.configure(endpoint_class, 1e6, 1e6)
+    try:
+        api = ECSApi()
+        job_id = api.stop_ecss([uuid(1, 0)])['job_id']
+
+        def timed(_):
+            start = time.time()
+            api.query_task_status(job_id)
+            return time.time() - start
+
+        results = {}
+        for concurrency in (1, opts.concurrency):
+            pool_manager.configure(pool_maxsize=max(concurrency, 10))
+            pool = ThreadPool(concurrency)
+            try:
+                start = time.time()
+                latencies = pool.map(timed, range(opts.requests))
+                elapsed = time.time() - start
+            finally:
+                pool.terminate()
+            results['e2e.get.c%d' % concurrency] = {
+                'rps': opts.requests / elapsed,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+            }
+        results['e2e.iter_servers'] = {
+            'time_ms': best_of(lambda: sum(1 for _ in api.iter_servers()), opts.repeat) * 1000}
+        results['e2e.iter_servers.stream'] = {
+            'time_ms': best_of(lambda: sum(1 for _ in api.iter_servers(stream=True)), opts.repeat) * 1000}
+    finally:
+        server.stop()
+    return results
+
+
+GROUPS = [
+    ('payload', bench_payload),
+    ('decode', bench_decode),
+    ('render', bench_render),
+    ('e2e', bench_e2e),
+]
+
+
+def lower_is_better(metric):
+    return metric.endswith('_ms')
+
+
+def compare(results, baseline, tolerance):
+    """ Print every metric next to its baseline and return the number of regressions. """
+    regressions = 0
+    for case in sorted(results):
+        for metric, value in sorted(results[case].items()):
+            old = baseline.get('results', {}).get(case, {}).get(metric)
+            if not old:
+                print('%-32s %-10s %10.2f   (no baseline)' % (case, metric, value))
+                continue
+            change = (value - old) / old
+            worse = change > tolerance if lower_is_better(metric) else change < -tolerance
+            regressions += worse
+            print('%-32s %-10s %10.2f  %10.2f  %+7.1f%%  %s' % (case, metric, value, old, change * 100,
+                                                                worse and 'REGRESSION' or 'ok'))
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--only', action='append', help='Run only these groups: %s' % ', '.join(g for g, _ in GROUPS))
+    parser.add_option('--save', help='Write the results as a JSON baseline')
+    parser.add_option('--compare', help='Compare with a JSON baseline, exit 1 on regressions')
+    parser.add_option('--tolerance', type='float', default=0.25)
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--ids', type='int', default=10000, help='Server IDs in the batch payloads')
+    parser.add_option('--servers', type='int', default=5000)
+    parser.add_option('--volumes', type='int', default=10000)
+    parser.add_option('--rows', type='int', default=50000, help='Rows rendered by the list formatters')
+    parser.add_option('--requests', type='int', default=2000)
+    parser.add_option('--concurrency', type='int', default=16)
+    parser.add_option('--latency', default='0', help='Latency of the fake server, see fakecloud.Latency')
+    opts, _ = parser.parse_args()
+
+    results = {}
+    try:
+        for group, func in GROUPS:
+            if opts.only and group not in opts.only:
+                continue
+            results.update(func(opts))
+    finally:
+        shutil.rmtree(HOME, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'codec': codec.name,
+        'results': results,
+    }
+    if opts.save:
+        with open(opts.save, 'w') as fp:
+            json.dump(report, fp, indent=4, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, opts.tolerance)
+        print('%d regression(s) against %s' % (regressions, opts.compare))
+        return regressions and 1 or 0
+    for case in sorted(results):
+        for metric, value in sorted(results[case].items()):
+            print('%-32s %-10s %10.2f' % (case, metric, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
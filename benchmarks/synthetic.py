@@ -0,0 +1,70 @@
+""" Synthetic ECS/EVS listings shaped like the real servers/detail and cloudvolumes/detail
+responses, used by the benchmarks when no recorded responses are given. """
+
+STATUSES = (u"ACTIVE", u"SHUTOFF", u"BUILD")
+AZS = (u"cn-east-2a", u"cn-east-2b", u"cn-east-2c")
+VOLUME_TYPES = (u"SATA", u"SSD", u"SAS")
+FLAVORS = (u"s1.medium", u"s1.large", u"c3.xlarge.2")
+
+
+def uuid(kind, i):
+    return u"%08x-%04x-4000-8000-%012x" % (i, kind, i)
+
+
+def server(i, project_id=u"0123456789abcdef0123456789abcdef"):
+    return {
+        u"id": uuid(1, i),
+        u"name": u"avocado_cloud-%04d" % i,
+        u"status": STATUSES[i % 3],
+        u"flavor": {u"id": FLAVORS[i % 3], u"links": [{u"rel": u"bookmark", u"href": u"https://ecs.example/flavors"}]},
+        u"image": {u"id": u"726802ee-a5c6-4b2e-9a2f-66f24f205313"},
+        u"key_name": u"wshi",
+        u"tenant_id": project_id,
+        u"user_id": u"fedcba9876543210fedcba9876543210",
+        u"created": u"2017-03-01T08:%02d:%02dZ" % (i // 60 % 60, i % 60),
+        u"updated": u"2017-03-01T09:%02d:%02dZ" % (i // 60 % 60, i % 60),
+        u"hostId": u"%056x" % i,
+        u"OS-EXT-AZ:availability_zone": AZS[i % 3],
+        u"OS-EXT-STS:vm_state": STATUSES[i % 3].lower(),
+        u"OS-EXT-STS:power_state": 1,
+        u"addresses": {
+            u"3a4250b1-9256-4b04-8607-dd220c6ae991": [
+                {u"addr": u"192.168.%d.%d" % (i // 250 % 250, i % 250 + 2), u"version": 4,
+                 u"OS-EXT-IPS:type": u"fixed", u"OS-EXT-IPS-MAC:mac_addr": u"fa:16:3e:%02x:%02x:%02x" % (
+                     i >> 16 & 255, i >> 8 & 255, i & 255)},
+                {u"addr": u"122.112.%d.%d" % (i // 250 % 250, i % 250 + 2), u"version": 4,
+                 u"OS-EXT-IPS:type": u"floating", u"OS-EXT-IPS-MAC:mac_addr": u"fa:16:3e:%02x:%02x:%02x" % (
+                     i >> 16 & 255, i >> 8 & 255, i & 255)},
+            ]
+        },
+        u"os-extended-volumes:volumes_attached": [{u"id": uuid(2, i * 3 + k)} for k in range(3)],
+        u"security_groups": [{u"name": u"default"}],
+        u"metadata": {u"metering.image_id": u"726802ee-a5c6-4b2e-9a2f-66f24f205313",
+                      u"metering.imagetype": u"gold", u"vpc_id": u"3a4250b1-9256-4b04-8607-dd220c6ae991"},
+        u"links": [{u"rel": u"self", u"href": u"https://ecs.example/v2/%s/servers/%s" % (project_id, uuid(1, i))}],
+    }
+
+
+def volume(i):
+    return {
+        u"id": uuid(2, i),
+        u"name": u"avocado_cloud-volume-%d" % i,
+        u"size": 40 + i % 200,
+        u"volume_type": VOLUME_TYPES[i % 3],
+        u"availability_zone": AZS[i % 3],
+        u"status": (u"available", u"in-use")[i % 2],
+        u"bootable": u"false",
+        u"created_at": u"2017-03-01T08:00:00.000000",
+        u"updated_at": u"2017-03-01T09:00:00.000000",
+        u"attachments": [{u"server_id": uuid(1, i // 3), u"device": u"/dev/vd%s" % u"bcd"[i % 3],
+                          u"attachment_id": uuid(3, i)}] if i % 2 else [],
+        u"metadata": {u"hw:passthrough": u"false"},
+    }
+
+
+def servers_detail(n):
+    return {u"servers": [server(i) for i in range(n)]}
+
+
+def volumes_detail(n):
+    return {u"volumes": [volume(i) for i in range(n)], u"count": n}
@@ -0,0 +1,273 @@
+from StringIO import StringIO
+import SocketServer
+import threading
+import logging
+import socket
+import json
+import time
+import sys
+import os
+
+agent_socket = os.path.expanduser('~') + '/.ecs_agent.sock'
+agent_log = os.path.expanduser('~') + '/.ecs_agent.log'
+
+
+def _send(sock, obj):
+    sock.sendall(json.dumps(obj) + '\n')
+
+
+def _recv(sock):
+    fp = sock.makefile('r')
+    try:
+        line = fp.readline()
+    finally:
+        fp.close()
+    if not line:
+        raise socket.error("agent closed the connection")
+    return json.loads(line)
+
+
+def call(request, path=agent_socket, timeout=None):
+    """ Send one request to the agent and return its reply. Raises socket.error when no
+    agent is listening on path. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        _send(sock, request)
+        return _recv(sock)
+    finally:
+        sock.close()
+
+
+def forward(argv, path=agent_socket):
+    """ Run an ecs command line in the agent. Returns the exit status, or None when
+    no agent is running and the command has to be run locally. """
+    if not os.path.exists(path):
+        return None
+    # commands run in the agent with the caller's working directory and ECS_* variables
+    env = dict((name, value) for name, value in os.environ.items() if name.startswith('ECS_'))
+    try:
+        reply = call({'argv': argv, 'cwd': os.getcwd(), 'env': env}, path)
+    except socket.error:
+        logging.debug("No agent listening on %s" % path)
+        return None
+    if 'refused' in reply:
+        logging.debug("The agent refused the command: %s" % reply['refused'])
+        return None
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['rc']
+
+
+class AgentHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if 'control' in request:
+            reply = self.server.control(request['control'])
+        else:
+            reply = self.server.run(request['argv'], request.get('cwd'), request.get('env'))
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class ThreadLocalStream(object):
+    """ Installed as sys.stdout and sys.stderr in the agent. Writes go to the buffer of the
+    command run by the current thread, or to the real stream outside of commands, so that
+    commands can run concurrently. """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self.local, 'fp', None) or self.default
+
+    def write(self, data):
+        self.target.write(data)
+
+    def writelines(self, lines):
+        self.target.writelines(lines)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class CommandLogFilter(logging.Filter):
+    """ Passes only the records logged by a thread running a command. """
+
+    def __init__(self, stream):
+        logging.Filter.__init__(self)
+        self.stream = stream
+
+    def filter(self, record):
+        return getattr(self.stream.local, 'fp', None) is not None
+
+
+class AgentServer(SocketServer.ThreadingUnixStreamServer):
+    """ Holds one authenticated ECSApi, the shared connection pool and the caches, and
+    runs forwarded ecs command lines against them, each in its own thread with its own
+    output buffers, working directory and environment (see ecs.command_context). """
+    daemon_threads = True
+
+    def __init__(self, api, path=agent_socket):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.ThreadingUnixStreamServer.__init__(self, path, AgentHandler)
+        os.chmod(path, 0o600)
+        from coalesce import ActionCoalescer
+        self.api = api
+        self.coalescer = ActionCoalescer(api)
+        self.path = path
+        self.started = time.time()
+        self.served = 0
+        self.lock = threading.Lock()
+        self.stdout = ThreadLocalStream(sys.stdout)
+        self.stderr = ThreadLocalStream(sys.stderr)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        # log records of commands go to the stderr buffer of the command
+        self.log_handler = logging.StreamHandler(self.stderr)
+        self.log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        self.log_handler.addFilter(CommandLogFilter(self.stderr))
+        logging.getLogger().addHandler(self.log_handler)
+
+    def foreign_identity(self, env):
+        """ The first ECS_* variable of env naming another project, endpoint or user than
+        the one we are authenticated as, or None. Those the client leaves unset would be
+        prompted for, ours stand in for them. """
+        from ecs_api import endpoint_url
+        env = env or {}
+        _, project_name, domain_name, username, password = self.api.identity
+        base_url = self.api.base_url
+        if env.get('ECS_PROJECT') or env.get('ECS_ENDPOINT'):
+            project_name = env.get('ECS_PROJECT') or project_name
+            base_url = endpoint_url(project_name, env)
+        ours = [('ECS_PROJECT', self.api.project_name, project_name),
+                ('ECS_ENDPOINT', self.api.base_url, base_url),
+                ('ECS_DOMAIN', domain_name, env.get('ECS_DOMAIN') or domain_name),
+                ('ECS_USERNAME', username, env.get('ECS_USERNAME') or username),
+                ('ECS_PASSWORD', password, env.get('ECS_PASSWORD') or password)]
+        for name, value, theirs in ours:
+            if value != theirs:
+                return name
+        return None
+
+    def run(self, argv, cwd=None, env=None):
+        """ Run argv for a client, unless its environment names another tenant; the client
+        then runs it by itself. """
+        from cache import metadata_cache
+        import ecs
+        foreign = self.foreign_identity(env)
+        if foreign:
+            return {'refused': "%s differs from the agent's" % foreign}
+        with self.lock:
+            self.served += 1
+        ecs.shared_api = self.api
+        ecs.shared_coalescer = self.coalescer
+        stdout, stderr = StringIO(), StringIO()
+        self.stdout.local.fp, self.stderr.local.fp = stdout, stderr
+        ecs.command_context.cwd = cwd
+        ecs.command_context.env = env
+        rc = 0
+        try:
+            ecs.main(['ecs'] + argv)
+        except SystemExit as e:
+            rc = e.code if isinstance(e.code, int) else (e.code is not None and 1 or 0)
+        except Exception:
+            logging.exception("Agent command failed")
+            rc = 1
+        finally:
+            self.stdout.local.fp = self.stderr.local.fp = None
+            ecs.command_context.cwd = ecs.command_context.env = ecs.command_context.command = None
+            # new metadata reaches the CLI processes that run without the agent
+            metadata_cache.save()
+        return {'rc': rc, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def control(self, command):
+        if command == 'stop':
+            threading.Thread(target=self.shutdown).start()
+            return {'stopping': True}
+        from pool import pool_manager
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'served': self.served,
+                'project_id': self.api.project_id, 'pool': pool_manager.stats(),
+                'coalesced': {'requests': self.coalescer.requests, 'calls': self.coalescer.calls}}
+
+    def server_close(self):
+        SocketServer.ThreadingUnixStreamServer.server_close(self)
+        self.coalescer.close()
+        logging.getLogger().removeHandler(self.log_handler)
+        sys.stdout, sys.stderr = self.stdout.default, self.stderr.default
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(credentials, path=agent_socket):
+    from ecs_api import ECSApi
+    api = ECSApi(*credentials)
+    server = AgentServer(api, path)
+    logging.info("ecs agent listening on %s" % path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def start(path=agent_socket, wait=30):
+    """ Prompt for credentials, then fork an agent into the background and wait for it to listen. """
+    from ecs_api import prompt_credentials
+    credentials = prompt_credentials()
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        logging.basicConfig(filename=agent_log, level=logging.INFO,
+                            format='%(asctime)s %(levelname)s %(message)s')
+        try:
+            serve(credentials, path)
+        except Exception:
+            logging.exception("ecs agent failed")
+        os._exit(0)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        try:
+            reply = call({'control': 'status'}, path, timeout=1)
+            print("ecs agent running (pid %d) on %s" % (reply['pid'], path))
+            return 0
+        except socket.error:
+            time.sleep(0.2)
+    print("Error: ecs agent did not start, see %s" % agent_log)
+    return 1
+
+
+def main(argv=sys.argv):
+    action = len(argv) > 1 and argv[1] or 'status'
+    if action == 'start':
+        return start()
+    if action == 'run':
+        from ecs_api import prompt_credentials
+        logging.getLogger().setLevel(logging.INFO)
+        serve(prompt_credentials())
+        return 0
+    try:
+        reply = call({'control': action == 'stop' and 'stop' or 'status'}, timeout=5)
+    except socket.error:
+        print("ecs agent is not running")
+        return 1
+    print(json.dumps(reply, indent=4, sort_keys=True))
+    return 0
+
+
+def help():
+    return "start\t\t\tPrompt for credentials and start the agent in the background\n" \
+           "run\t\t\tRun the agent in the foreground\n" \
+           "stop\t\t\tStop the running agent\n" \
+           "status\t\t\tShow agent status and connection pool statistics"
+
+
+if __name__ == '__main__':
+    sys.exit(main())
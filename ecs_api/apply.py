@@ -0,0 +1,51 @@
+from ecs import get_api, local_path
+from fleet import plan_fleet, execute
+import getopt
+import json
+import sys
+
+
+def print_plan(steps):
+    if not steps:
+        print("Nothing to do, the fleet matches the spec")
+        return
+    for step in steps:
+        depends = step.depends and " (after %s)" % ", ".join(str(dep.id) for dep in step.depends) or ""
+        print("%3d  %-14s %-40s %s%s" % (step.id, step.action, step.target, json.dumps(step.detail, sort_keys=True),
+                                         depends))
+
+
+def help():
+    return "<FleetFile>\t\tReconcile the servers named in <FleetFile> (the JSON of 'ecs create',\n" \
+           "\t\t\tor a list of them) with its count, flavor, data volumes and NICs\n" \
+           "--plan <FleetFile>\tOnly print the API calls that would be made\n" \
+           "--parallel P\t\tRun up to P calls at once (default 8)"
+
+
+def main(argv=sys.argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv[1:], '', ['plan', 'parallel='])
+    except getopt.GetoptError as e:
+        print("Error: %s" % e)
+        return
+    opts = dict(opts)
+    if len(args) != 1:
+        print("Error: ecs apply requires 1 argument")
+        return
+    with open(local_path(args[0]), 'r') as fp:
+        fleet = json.load(fp)
+    api = get_api()
+    steps = plan_fleet(api, fleet)
+    print_plan(steps)
+    if '--plan' in opts or not steps:
+        return
+    outcomes = execute(api, steps, int(opts.get('--parallel', 8)))
+    print(json.dumps(outcomes, indent=4, sort_keys=True))
+    failed = [step_id for step_id, outcome in outcomes.items() if outcome['status'] != 'SUCCESS']
+    if failed:
+        print("Error: %d of %d steps did not succeed" % (len(failed), len(steps)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
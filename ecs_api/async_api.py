@@ -0,0 +1,87 @@
+import logging
+from multiprocessing.pool import ThreadPool
+from ecs_api import ECSApi
+from pool import pool_manager
+
+
+def gather(results, timeout=None):
+    """ Wait for a list of pending results and return their values in order. """
+    return [result.get(timeout) for result in results]
+
+
+class AsyncECSSession(object):
+    """ Non-blocking front end of an ECSSession. Every call is submitted to a shared
+    worker pool and returns immediately with an AsyncResult; the shared HTTP connection
+    pool is grown to the number of workers so concurrent calls reuse warm connections. """
+
+    def __init__(self, session, workers=32):
+        self.session = session
+        self.workers = workers
+        if pool_manager.settings['pool_maxsize'] < workers:
+            pool_manager.configure(pool_maxsize=workers)
+        self.pool = ThreadPool(workers)
+
+    def submit(self, func, *args, **kwargs):
+        """ Schedule func(*args, **kwargs) and return an AsyncResult. Errors such as
+        ECSHTTPError are raised again by AsyncResult.get(). """
+        return self.pool.apply_async(func, args, kwargs)
+
+    def map(self, func, iterable):
+        """ Schedule func for every item and return the list of AsyncResults. """
+        return [self.submit(func, item) for item in iterable]
+
+    def get(self, url):
+        return self.submit(self.session.get, url)
+
+    def post(self, url, data):
+        return self.submit(self.session.post, url, data)
+
+    def put(self, url, data):
+        return self.submit(self.session.put, url, data)
+
+    def delete(self, url):
+        return self.submit(self.session.delete, url)
+
+    def close(self):
+        logging.debug("Shutting down async worker pool")
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class AsyncECSApi(AsyncECSSession):
+    """ Mirrors every public ECSApi method (create_ecss, query_ecs_detail,
+    query_task_status, attach_volume, ...) as a call returning an AsyncResult. """
+
+    def __init__(self, api=None, workers=32):
+        super(AsyncECSApi, self).__init__(api or ECSApi(), workers)
+
+    @property
+    def api(self):
+        return self.session
+
+    def __getattr__(self, name):
+        if name == 'session':
+            raise AttributeError(name)
+        attr = getattr(self.session, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            return self.submit(attr, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+
+    with AsyncECSApi() as ecs:
+        evss, servers = gather([ecs.query_evss(), ecs.query_ecs_detail()])
+        print("%d volumes, %d servers" % (len(evss['volumes']), len(servers['servers'])))
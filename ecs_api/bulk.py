@@ -0,0 +1,88 @@
+from multiprocessing.pool import ThreadPool
+from jobs import JobWaiter
+import logging
+import copy
+import time
+
+# Largest "count" a single create_ecss request may carry.
+MAX_CREATE_COUNT = 100
+
+
+def split_count(count, batch_size=MAX_CREATE_COUNT):
+    """ Split count into batch sizes no larger than batch_size. """
+    count = int(count)
+    return [min(batch_size, count - i) for i in range(0, count, batch_size)]
+
+
+def _submit(api, spec, count, tracer=None):
+    data = copy.deepcopy(spec)
+    data["server"]["count"] = count
+    start = time.time()
+    try:
+        j_content = api.create_ecss(data)
+    except Exception as e:
+        return count, None, e
+    if "job_id" not in j_content:
+        return count, None, j_content
+    if tracer:
+        tracer.submitted(j_content["job_id"], count, start, time.time())
+    return count, j_content["job_id"], None
+
+
+def job_server_ids(j_content):
+    """ Return the IDs of the servers a finished creation job created successfully. """
+    sub_jobs = (j_content.get("entities") or {}).get("sub_jobs") or []
+    return [sub_job["entities"]["server_id"] for sub_job in sub_jobs
+            if sub_job.get("status") == "SUCCESS" and (sub_job.get("entities") or {}).get("server_id")]
+
+
+def bulk_create(api, spec=None, count=1, parallel=4, batch_size=MAX_CREATE_COUNT, retries=2, wait=True,
+                tracer=None):
+    """ Create count ECSs from spec (the create_ecss request body) by splitting the request
+    into batches of at most batch_size and submitting up to `parallel` of them at once.
+
+    With wait the creation jobs are followed until they finish and servers whose
+    sub-job failed, like batches whose submission failed, are requested again up to
+    `retries` times. Jobs that time out are not resubmitted, since their servers may
+    still appear. Returns {'job_ids', 'server_ids', 'failed'}.
+
+    A tracing.ProvisionTracer given as tracer records the submit and job phases. """
+    if spec is None:
+        spec = api.default_server_spec()
+    result = {"job_ids": [], "server_ids": [], "failed": 0}
+    remaining = int(count)
+    unknown = 0
+    pool = ThreadPool(parallel)
+    try:
+        for attempt in range(retries + 1):
+            if not remaining:
+                break
+            if attempt:
+                logging.info("Resubmitting %d ECSs (attempt %d)" % (remaining, attempt + 1))
+            batches = split_count(remaining, batch_size)
+            remaining = 0
+            submitted = {}
+            waiter = JobWaiter(api, workers=parallel, on_status=tracer and tracer.job_status)
+            for n, job_id, error in pool.imap_unordered(lambda n: _submit(api, spec, n, tracer), batches):
+                if job_id is None:
+                    logging.error("Submitting %d ECSs failed: %s" % (n, error))
+                    remaining += n
+                    continue
+                result["job_ids"].append(job_id)
+                submitted[job_id] = n
+                waiter.add(job_id)
+            if not wait:
+                continue
+            for job_id, j_content in waiter.wait():
+                server_ids = job_server_ids(j_content)
+                result["server_ids"].extend(server_ids)
+                missing = submitted[job_id] - len(server_ids)
+                if j_content.get("status") in ("SUCCESS", "FAIL"):
+                    remaining += missing
+                else:
+                    logging.error("Job %s did not finish: %s" % (job_id, j_content.get("status")))
+                    unknown += missing
+    finally:
+        pool.terminate()
+    result["failed"] = remaining + unknown
+    return result
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from fileutil import file_lock, load_json, atomic_write_json
+from functools import wraps
+import threading
+import logging
+import atexit
+import copy
+import time
+import os
+
+cache_file = os.path.expanduser('~') + '/.ecs_cache'
+
+# Seconds each kind of metadata is served from the cache.
+DEFAULT_TTLS = {
+    'flavors': 24 * 3600,
+    'images': 3600,
+    'availability_zones': 24 * 3600,
+    'vpcs': 3600,
+    'subnets': 3600,
+    'security_groups': 600,
+}
+
+
+class MetadataCache(object):
+    """ TTL and LRU bounded cache for rarely changing metadata listings.
+
+    Entries live in memory and are persisted to `path` between CLI invocations, by
+    save() at exit (and after each command in the agent). With `enabled` off the cache
+    is bypassed entirely; with `refresh` on lookups always miss but fresh results are
+    still stored. """
+
+    def __init__(self, path=cache_file, ttls=None, max_entries=256):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.enabled = True
+        self.refresh = False
+        self.entries = None
+        self.dirty = False
+        # expiry of the entries invalidated since the last save, by key
+        self.removed = {}
+        self.lock = threading.Lock()
+        self.registered = False
+
+    def _ensure_loaded(self):
+        if self.entries is None:
+            self.entries = OrderedDict()
+            now = time.time()
+            j_entries = load_json(self.path, [])
+            for key, expires, value in sorted(j_entries, key=lambda entry: entry[1]):
+                if expires > now:
+                    self.entries[key] = (expires, value)
+
+    def _changed(self):
+        self.dirty = True
+        if not self.registered:
+            self.registered = True
+            atexit.register(self.save)
+
+    def _merge(self, j_entries):
+        """ Merge the entries saved by other processes since we loaded the file: the entry
+        expiring last wins, and those we invalidated stay dropped. Theirs go at the least
+        recently used end. """
+        now = time.time()
+        merged = OrderedDict()
+        for key, expires, value in sorted(j_entries, key=lambda entry: entry[1]):
+            if expires > now and self.removed.get(key) != expires and key not in self.entries:
+                merged[key] = (expires, value)
+        for key, (expires, value) in self.entries.items():
+            merged[key] = (expires, value)
+        for key, expires, value in j_entries:
+            if key in self.entries and expires > self.entries[key][0]:
+                merged[key] = (expires, value)
+        while len(merged) > self.max_entries:
+            merged.popitem(last=False)
+        self.entries = merged
+
+    def save(self):
+        """ Persist the entries if they changed since they were loaded or last saved,
+        merged with those other processes saved meanwhile. """
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            try:
+                with file_lock(self.path):
+                    self._merge(load_json(self.path, []))
+                    atomic_write_json(self.path, [[k, e, v] for k, (e, v) in self.entries.items()])
+                self.removed = {}
+            except (IOError, OSError) as e:
+                logging.debug("Unable to persist metadata cache: %s" % e)
+
+    def get(self, key):
+        """ Return the cached value of key, or None when it is missing or expired. """
+        if not self.enabled or self.refresh:
+            return None
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                return None
+            self.entries[key] = entry
+            return entry[1]
+
+    def put(self, resource, key, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._ensure_loaded()
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttls.get(resource, 600), value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._changed()
+
+    def invalidate(self, resource=None):
+        """ Drop every entry of a resource type, or the whole cache when resource is None. """
+        with self.lock:
+            self._ensure_loaded()
+            for key in list(self.entries):
+                if resource is None or key.split('|', 1)[0] == resource:
+                    self.removed[key] = self.entries.pop(key)[0]
+            self._changed()
+
+
+metadata_cache = MetadataCache()
+
+
+def cached(resource):
+    """ Serve an ECSApi listing method from metadata_cache. The cache key covers the
+    endpoint, the project and the call arguments. Callers get their own copy of the
+    value, so changing it does not change the cache. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = '|'.join([resource, self.base_url, self.project_id] + [str(arg) for arg in args] +
+                           ['%s=%s' % item for item in sorted(kwargs.items())])
+            value = metadata_cache.get(key)
+            if value is None:
+                value = func(self, *args, **kwargs)
+                metadata_cache.put(resource, key, value)
+            else:
+                logging.debug("Serving %s from metadata cache" % resource)
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
@@ -0,0 +1,206 @@
+""" Merge single-server start/stop/restart/delete calls from many threads into batched
+cloudservers/action and cloudservers/delete requests.
+
+    coalescer = ActionCoalescer(api)
+    result = coalescer.stop(server_id)     # from any number of worker threads
+    result.get()                           # the {"job_id": ...} of the shared batch job
+"""
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from jobs import wait_jobs
+import threading
+import logging
+import time
+
+ACTIONS = {
+    'start': 'start_ecss',
+    'stop': 'stop_ecss',
+    'restart': 'restart_ecss',
+    'delete': 'delete_ecss',
+}
+
+# Servers per batched call; the batch operation APIs accept up to 1000.
+MAX_BATCH = 1000
+
+
+class ActionResult(object):
+    """ Handed to each caller of ActionCoalescer.submit(). It has the interface of
+    multiprocessing's AsyncResult and resolves to the response of the batched call
+    (or, with wait, to the final status of its job) shared by every server in the batch. """
+
+    def __init__(self, action, server_id):
+        self.action = action
+        self.server_id = server_id
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def _set(self, value, error=None):
+        self._value = value
+        self._error = error
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError("%s of %s has not completed" % (self.action, self.server_id))
+        return self._error is None
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    @property
+    def job_id(self):
+        """ The ID of the shared job, once the batched call has been made. """
+        return self.get().get('job_id')
+
+
+class ActionCoalescer(object):
+    """ Collects action requests for `window` seconds after the first one of a kind
+    arrives, or until `max_batch` servers are queued, then issues a single batched call
+    per action. A server queued twice for the same action in one window is sent once.
+
+    With wait every result resolves only once the shared job reaches SUCCESS or FAIL,
+    and the job is polled once for the whole batch. """
+
+    def __init__(self, api, window=0.05, max_batch=MAX_BATCH, wait=False, workers=4):
+        self.api = api
+        self.window = window
+        self.max_batch = max_batch
+        self.wait = wait
+        self.requests = 0
+        self.calls = 0
+        self.pending = {}
+        self.closed = False
+        self.cond = threading.Condition()
+        # Batched calls (and job waits) run here so that one slow call does not hold
+        # back the dispatch of the other actions.
+        self.pool = ThreadPool(workers)
+        self.thread = threading.Thread(target=self._run, name='ecs-coalescer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, action, server_id):
+        """ Queue action ('start', 'stop', 'restart' or 'delete') for server_id and return
+        an ActionResult. """
+        return self.submit_many(action, [server_id])[0]
+
+    def submit_many(self, action, server_ids):
+        """ Queue action for every one of server_ids at once and return their ActionResults.
+        Full batches are sent right away, the rest at the end of the window. """
+        if action not in ACTIONS:
+            raise ValueError("Unknown action '%s', use one of: %s" % (action, ', '.join(sorted(ACTIONS))))
+        results = [ActionResult(action, server_id) for server_id in server_ids]
+        with self.cond:
+            if self.closed:
+                raise ValueError("ActionCoalescer is closed")
+            for result in results:
+                if action not in self.pending:
+                    self.pending[action] = (time.time() + self.window, OrderedDict())
+                servers = self.pending[action][1]
+                servers.setdefault(result.server_id, []).append(result)
+                self.requests += 1
+                if len(servers) >= self.max_batch:
+                    self._dispatch(action)
+            self.cond.notify()
+        return results
+
+    def start(self, server_id):
+        return self.submit('start', server_id)
+
+    def stop(self, server_id):
+        return self.submit('stop', server_id)
+
+    def restart(self, server_id):
+        return self.submit('restart', server_id)
+
+    def delete(self, server_id):
+        return self.submit('delete', server_id)
+
+    def _dispatch(self, action):
+        # called with self.cond held
+        _, servers = self.pending.pop(action)
+        self.calls += 1
+        self.pool.apply_async(self._call, (action, servers))
+
+    def _call(self, action, servers):
+        logging.debug("Sending %s for %d servers in one call" % (action, len(servers)))
+        j_content, error = None, None
+        try:
+            j_content = getattr(self.api, ACTIONS[action])(list(servers))
+            if self.wait and 'job_id' in j_content:
+                j_content = wait_jobs(self.api, [j_content['job_id']])[j_content['job_id']]
+        except Exception as e:
+            error = e
+        for results in servers.values():
+            for result in results:
+                result._set(j_content, error)
+
+    def _run(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                for action, (deadline, _) in list(self.pending.items()):
+                    if deadline <= now or self.closed:
+                        self._dispatch(action)
+                if self.closed:
+                    return
+                if self.pending:
+                    self.cond.wait(max(min(deadline for deadline, _ in self.pending.values()) - now, 0.001))
+                else:
+                    self.cond.wait()
+
+    def flush(self):
+        """ Send everything queued now instead of at the end of its window. """
+        with self.cond:
+            for action in list(self.pending):
+                self._dispatch(action)
+
+    def close(self):
+        """ Send what is still queued and wait for all batched calls to complete. """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def batch_action(api, action, server_ids, coalescer=None, wait=False):
+    """ Make action on server_ids with as few calls as MAX_BATCH allows and return
+    {server_id: ActionResult}. A running coalescer shares the calls with the other threads
+    using it; otherwise a coalescer is made for the call (with wait, see ActionCoalescer). """
+    if coalescer is not None:
+        return OrderedDict(zip(server_ids, coalescer.submit_many(action, server_ids)))
+    with ActionCoalescer(api, wait=wait) as coalescer:
+        results = coalescer.submit_many(action, server_ids)
+        coalescer.flush()
+    return OrderedDict(zip(server_ids, results))
+
+
+def responses(results):
+    """ The distinct responses of the batched calls behind {server_id: ActionResult}, in
+    order; raises the error of a failed call. """
+    distinct = OrderedDict()
+    for result in results.values():
+        value = result.get()
+        distinct.setdefault(id(value), value)
+    return distinct.values()
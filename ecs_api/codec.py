@@ -0,0 +1,74 @@
+""" JSON codec used for request bodies and responses.
+
+Responses are parsed straight from the raw body bytes, which skips requests' charset
+detection and unicode decoding of the whole body. The fastest installed library is
+used (orjson, ujson, simplejson, then the standard json module); set ECS_JSON_CODEC
+to one of those names to force a choice. """
+
+import json
+import os
+
+
+def _stdlib():
+    return 'json', json.loads, lambda obj: json.dumps(obj, separators=(',', ':'))
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj):
+        data = orjson.dumps(obj)
+        return data if isinstance(data, str) else data.decode('utf-8')
+    return 'orjson', orjson.loads, dumps
+
+
+def _ujson():
+    import ujson
+    return 'ujson', ujson.loads, lambda obj: ujson.dumps(obj, escape_forward_slashes=False)
+
+
+def _simplejson():
+    import simplejson
+    return 'simplejson', simplejson.loads, lambda obj: simplejson.dumps(obj, separators=(',', ':'))
+
+
+CODECS = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'simplejson': _simplejson,
+    'json': _stdlib,
+}
+
+PREFERENCE = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def available():
+    """ Names of the codecs that can be loaded here, fastest first. """
+    names = []
+    for name in PREFERENCE:
+        try:
+            CODECS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def load_codec(name=None):
+    """ Return (name, loads, dumps) for the requested or the fastest available codec. """
+    for candidate in (name,) if name else PREFERENCE:
+        try:
+            return CODECS[candidate]()
+        except ImportError:
+            if name:
+                raise
+    return _stdlib()
+
+
+name, loads, dumps = load_codec(os.environ.get('ECS_JSON_CODEC'))
+
+
+def use(codec_name):
+    """ Switch the module-wide codec, e.g. for benchmarking. """
+    global name, loads, dumps
+    name, loads, dumps = load_codec(codec_name)
@@ -1,4 +1,6 @@
-from ecs_api import ECSApi
+from ecs import get_api, local_path
+from bulk import bulk_create
+import getopt
 import json
 import sys
 
@@ -39,27 +41,79 @@ json_spec = {
 
 
 def ecs_create(json_ecs):
-    j_content = ECSApi().create_ecss(json_ecs)
+    j_content = get_api().create_ecss(json_ecs)
     if "job_id" not in j_content:
         print("Error")
     else:
         print(json.dumps(j_content, indent=4, sort_keys=True))
 
 
+def ecs_bulk_create(json_ecs, count, parallel):
+    j_content = bulk_create(get_api(), json_ecs, count, parallel)
+    print(json.dumps(j_content, indent=4, sort_keys=True))
+    if j_content["failed"]:
+        print("Error: %d instances were not created" % j_content["failed"])
+
+
+def ecs_traced_create(json_ecs, count, parallel, json_path, chrome_path):
+    from tracing import ProvisionTracer
+    api = get_api()
+    tracer = ProvisionTracer()
+    j_content = bulk_create(api, json_ecs, count, parallel, tracer=tracer)
+    spec = json_ecs["server"]
+    pending = tracer.follow(api, wait_eip="publicip" in spec, name=spec.get("name"))
+    if json_path:
+        tracer.write(json_path)
+    if chrome_path:
+        tracer.write_chrome_trace(chrome_path)
+    print(json.dumps(j_content, indent=4, sort_keys=True))
+    print("%-12s %6s %9s %9s %9s" % ("Phase", "Count", "p50 s", "p90 s", "max s"))
+    for phase, stats in tracer.summary().items():
+        print("%-12s %6d %9.1f %9.1f %9.1f" % (phase, stats["count"], stats["p50"], stats["p90"], stats["max"]))
+    if j_content["failed"]:
+        print("Error: %d instances were not created" % j_content["failed"])
+    if pending:
+        print("Error: %d instances did not become ready: %s" % (len(pending), " ".join(pending)))
+
+
 def help():
-    return "spec\t\t\tCreate a example config file\n<ConfigFile>\t\tCreate a instance based on <ConfigFile>"
+    return "spec\t\t\tCreate a example config file\n<ConfigFile>\t\tCreate a instance based on <ConfigFile>\n" \
+           "--count N <ConfigFile>\tCreate N instances in batches, waiting for all of them\n" \
+           "--parallel P\t\tWith --count or --trace, submit up to P batches at once (default 4)\n" \
+           "--trace FILE\t\tWait until the instances are ACTIVE (with their EIP) and write\n" \
+           "\t\t\tthe provisioning timeline of each one to FILE as JSON\n" \
+           "--chrome-trace FILE\tWrite the timelines as a Chrome trace (chrome://tracing)"
 
 
 def main(argv=sys.argv):
-    if len(argv) != 2:
+    try:
+        opts, args = getopt.getopt(argv[1:], '', ['count=', 'parallel=', 'trace=', 'chrome-trace='])
+    except getopt.GetoptError as e:
+        print("Error: %s" % e)
+        return 1
+    opts = dict(opts)
+    if len(args) != 1:
         print("Error: ecs create requires 1 argument")
-    if argv[1] == 'spec':
-        with open('ecs_json', 'w') as fp:
+        return 1
+    if '--parallel' in opts and not set(opts) & set(['--count', '--trace', '--chrome-trace']):
+        # a single create request has nothing to run in parallel
+        print("Error: --parallel requires --count, --trace or --chrome-trace")
+        return 1
+    if args[0] == 'spec':
+        with open(local_path('ecs_json'), 'w') as fp:
             json.dump(json_spec, fp, indent=4)
     else:
-        with open(argv[1], 'r') as fp:
+        with open(local_path(args[0]), 'r') as fp:
             json_ecs = json.load(fp)
-        ecs_create(json_ecs)
+        if '--trace' in opts or '--chrome-trace' in opts:
+            count = int(opts.get('--count', json_ecs["server"].get("count", 1)))
+            ecs_traced_create(json_ecs, count, int(opts.get('--parallel', 4)),
+                              opts.get('--trace') and local_path(opts['--trace']),
+                              opts.get('--chrome-trace') and local_path(opts['--chrome-trace']))
+        elif '--count' in opts:
+            ecs_bulk_create(json_ecs, int(opts['--count']), int(opts.get('--parallel', 4)))
+        else:
+            ecs_create(json_ecs)
 
 
 if __name__ == '__main__':
@@ -1,21 +1,47 @@
 #!/usr/bin/env python
 
-from ecs_api import ECSApi
+# Only light modules are imported here. ecs_api (and with it requests/urllib3) and the
+# other helpers are imported by the commands that need them, so that 'ecs help', typos
+# and commands forwarded to the agent do not pay for the HTTP stack.
+from errors import ECSError, ECSHTTPError
+from functools import partial
+from output import FORMATS
 from textwrap import wrap
 import traceback
+import threading
+import atexit
 import logging
 import json
+import time
 import sys
+import os
 
 USAGE_HELP = "Usage: ecs <subcommand> [args]\n\n" \
-             "Control, list, and manipulate ECS instances.\n"
+             "Control, list, and manipulate ECS instances.\n\n" \
+             "Global options:\n" \
+             "  --no-cache             Bypass the flavor/image/VPC/subnet/AZ/SG metadata cache\n" \
+             "  --refresh              Ignore cached metadata and store fresh results\n" \
+             "  --stats                Print per-endpoint request statistics to stderr at exit\n" \
+             "  --stats-file <File>    Write request statistics to <File> at exit, Prometheus text\n" \
+             "                         for *.prom files and JSON otherwise\n\n" \
+             "Environment:\n" \
+             "  ECS_PROJECT, ECS_DOMAIN, ECS_USERNAME, ECS_PASSWORD  Credentials used instead of prompting\n" \
+             "  ECS_PROJECTS           Comma separated projects queried by multi-list\n" \
+             "  ECS_ENDPOINT           Override the ECS endpoint URL\n" \
+             "  ECS_TIMEOUT            Connect[,read] timeout of requests in seconds (default 10,120)\n" \
+             "  ECS_NO_AGENT           Do not forward commands to a running agent\n" \
+             "  ECS_STATS_FILE         Same as --stats-file\n"
 
 SUBCOMMAND_HELP = {
-    'create': ('<ConfigFile>|spec',
+    'create': ('[--count N [--parallel P]] [--trace FILE] [--chrome-trace FILE] <ConfigFile>|spec',
                'Create an ECS instance based on <ConfigFile>.'),
+    'apply': ('[--plan] [--parallel P] <FleetFile>',
+              'Create, delete, resize and extend the ECSs named in <FleetFile> until they match it.'),
     'delete': ('<ServerID> [<ServerID>] [<ServerID>...]',
                'Delete EVS instances.'),
     'help': ('', 'Display this message.'),
+    'agent': ('start|run|stop|status',
+              'Manage a resident agent that runs ecs commands with a warm session.'),
     'list': ('', 'List all ECS instances.'),
     'info': ('<InstanceName>', 'Get information about an/all ECS instance(s).'),
     'start': ('<ServerID> [<ServerID>] [<ServerID>...]',
@@ -36,54 +62,173 @@ SUBCOMMAND_HELP = {
     'keypair-list': ('', 'Get information about ECS ssh-keypair.'),
     'projects': ('', 'Getting list of projects accessible to users.'),
     'project-info': ('<ProjectName>', 'Query information about project.'),
-    'task-status': ('<JobID>', 'Get the execution status of task.'),
+    'task-status': ('[--wait] <JobID> [<JobID>...]', 'Get the execution status of task.'),
+    'wait': ('[--port N|--no-probe] [--fixed-ip] [--timeout S] <ServerID> [<ServerID>...]',
+             'Wait until ECSs are ACTIVE and accept SSH connections, printing each one as soon as '
+             'it is ready.'),
     'block-attach': ('<ServerID> <VolumeID> <DevicePATH>',
                      'Attach a disk to an ECS.'),
     'block-detach': ('<ServerID> <VolumeID>',
                      'Detach an EVS disk from an ECS.'),
-    'block-list': ('<ServerID>',
-                   'List virtual block devices attached to an ECS.'),
+    'block-list': ('--all | <ServerID> [<ServerID>...]',
+                   'List virtual block devices attached to ECSs.'),
     'network-attach': ('<ServerID> <count>, <subnet_id>, <security_group_id>',
                        'Add one or multiple NICs to an ECS.'),
     'network-detach': ('<ServerID> <nic_ids>',
                        'Delete one or multiple NICs from an ECS.'),
-    'network-list': ('<ServerID>',
-                     'List virtual network interfaces attached to an ECS.'),
+    'network-list': ('--all | <ServerID> [<ServerID>...]',
+                     'List virtual network interfaces attached to ECSs.'),
     'evs-create': ('<name>, <size>, <vol_type>, [<count>]',
                    'Create one or multiple Elastic Volume Service (EVS) disks.'),
     'evs-delete': ('<VolumeID>', 'Delete an EVS disk.'),
     'evs-list': ('', 'List all EVS disks.'),
+    'multi-list': ('servers|volumes|eips|quotas [--projects <Project>[,<Project>...]]',
+                   'List resources of several regions/projects at once, tagged by region.'),
+    'pool': ('define|remove|status|lease|release|maintain [args]',
+             'Manage warm pools of pre-provisioned ECSs: ecs pool define <Name> <ConfigFile>|default '
+             '--size N [--stopped] [--rebuild], remove <Name>, status, lease <Name> [--wait S], '
+             'release <ServerID> [--rebuild], maintain [<Name>].'),
+    'sync': ('[--full]', 'Refresh the local inventory index of servers, volumes, NICs and EIPs.'),
+    'query': ('servers|volumes|nics|eips [<filter>=<pattern>...]',
+              'Look up resources in the local inventory index, e.g. '
+              'ecs query servers name=avocado_cloud* status=SHUTOFF az=cn-east-2a volume_type=SSD'),
 }
 
+# Set by the resident agent so that subcommands reuse its authenticated ECSApi, and
+# batch the start/stop/restart/delete calls of concurrent commands together.
+shared_api = None
+shared_coalescer = None
+
+# Working directory and environment of the command run by the current thread. The agent
+# sets them to those of the client that forwarded the command; None means our own.
+# main() records the subcommand name given on the command line in it too.
+command_context = threading.local()
+
+
+def subcommand():
+    """ The subcommand name of the command run by the current thread, as typed. """
+    return getattr(command_context, 'command', None)
+
+
+def getenv(name, default=None):
+    env = getattr(command_context, 'env', None)
+    return (os.environ if env is None else env).get(name, default)
+
+
+def local_path(path):
+    """ path resolved against the working directory of the command. """
+    cwd = getattr(command_context, 'cwd', None)
+    path = os.path.expanduser(path)
+    return os.path.join(cwd, path) if cwd else path
+
+
+def get_api():
+    if shared_api:
+        return shared_api
+    from ecs_api import ECSApi
+    return ECSApi()
+
+
+OUTPUT_OPTION = ('-o', '--output', 'Output format: table, ndjson, csv or json')
+
 SUBCOMMAND_OPTIONS = {
     'list': (
         ('-l', '--long', 'Output all VM details'),
         ('', '--label', 'Include security labels'),
+        OUTPUT_OPTION,
+    ),
+    'task-status': (
+        ('-w', '--wait', 'Wait for all tasks to finish, printing each one as it completes'),
+    ),
+    'wait': (
+        ('', '--port', 'TCP port probed on each ECS (default 22)'),
+        ('', '--no-probe', 'Only wait for the ACTIVE status and an address'),
+        ('', '--fixed-ip', 'Probe the private IP instead of the EIP'),
+        ('', '--timeout', 'Seconds to wait before giving up (default 1800)'),
+        ('', '--interval', 'Seconds between status polls (default 5)'),
+        ('-o', '--output', 'Output format: ndjson (default), table, csv or json'),
+    ),
+    'block-list': (
+        ('-a', '--all', 'List the disks of all ECSs, querying them concurrently'),
+        OUTPUT_OPTION,
+    ),
+    'network-list': (
+        ('-a', '--all', 'List the NICs of all ECSs, querying them concurrently'),
+        OUTPUT_OPTION,
+    ),
+    'multi-list': (
+        ('-p', '--projects', 'Comma separated projects (regions) to query, by default $ECS_PROJECTS'),
+        OUTPUT_OPTION,
+    ),
+    'pool': (
+        ('', '--size', 'define: number of idle ECSs the pool keeps'),
+        ('', '--stopped', 'define: keep the idle ECSs stopped and start them when leased'),
+        ('', '--rebuild', 'define/release: replace released ECSs instead of restarting or stopping them'),
+        ('', '--wait', 'lease: seconds to wait for a ready ECS (default 0)'),
+        OUTPUT_OPTION,
+    ),
+    'sync': (
+        ('', '--full', 'List all servers again instead of only those changed since the last sync'),
     ),
 }
 
+for c in ['info', 'flavors', 'images', 'vpcs', 'subnets', 'eips', 'security-groups', 'availability-zones',
+          'keypair-list', 'projects', 'project-info', 'evs-list', 'query']:
+    SUBCOMMAND_OPTIONS[c] = (OUTPUT_OPTION,)
+
+
+def output_format(args, default='table'):
+    """ Remove --output/-o <format> from args and return the requested format. """
+    fmt = default
+    for output_arg in ['--output', '-o']:
+        while output_arg in args:
+            i = args.index(output_arg)
+            if i + 1 >= len(args):
+                logging.error("'%s' requires one of: %s\n" % (output_arg, ', '.join(FORMATS)))
+                usage(subcommand())
+            fmt = args[i + 1]
+            del args[i:i + 2]
+    if fmt not in FORMATS:
+        logging.error("Unknown output format '%s', use one of: %s\n" % (fmt, ', '.join(FORMATS)))
+        usage(subcommand())
+    return fmt
+
+
+def emit(records, fmt, columns, empty_msg):
+    """ Write records as they arrive; empty_msg is shown when there are none,
+    except in the machine readable formats. """
+    from output import make_writer
+    writer = make_writer(fmt, sys.stdout, columns)
+    writer.writerows(records)
+    writer.close()
+    if not writer.count and fmt in ('table', 'json'):
+        print(empty_msg)
+
+
+def server_action(action, server_ids):
+    """ Print the response of each batched call making action on server_ids. Calls take up
+    to 1000 servers; under the agent they are shared with the concurrent commands. """
+    from coalesce import batch_action, responses
+    for j_content in responses(batch_action(get_api(), action, server_ids, shared_coalescer)):
+        if "job_id" not in j_content:
+            print("Error")
+        else:
+            print(json.dumps(j_content, indent=4, sort_keys=True))
+
 
 def ecs_delete(args):
     arg_check(args, 1)
-    j_content = ECSApi().delete_ecss(args)
-    if "job_id" not in j_content:
-        print("Error")
-    else:
-        print(json.dumps(j_content, indent=4, sort_keys=True))
+    server_action('delete', args)
 
 
 def ecs_restart(args):
     arg_check(args, 1)
-    j_content = ECSApi().restart_ecss(args)
-    if "job_id" not in j_content:
-        print("Error")
-    else:
-        print(json.dumps(j_content, indent=4, sort_keys=True))
+    server_action('restart', args)
 
 
 def ecs_rename(args):
     arg_check(args, 2, 2)
-    j_content = ECSApi().modify_ecs_info(args[0], args[1])
+    j_content = get_api().modify_ecs_info(args[0], args[1])
     if 'server' not in j_content:
         print("No server")
     else:
@@ -92,25 +237,17 @@ def ecs_rename(args):
 
 def ecs_stop(args):
     arg_check(args, 1)
-    j_content = ECSApi().stop_ecss(args)
-    if "job_id" not in j_content:
-        print("Error")
-    else:
-        print(json.dumps(j_content, indent=4, sort_keys=True))
+    server_action('stop', args)
 
 
 def ecs_start(args):
     arg_check(args, 1)
-    j_content = ECSApi().start_ecss(args)
-    if "job_id" not in j_content:
-        print("Error")
-    else:
-        print(json.dumps(j_content, indent=4, sort_keys=True))
+    server_action('start', args)
 
 
 def ecs_resize(args):
     arg_check(args, 2, 2)
-    j_content = ECSApi().resize_ecs(args[0], args[1])
+    j_content = get_api().resize_ecs(args[0], args[1])
     if "job_id" not in j_content:
         print("Error")
     else:
@@ -118,132 +255,138 @@ def ecs_resize(args):
 
 
 def ecs_list(args):
-    j_content = ECSApi().query_ecs()
-    if len(j_content['servers']) == 0:
-        print("No servers")
-    else:
-        print '%-36s\t%s' % ("ID", "Name")
-        for server in j_content['servers']:
-            print '%-36s\t%s' % (server["id"].encode('ascii', 'ignore'), server["name"].encode('ascii', 'ignore'))
+    fmt = output_format(args)
+    api = get_api()
+    emit(api.iter_servers(name=api.vm_name, detail=False, prefetch_next=True), fmt,
+         [("ID", "id"), ("Name", "name")], "No servers")
 
 
 def ecs_info(args):
-    j_content = ECSApi().query_ecs_detail()
-    if len(j_content['servers']) == 0:
-        print("No servers")
-    else:
-        for server in j_content['servers']:
-            print(json.dumps(server, indent=4, sort_keys=True))
+    fmt = output_format(args, 'json')
+    api = get_api()
+    emit(api.iter_servers(name=api.vm_name, stream=True), fmt,
+         [("ID", "id"), ("Name", "name"), ("Status", "status"), ("Flavor", "flavor.id"),
+          ("AZ", "OS-EXT-AZ:availability_zone"), ("Created", "created")], "No servers")
 
 
 def ecs_flavors(args):
-    j_content = ECSApi().list_flavors()
-    if len(j_content['flavors']) == 0:
-        print("No flavors")
-    else:
-        print '%-12s\t%-12s' % ("ID", "Name")
-        for flavor in j_content['flavors']:
-            print '%-12s\t%-12s' % (flavor['id'], flavor['name'])
+    fmt = output_format(args)
+    j_content = get_api().list_flavors()
+    emit(j_content['flavors'], fmt, [("ID", "id"), ("Name", "name")], "No flavors")
 
 
 def ecs_images(args):
-    j_content = ECSApi().query_images()
-    if len(j_content['images']) == 0:
-        print("No images")
-    else:
-        print '%-36s\t%-36s\t%-36s\t%-20s' % ("ID", "Name", "OS Version", "Created_date")
-        for image in j_content['images']:
-            print '%-36s\t%-36s\t%-36s\t%-20s' % \
-                  (image['id'], image['name'], image['__os_version'], image['created_at'])
+    fmt = output_format(args)
+    emit(get_api().iter_images(prefetch_next=True), fmt,
+         [("ID", "id"), ("Name", "name"), ("OS Version", "__os_version"), ("Created_date", "created_at")],
+         "No images")
 
 
 def ecs_vpcs(args):
-    j_content = ECSApi().query_vpcs()
-    if len(j_content['vpcs']) == 0:
-        print("No vpcs")
-    else:
-        print '%-36s\t%-20s\t%-10s' % ("ID", "Name", "CIDR")
-        for vpc in j_content['vpcs']:
-            print '%-36s\t%-20s\t%-10s' % (vpc['id'], vpc['name'], vpc['cidr'])
+    fmt = output_format(args)
+    j_content = get_api().query_vpcs()
+    emit(j_content['vpcs'], fmt, [("ID", "id"), ("Name", "name"), ("CIDR", "cidr")], "No vpcs")
 
 
 def ecs_subnets(args):
+    fmt = output_format(args)
     arg_check(args, 1, 1)
-    j_content = ECSApi().query_subnets(args[0])
-    if len(j_content['subnets']) == 0:
-        print("No subnets")
-    else:
-        print '%-36s\t%-20s\t%-10s' % ("ID", "Name", "CIDR")
-        for subnet in j_content['subnets']:
-            print '%-36s\t%-20s\t%-10s' % (subnet['id'], subnet['name'], subnet['cidr'])
+    j_content = get_api().query_subnets(args[0])
+    emit(j_content['subnets'], fmt, [("ID", "id"), ("Name", "name"), ("CIDR", "cidr")], "No subnets")
 
 
 def ecs_eips(args):
-    j_content = ECSApi().query_eips()
-    if len(j_content['publicips']) == 0:
-        print("No publicips")
-    else:
-        print '%-36s\t%-15s\t%-10s' % ("ID", "Public IP Address", "Status")
-        for publicip in j_content['publicips']:
-            print '%-36s\t%-15s\t%-10s' % (publicip['id'], publicip['public_ip_address'], publicip['status'])
+    fmt = output_format(args)
+    emit(get_api().iter_publicips(prefetch_next=True), fmt,
+         [("ID", "id"), ("Public IP Address", "public_ip_address"), ("Status", "status")], "No publicips")
 
 
 def ecs_security_groups(args):
-    j_content = ECSApi().query_security_groups()
-    if len(j_content['security_groups']) == 0:
-        print("No security_groups")
-    else:
-        for security_group in j_content['security_groups']:
-            print(json.dumps(security_group, indent=4, sort_keys=True))
+    fmt = output_format(args, 'json')
+    j_content = get_api().query_security_groups()
+    emit(j_content['security_groups'], fmt, [("ID", "id"), ("Name", "name"), ("VPC", "vpc_id")],
+         "No security_groups")
 
 
 def ecs_availability_zones(args):
-    j_content = ECSApi().query_availability_zones()
-    if len(j_content['availabilityZoneInfo']) == 0:
-        print("No availability zones")
-    else:
-        for availabilityzone in j_content['availabilityZoneInfo']:
-            print(availabilityzone['zoneName'])
+    fmt = output_format(args)
+    j_content = get_api().query_availability_zones()
+    emit(j_content['availabilityZoneInfo'], fmt, [("Name", "zoneName"), ("Available", "zoneState.available")],
+         "No availability zones")
 
 
 def ecs_keypair_list(args):
-    j_content = ECSApi().query_ssh_keypairs()
-    if len(j_content['keypairs']) == 0:
-        print("No keypairs")
-    else:
-        for keypair in j_content['keypairs']:
-            print(keypair["keypair"]["name"])
+    fmt = output_format(args)
+    j_content = get_api().query_ssh_keypairs()
+    emit(j_content['keypairs'], fmt, [("Name", "keypair.name"), ("Fingerprint", "keypair.fingerprint")],
+         "No keypairs")
 
 
 def ecs_projects(args):
-    j_content = ECSApi().query_projects()
-    if len(j_content['projects']) == 0:
-        print("No projects")
-    else:
-        for project in j_content['projects']:
-            print(json.dumps(project, indent=4, sort_keys=True))
+    fmt = output_format(args, 'json')
+    j_content = get_api().query_projects()
+    emit(j_content['projects'], fmt, [("ID", "id"), ("Name", "name"), ("Enabled", "enabled")], "No projects")
 
 
 def ecs_project_info(args):
+    fmt = output_format(args)
     arg_check(args, 1, 1)
-    j_content = ECSApi().query_project_info(args[0])
-    if len(j_content['projects']) == 0:
-        print("No projects")
-    else:
-        print '%-32s\t%s' % ("ID", "Name")
-        for project in j_content['projects']:
-            print '%-32s\t%s' % (project['id'], project['name'])
+    j_content = get_api().query_project_info(args[0])
+    emit(j_content['projects'], fmt, [("ID", "id"), ("Name", "name")], "No projects")
 
 
 def task_status(args):
-    arg_check(args, 1, 1)
-    j_content = ECSApi().query_task_status(args[0])
-    print(json.dumps(j_content, indent=4, sort_keys=True))
+    wait = False
+    for wait_arg in ['--wait', '-w']:
+        if wait_arg in args:
+            args.remove(wait_arg)
+            wait = True
+    if not wait:
+        arg_check(args, 1, 1)
+        j_content = get_api().query_task_status(args[0])
+        print(json.dumps(j_content, indent=4, sort_keys=True))
+        return
+    arg_check(args, 1)
+    from jobs import JobWaiter
+    waiter = JobWaiter(get_api())
+    for job_id in args:
+        waiter.add(job_id)
+    for job_id, j_content in waiter.wait():
+        print(json.dumps(j_content, indent=4, sort_keys=True))
+        sys.stdout.flush()
+
+
+def ecs_wait(args):
+    import getopt
+    fmt = output_format(args, 'ndjson')
+    try:
+        opts, args = getopt.getopt(args, '', ['port=', 'no-probe', 'fixed-ip', 'timeout=', 'interval='])
+    except getopt.GetoptError as e:
+        logging.error("%s\n" % e)
+        usage(subcommand())
+    opts = dict(opts)
+    arg_check(args, 1)
+    from readiness import ReadinessWaiter
+    waiter = ReadinessWaiter(get_api(), port=None if '--no-probe' in opts else int(opts.get('--port', 22)),
+                             floating='--fixed-ip' not in opts, timeout=float(opts.get('--timeout', 1800)),
+                             interval=float(opts.get('--interval', 5)))
+    failed = []
+
+    def records():
+        for server_id, result in waiter.wait(args):
+            if result['status'] != 'READY':
+                failed.append(server_id)
+            yield dict(result, id=server_id)
+    emit(records(), fmt, [("ID", "id"), ("Status", "status"), ("Address", "address"),
+                          ("Elapsed", "elapsed")], "No ECSs")
+    if failed:
+        logging.error("%d ECSs did not become ready: %s" % (len(failed), ' '.join(failed)))
+        sys.exit(1)
 
 
 def ecs_block_attach(args):
     arg_check(args, 3, 3)
-    j_content = ECSApi().attach_volume(*args)
+    j_content = get_api().attach_volume(*args)
     if "job_id" not in j_content:
         print("Error")
     else:
@@ -252,24 +395,47 @@ def ecs_block_attach(args):
 
 def ecs_block_detach(args):
     arg_check(args, 2, 2)
-    ECSApi().detach_volume(*args)
+    get_api().detach_volume(*args)
+
+
+def server_ids_arg(args):
+    """ The server IDs of a per-server command: the arguments, or every ECS with --all/-a. """
+    for all_arg in ['--all', '-a']:
+        if all_arg in args:
+            args.remove(all_arg)
+            arg_check(args, 0, 0)
+            return [server['id'] for server in get_api().iter_servers(detail=False, prefetch_next=True)]
+    arg_check(args, 1)
+    return args
+
+
+def emit_many(query, key, fmt, columns, empty_msg, server_ids):
+    """ Run a *_many query and emit the records of every server tagged with its ID;
+    servers whose query failed are reported at the end. """
+    results, errors = query(server_ids)
+    records = (dict(record, server_id=server_id)
+               for server_id, j_content in results.items() for record in j_content[key])
+    emit(records, fmt, [("Server", "server_id")] + columns, empty_msg)
+    for server_id, error in errors.items():
+        logging.error("%s: %s" % (server_id, error))
+    if errors:
+        sys.exit(1)
 
 
 def ecs_block_list(args):
-    arg_check(args, 1, 1)
-    j_content = ECSApi().query_volumes(args[0])
-    if len(j_content['volumeAttachments']) == 0:
-        print("No volumes")
-    else:
-        print '%-3s\t%-36s\t%-15s' % ("No.", "ID", "Device")
-        for i, volume in enumerate(j_content['volumeAttachments']):
-            print '%3s\t%-36s\t%-15s' % \
-                  (str(i), volume["id"], volume["device"])
+    fmt = output_format(args)
+    server_ids = server_ids_arg(args)
+    if len(args) == 1:
+        j_content = get_api().query_volumes(args[0])
+        emit(j_content['volumeAttachments'], fmt, [("No.", "#"), ("ID", "id"), ("Device", "device")], "No volumes")
+        return
+    emit_many(get_api().query_volumes_many, 'volumeAttachments', fmt,
+              [("ID", "id"), ("Device", "device")], "No volumes", server_ids)
 
 
 def ecs_network_attach(args):
     arg_check(args, 4, 4)
-    j_content = ECSApi().add_nics(*args)
+    j_content = get_api().add_nics(*args)
     if "job_id" not in j_content:
         print("Error")
     else:
@@ -278,28 +444,29 @@ def ecs_network_attach(args):
 
 def ecs_network_detach(args):
     arg_check(args, 2)
-    j_content = ECSApi().delete_nics(args[0], args[1:])
+    j_content = get_api().delete_nics(args[0], args[1:])
     if "job_id" not in j_content:
         print("Error")
     else:
         print(json.dumps(j_content, indent=4, sort_keys=True))
 
 
+# The same paths work on the Interface models and on the raw os-interface records.
+NIC_COLUMNS = [("ID", "port_id"), ("IP Address", "fixed_ips.0.ip_address"), ("State", "port_state")]
+
+
 def ecs_network_list(args):
-    arg_check(args, 1, 1)
-    j_content = ECSApi().query_nics(args[0])
-    if len(j_content['interfaceAttachments']) == 0:
-        print("No NICs")
-    else:
-        print '%-3s\t%-36s\t%-15s\t%-10s' % ("No.", "ID", "IP Address", "State")
-        for i, nic in enumerate(j_content['interfaceAttachments']):
-            print '%3s\t%-36s\t%-15s\t%-10s' % \
-                  (str(i), nic["port_id"], nic["fixed_ips"][0]["ip_address"], nic["port_state"])
+    fmt = output_format(args)
+    server_ids = server_ids_arg(args)
+    if len(args) == 1:
+        emit(get_api().query_nics(args[0], models=True), fmt, [("No.", "#")] + NIC_COLUMNS, "No NICs")
+        return
+    emit_many(get_api().query_nics_many, 'interfaceAttachments', fmt, NIC_COLUMNS, "No NICs", server_ids)
 
 
 def ecs_evs_create(args):
     arg_check(args, 3, 4)
-    j_content = ECSApi().create_evss(*args)
+    j_content = get_api().create_evss(*args)
     if "job_id" not in j_content:
         print("Error")
     else:
@@ -308,25 +475,179 @@ def ecs_evs_create(args):
 
 def ecs_evs_delete(args):
     arg_check(args, 1, 1)
-    j_content = ECSApi().delete_evs(args[0])
+    j_content = get_api().delete_evs(args[0])
     print(json.dumps(j_content, indent=4, sort_keys=True))
 
 
 def ecs_evs_list(args):
-    j_content = ECSApi().query_evss()
-    if len(j_content['volumes']) == 0:
-        print("No EVSs")
-    else:
-        print '%-36s\t%-40s\t%-5s\t%-10s\t%-10s\t%-10s' % ("ID", "Name", "Size", "Type", "AZ", "Status")
-        for volume in j_content['volumes']:
-            print '%-36s\t%-40s\t%-5s\t%-10s\t%-10s\t%-10s' % \
-                  (volume["id"], volume["name"], volume["size"], volume["volume_type"], volume["availability_zone"],
-                   volume["status"])
+    fmt = output_format(args)
+    emit(get_api().iter_volumes(stream=True), fmt,
+         [("ID", "id"), ("Name", "name"), ("Size", "size"), ("Type", "volume_type"),
+          ("AZ", "availability_zone"), ("Status", "status")], "No EVSs")
+
+
+MULTI_LIST = {
+    'servers': ('servers', [("Region", "region"), ("ID", "id"), ("Name", "name"), ("Status", "status"),
+                            ("Flavor", "flavor.id"), ("AZ", "OS-EXT-AZ:availability_zone")]),
+    'volumes': ('volumes', [("Region", "region"), ("ID", "id"), ("Name", "name"), ("Size", "size"),
+                            ("Type", "volume_type"), ("AZ", "availability_zone"), ("Status", "status")]),
+    'eips': ('publicips', [("Region", "region"), ("ID", "id"), ("Public IP Address", "public_ip_address"),
+                           ("Status", "status")]),
+    'quotas': ('quotas', [("Region", "region"), ("Project", "project"), ("Instances", "totalInstancesUsed"),
+                          ("Max Instances", "maxTotalInstances"), ("Cores", "totalCoresUsed"),
+                          ("Max Cores", "maxTotalCores"), ("RAM", "totalRAMUsed"), ("Max RAM", "maxTotalRAMSize")]),
+}
+
+
+def ecs_multi_list(args):
+    fmt = output_format(args)
+    projects = getenv('ECS_PROJECTS', '')
+    for projects_arg in ['--projects', '-p']:
+        while projects_arg in args:
+            i = args.index(projects_arg)
+            if i + 1 >= len(args):
+                logging.error("'%s' requires a list of projects\n" % projects_arg)
+                usage(subcommand())
+            projects = args[i + 1]
+            del args[i:i + 2]
+    arg_check(args, 1, 1)
+    if args[0] not in MULTI_LIST:
+        logging.error("Unknown resource '%s', use one of: %s\n" % (args[0], ', '.join(sorted(MULTI_LIST))))
+        usage(subcommand())
+    projects = [project for project in projects.split(',') if project]
+    if not projects:
+        logging.error("No projects given, use --projects or ECS_PROJECTS\n")
+        usage(subcommand())
+    method, columns = MULTI_LIST[args[0]]
+    from multi_api import MultiScopeApi
+    # under the agent, reuse its credentials instead of prompting for them
+    credentials = shared_api and shared_api.identity[2:] or ()
+    with MultiScopeApi(projects, *credentials) as api:
+        records, errors = getattr(api, method)()
+    emit(records, fmt, columns, "No %s" % args[0])
+    for project, error in errors.items():
+        logging.error("%s: %s" % (project, error))
+    if errors:
+        sys.exit(1)
+
+
+def ecs_sync(args):
+    full = '--full' in args
+    if full:
+        args.remove('--full')
+    arg_check(args, 0, 0)
+    from inventory import Inventory
+    inventory = Inventory()
+    try:
+        counts = inventory.sync(get_api(), full=full)
+    finally:
+        inventory.close()
+    print(json.dumps(counts, indent=4, sort_keys=True))
+
+
+def ecs_query(args):
+    fmt = output_format(args)
+    arg_check(args, 1)
+    from inventory import Inventory, RESOURCES, STALE_AFTER
+    resource = args[0]
+    if resource not in RESOURCES:
+        logging.error("Unknown resource '%s', use one of: %s\n" % (resource, ', '.join(sorted(RESOURCES))))
+        usage(subcommand())
+    filters = {}
+    for arg in args[1:]:
+        if '=' not in arg:
+            logging.error("Filters are given as <filter>=<pattern>, got '%s'\n" % arg)
+            usage(subcommand())
+        name, pattern = arg.split('=', 1)
+        filters[name] = pattern
+    inventory = Inventory()
+    try:
+        synced_at = inventory.synced_at()
+        if synced_at is None:
+            sys.stderr.write("Inventory has not been synced yet, run 'ecs sync'\n")
+        else:
+            age = time.time() - synced_at
+            sys.stderr.write("Inventory synced %d min ago%s\n" %
+                             (age // 60, age > STALE_AFTER and " (stale, run 'ecs sync')" or ""))
+        try:
+            records = inventory.query(resource, filters)
+            emit(records, fmt, RESOURCES[resource][1], "No %s" % resource)
+        except ValueError as e:
+            logging.error("%s\n" % e)
+            usage(subcommand())
+    finally:
+        inventory.close()
+
+
+def ecs_pool(args):
+    import getopt
+    fmt = output_format(args)
+    try:
+        opts, args = getopt.gnu_getopt(args, '', ['size=', 'stopped', 'rebuild', 'wait='])
+    except getopt.GetoptError as e:
+        logging.error("%s\n" % e)
+        usage(subcommand())
+    opts = dict(opts)
+    arg_check(args, 1)
+    action, args = args[0], args[1:]
+    from warmpool import WarmPool
+    pool = WarmPool(get_api())
+
+    def maintain_later():
+        # the agent lives on, a CLI process hands the work to a detached child
+        if shared_api:
+            pool.replenish_async()
+        else:
+            pool.maintain_in_background()
+
+    try:
+        if action == 'define':
+            arg_check(args, 2, 2)
+            if '--size' not in opts:
+                logging.error("'ecs pool define' requires --size\n")
+                usage(subcommand())
+            if args[1] == 'default':
+                spec = pool.api.default_server_spec()
+            else:
+                with open(local_path(args[1]), 'r') as fp:
+                    spec = json.load(fp)
+            pool.define(args[0], spec, int(opts['--size']), '--stopped' in opts and 'stopped' or 'running',
+                        '--rebuild' in opts and 'rebuild' or 'reuse')
+            maintain_later()
+        elif action == 'remove':
+            arg_check(args, 1, 1)
+            print(json.dumps({'deleted': pool.remove(args[0])}, indent=4, sort_keys=True))
+        elif action == 'status':
+            arg_check(args, 0, 0)
+            emit(pool.status(), fmt, [("Name", "name"), ("Size", "size"), ("Mode", "mode"), ("Recycle", "recycle"),
+                                      ("Ready", "ready"), ("Leased", "leased"), ("Creating", "creating"),
+                                      ("Recycling", "recycling"), ("Released", "released")], "No pools")
+        elif action == 'lease':
+            arg_check(args, 1, 1)
+            try:
+                server = pool.lease(args[0], timeout=float(opts.get('--wait', 0)))
+            finally:
+                maintain_later()
+            print(json.dumps(server, indent=4, sort_keys=True))
+        elif action == 'release':
+            arg_check(args, 1)
+            for server_id in args:
+                pool.release(server_id, rebuild='--rebuild' in opts)
+            maintain_later()
+        elif action == 'maintain':
+            arg_check(args, 0, 1)
+            print(json.dumps(pool.maintain(args and args[0] or None), indent=4, sort_keys=True))
+        else:
+            logging.error("Unknown pool action '%s'\n" % action)
+            usage(subcommand())
+    except (ValueError, LookupError) as e:
+        logging.error(str(e))
+        sys.exit(1)
 
 
 def ecs_importcommand(command, args):
     cmd = __import__(command, globals(), locals(), 'ecs_api')
-    cmd.main([command] + args)
+    return cmd.main([command] + args)
 
 
 commands = {
@@ -351,6 +672,7 @@ commands = {
     "projects": ecs_projects,
     "project-info": ecs_project_info,
     "task-status": task_status,
+    "wait": ecs_wait,
     # block
     "block-attach": ecs_block_attach,
     "block-detach": ecs_block_detach,
@@ -363,14 +685,21 @@ commands = {
     "evs-create": ecs_evs_create,
     "evs-delete": ecs_evs_delete,
     "evs-list": ecs_evs_list,
+    "multi-list": ecs_multi_list,
+    "pool": ecs_pool,
+    # inventory
+    "sync": ecs_sync,
+    "query": ecs_query,
 }
 
 IMPORTED_COMMANDS = [
     'create',
+    'apply',
+    'agent',
 ]
 
 for c in IMPORTED_COMMANDS:
-    commands[c] = eval('lambda args: ecs_importcommand("%s", args)' % c)
+    commands[c] = partial(ecs_importcommand, c)
 
 
 def cmd_help(cmd):
@@ -453,16 +782,16 @@ def arg_check(args, lo, hi=-1):
 
     if hi == -1:
         if n < lo:
-            logging.error("'ecs %s' requires at least %d argument%s.\n" % (sys.argv[1], lo, lo == 1 and ' ' or 's'))
-            usage(sys.argv[1])
+            logging.error("'ecs %s' requires at least %d argument%s.\n" % (subcommand(), lo, lo == 1 and ' ' or 's'))
+            usage(subcommand())
     elif lo == hi:
         if n != lo:
-            logging.error("'ecs %s' requires %d argument%s.\n" % (sys.argv[1], lo, lo == 1 and ' ' or 's'))
-            usage(sys.argv[1])
+            logging.error("'ecs %s' requires %d argument%s.\n" % (subcommand(), lo, lo == 1 and ' ' or 's'))
+            usage(subcommand())
     else:
         if n < lo or n > hi:
-            logging.error("'ecs %s' requires between %d and %d arguments.\n" % (sys.argv[1], lo, hi))
-            usage(sys.argv[1])
+            logging.error("'ecs %s' requires between %d and %d arguments.\n" % (subcommand(), lo, hi))
+            usage(subcommand())
 
 
 def ecs_lookup_cmd(cmd):
@@ -484,10 +813,70 @@ def ecs_lookup_cmd(cmd):
         usage()
 
 
+def long_running(argv):
+    """ Whether the command line waits for servers or jobs, printing as it goes. The agent
+    returns the output of a command at its end, so these are not forwarded to it. """
+    names = [c for c in commands if c == argv[1]] or [c for c in commands if c.startswith(argv[1])]
+    cmd, args = len(names) == 1 and names[0] or argv[1], argv[2:]
+    if cmd == 'wait':
+        return True
+    if cmd == 'task-status':
+        return '--wait' in args or '-w' in args
+    if cmd == 'pool':
+        return 'lease' in args or 'maintain' in args
+    if cmd == 'create':
+        return 'spec' not in args
+    if cmd == 'apply':
+        return '--plan' not in args
+    return False
+
+
+def stats_options(argv):
+    """ Remove --stats and --stats-file <File> from argv and arrange for the request
+    statistics to be reported at exit. Returns whether statistics were requested. """
+    show = '--stats' in argv[1:]
+    while '--stats' in argv:
+        argv.remove('--stats')
+    path = getenv('ECS_STATS_FILE')
+    while '--stats-file' in argv:
+        i = argv.index('--stats-file')
+        if i + 1 >= len(argv):
+            logging.error("'--stats-file' requires a file name\n")
+            usage()
+        path = local_path(argv[i + 1])
+        del argv[i:i + 2]
+    if not show and not path:
+        return False
+
+    def report():
+        from metrics import metrics
+        if show:
+            sys.stderr.write(metrics.summary() + '\n')
+        if path:
+            metrics.write(path)
+    atexit.register(report)
+    return True
+
+
 def main(argv=sys.argv):
     if len(argv) < 2:
         usage()
 
+    # intercept --stats and --stats-file; the requests must be made here to be measured
+    stats = stats_options(argv)
+    if len(argv) < 2:
+        usage()
+
+    # hand the command over to a running agent, unless we are the agent; the cache switches
+    # are process-wide in the agent, so commands using them run here, as do the long running
+    # ones whose output would only be seen at their end
+    if shared_api is None and not stats and argv[1] not in ('agent', 'help') and not os.environ.get('ECS_NO_AGENT') \
+            and '--no-cache' not in argv and '--refresh' not in argv and not long_running(argv):
+        from agent import forward
+        rc = forward(argv[1:])
+        if rc is not None:
+            sys.exit(rc)
+
     logging.basicConfig(level=logging.ERROR, format='%(asctime)s %(levelname)s %(message)s')
 
     # intercept --debug(-d) and output debug log
@@ -497,6 +886,18 @@ def main(argv=sys.argv):
                 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
                 logging.debug("Running in debug mode")
 
+    # intercept metadata cache switches
+    if '--no-cache' in argv[1:]:
+        from cache import metadata_cache
+        argv.remove('--no-cache')
+        metadata_cache.enabled = False
+    if '--refresh' in argv[1:]:
+        from cache import metadata_cache
+        argv.remove('--refresh')
+        metadata_cache.refresh = True
+    if len(argv) < 2:
+        usage()
+
     # intercept --help(-h) and output our own help
     for help_arg in ['--help', '-h']:
         if help_arg in argv[1:]:
@@ -507,6 +908,7 @@ def main(argv=sys.argv):
             sys.exit(0)
 
     cmd = ecs_lookup_cmd(argv[1])
+    command_context.command = argv[1]
 
     # strip off prog name and subcmd
     args = argv[2:]
@@ -514,7 +916,10 @@ def main(argv=sys.argv):
         try:
             rc = cmd(args)
             if rc:
-                usage()
+                sys.exit(rc)
+        except ECSError as e:
+            logging.error(str(e))
+            sys.exit(isinstance(e, ECSHTTPError) and e.status_code or 1)
         except Exception:
             logging.error(traceback.format_exc())
             sys.exit(1)
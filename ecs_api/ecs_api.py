@@ -1,9 +1,23 @@
-import json
 import logging
 from requests.compat import urljoin
-from datetime import datetime, timedelta
 import requests
+from Queue import Queue, Full
+from multiprocessing.pool import ThreadPool
+from tokens import TokenCache
+from pool import get_session, pool_manager
+from cache import cached
+from ratelimit import rate_limiter, endpoint_class, parse_retry_after
+from errors import ECSConnectionError, error_for_response
+from metrics import metrics
+from streaming import iter_array
+from models import Server, Volume, Interface, Flavor, Image
+import codec
+from collections import OrderedDict
+import threading
 import getpass
+import random
+import time
+import sys
 import os
 
 # Disable HTTPS verification warnings.
@@ -17,27 +31,144 @@ else:
 
 token_file = os.path.expanduser('~') + '/.ecs_token'
 
+# Default page size used by the iter_* generators.
+PAGE_LIMIT = 200
+
+# Attempts made for throttled responses and, on retriable requests, for network errors.
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Seconds to wait for a connection and between bytes of a response; ECS_TIMEOUT overrides
+# them as <connect>[,<read>].
+TIMEOUT = (10, 120)
+
+# Concurrent requests made by the *_many per-server queries.
+FANOUT_WORKERS = 16
+
+
+def backoff(attempt):
+    """ Jittered exponential delay before retry number attempt. """
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.5)
+
+
+def body_size(data):
+    return len(data) if isinstance(data, basestring) else 0
+
+
+def request_timeout():
+    """ The (connect, read) timeout of requests, TIMEOUT unless ECS_TIMEOUT is set. """
+    value = os.environ.get('ECS_TIMEOUT')
+    if not value:
+        return TIMEOUT
+    try:
+        seconds = [float(part) for part in value.split(',')]
+    except ValueError:
+        logging.warning("Ignoring ECS_TIMEOUT=%s, expected <connect>[,<read>] seconds" % value)
+        return TIMEOUT
+    return seconds[0], seconds[-1] if len(seconds) > 1 else TIMEOUT[1]
+
+
+def send_request(s, method, url, retry=False, **kwargs):
+    """ Send a request through the rate limiter of its endpoint class.
+
+    429 responses, and 503 responses when retry is set, are retried after the
+    Retry-After delay, which also holds back every other caller of that endpoint
+    class. Network errors and timeouts are retried with jittered backoff only when
+    retry is set, i.e. for idempotent requests, except connect timeouts, for which
+    nothing was sent. """
+    endpoint = endpoint_class(method, url)
+    kwargs.setdefault('timeout', request_timeout())
+    for attempt in range(MAX_ATTEMPTS):
+        last = attempt == MAX_ATTEMPTS - 1
+        rate_limiter.acquire(endpoint)
+        metrics.start_attempt()
+        start = time.time()
+        try:
+            r = s.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            retriable = retry or isinstance(e, requests.exceptions.ConnectTimeout)
+            metrics.record(method, url, 'error', body_size(kwargs.get('data')), total=time.time() - start,
+                           retry=retriable and not last)
+            if not retriable or last:
+                raise ECSConnectionError("connection to %s failed: %s" % (url, e))
+            delay = backoff(attempt)
+            logging.warning("connection to %s %s, retrying in %.1fs" %
+                            (url, isinstance(e, requests.exceptions.Timeout) and "timed out" or "failed", delay))
+            time.sleep(delay)
+            continue
+        throttled = not last and (r.status_code == 429 or (r.status_code == 503 and retry))
+        metrics.record(method, url, r.status_code, body_size(kwargs.get('data')),
+                       0 if kwargs.get('stream') else r.raw.tell() or len(r.content),
+                       r.elapsed.total_seconds(), time.time() - start, throttled)
+        if throttled:
+            delay = parse_retry_after(r.headers.get('Retry-After'), backoff(attempt))
+            logging.warning("%s throttled with %s, retrying in %.1fs" % (url, r.status_code, delay))
+            rate_limiter.penalize(endpoint, delay)
+            r.close()
+            continue
+        return r
+
+
+def prefetch(iterable, poll=0.1):
+    """ Consume iterable in a background thread, keeping one item ready ahead of the caller.
+    Once the caller stops iterating, the thread stops too and closes iterable. """
+    queue = Queue(maxsize=1)
+    stop = threading.Event()
+
+    def put(entry):
+        # a full queue may never be read again, so check for the caller every poll seconds
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=poll)
+                return True
+            except Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException:
+            put((None, sys.exc_info()))
+            return
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        put((StopIteration, None))
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if item is StopIteration:
+                return
+            yield item
+    finally:
+        stop.set()
+
 
 def get_token(base_url, project_name, domain_name, username, password):
     token_uri = "/v3/auth/tokens"
     auth_url = urljoin(base_url, token_uri)
-    if os.path.isfile(token_file):
-        with open(token_file, 'r') as fp:
-            j_token = json.load(fp)
-        expire_date = datetime.strptime(j_token['expires_at'], '%Y-%m-%dT%H:%M:%S.%fZ') + timedelta(hours=8)
-        now = datetime.now()
-        if now > expire_date:
-            token, project_id = ecs_get_token(auth_url, project_name, domain_name, username, password)
-        else:
-            token = j_token['token']
-            project_id = j_token['project_id']
-    else:
-        token, project_id = ecs_get_token(auth_url, project_name, domain_name, username, password)
-    return token, project_id
+    j_token = token_cache.get(auth_url, project_name, domain_name, username, password)
+    return j_token['token'], j_token['project_id']
 
 
 def ecs_get_token(auth_url, project_name, domain_name, username, password):
-    s = requests.Session()
+    """ Request a new token from IAM, bypassing and then updating the token cache. """
+    j_token = token_cache.get(auth_url, project_name, domain_name, username, password, force=True)
+    return j_token['token'], j_token['project_id']
+
+
+def request_token(auth_url, project_name, domain_name, username, password):
+    s = get_session()
     data = {
         "auth": {
             "identity": {
@@ -63,93 +194,150 @@ def ecs_get_token(auth_url, project_name, domain_name, username, password):
     }
     logging.info("Request for token")
     headers = {'Content-Type': 'application/json;charset=utf8'}
-    r = s.post(auth_url, json=data, headers=headers)
+    r = send_request(s, 'POST', auth_url, retry=True, data=codec.dumps(data), headers=headers)
     if r.status_code != 201:
-        logging.error("%s %s." % (r.status_code, r.text))
-        exit(r.status_code)
-    j_content = json.loads(r.text)
+        raise error_for_response(r)
+    j_content = codec.loads(r.content)
     token = r.headers['X-Subject-Token']
     project_id = j_content['token']['project']['id']
     j_token = {'token': token, 'expires_at': j_content['token']['expires_at'],
                'project_id': project_id}
-    with open(token_file, 'w') as fp:
-        json.dump(j_token, fp)
-    return token, project_id
+    return j_token
+
+
+token_cache = TokenCache(token_file, request_token)
 
 
 def validate_token(token, auth_url):
     logging.info("Validate token")
-    s = requests.Session()
+    s = get_session()
     headers = {'Content-Type': 'application/json;charset=utf8', 'X-Auth-Token': token, 'X-Subject-Token': token}
-    r = s.get(auth_url, headers=headers)
+    r = send_request(s, 'GET', auth_url, retry=True, headers=headers)
     if r.status_code != 200:
-        logging.error("%s %s." % (r.status_code, r.text))
-        exit(r.status_code)
-    j_content = json.loads(r.text)
+        raise error_for_response(r)
+    j_content = codec.loads(r.content)
     print(j_content['token']['expires_at'])
 
 
 class ECSSession(object):
     def __init__(self, auth_url, project_name, domain_name, username, password):
-        self.s = requests.Session()
+        # The session and its connection pool are shared process-wide, so per-instance
+        # headers such as the token are sent with each request instead of set on it.
+        self.s = get_session()
         self.headers = {'Content-Type': 'application/json;charset=utf8'}
+        self.identity = (urljoin(auth_url, "/v3/auth/tokens"), project_name, domain_name, username, password)
         self.token, self.project_id = get_token(auth_url, project_name, domain_name, username, password)
         self.headers['X-Auth-Token'] = self.token
-        self.s.headers.update(self.headers)
-        self.r = None
-
-    def get(self, url):
+        # The last response is kept per thread so one session can be shared by concurrent callers.
+        self._local = threading.local()
+
+    @property
+    def r(self):
+        return getattr(self._local, 'r', None)
+
+    @r.setter
+    def r(self, value):
+        self._local.r = value
+
+    def _set_token(self, j_token):
+        if j_token['token'] != self.token:
+            self.token = j_token['token']
+            headers = dict(self.headers)
+            headers['X-Auth-Token'] = self.token
+            self.headers = headers
+
+    def _send(self, method, url, retry, headers=None, **kwargs):
+        """ Send a request with the current token; if it is rejected with 401,
+        re-authenticate and retry once. """
+        self._set_token(token_cache.get(*self.identity))
+        r = send_request(self.s, method, url, retry, headers=dict(headers or {}, **self.headers), **kwargs)
+        if r.status_code == 401:
+            logging.info("Token rejected, re-authenticating")
+            r.close()
+            self._set_token(token_cache.get(*self.identity, force=True))
+            r = send_request(self.s, method, url, retry, headers=dict(headers or {}, **self.headers), **kwargs)
+        return r
+
+    def get(self, url, retry=True):
         logging.debug("Making api get call to %s" % url)
-        try:
-            self.r = self.s.get(url, headers=self.headers)
-        except requests.exceptions.RequestException:
-            logging.error("connection to ecs failed")
+        self.r = self._send('GET', url, retry)
         # convert response to json
         return self.__json()
 
-    def post(self, url, data):
+    def post(self, url, data, retry=False):
         logging.debug("Making api post call to %s" % url)
-        try:
-            self.r = self.s.post(url, json=data, headers=self.headers)
-        except requests.exceptions.RequestException:
-            logging.error("connection to ecs failed")
+        self.r = self._send('POST', url, retry, data=codec.dumps(data))
         # convert response to json
         return self.__json()
 
-    def put(self, url, data):
+    def put(self, url, data, retry=False):
         logging.debug("Making api put call to %s" % url)
-        try:
-            self.r = self.s.put(url, json=data, headers=self.headers)
-        except requests.exceptions.RequestException:
-            logging.error("connection to ecs failed")
+        self.r = self._send('PUT', url, retry, data=codec.dumps(data))
         # convert response to json
         return self.__json()
 
-    def delete(self, url):
+    def delete(self, url, retry=True):
         logging.debug("Making api delete call to %s" % url)
+        self.r = self._send('DELETE', url, retry)
+
+    def stream(self, url, key, chunk_size=65536):
+        """ GET a listing and yield the elements of its top-level array `key` while the
+        (gzip compressed) body is still downloading, never holding the whole response. """
+        logging.debug("Making streaming api get call to %s" % url)
+        headers = dict(self.headers)
+        headers['Accept-Encoding'] = 'gzip'
+        self.r = r = self._send('GET', url, True, stream=True, headers=headers)
+        if r.status_code != 200:
+            raise error_for_response(r)
         try:
-            self.r = self.s.delete(url, headers=self.headers)
-        except requests.exceptions.RequestException:
-            logging.error("connection to ecs failed")
+            for item in iter_array(r.iter_content(chunk_size), key):
+                yield item
+        finally:
+            metrics.add_bytes_in('GET', url, r.raw.tell())
+            r.close()
 
     def __json(self):
         try:
-            json_obj = json.loads(self.r.text)
+            json_obj = codec.loads(self.r.content)
             return json_obj
         except ValueError:
             logging.error("Unable to convert string to json\n %s" % self.r.text)
 
 
-class ECSApi(ECSSession):
-    def __init__(self):
-
-        # Huawei connection credentials
+def prompt_credentials(project_name=None, domain_name=None, username=None, password=None):
+    """ Ask for the Huawei connection credentials that were not given as arguments
+    or in the ECS_PROJECT, ECS_DOMAIN, ECS_USERNAME and ECS_PASSWORD environment variables. """
+    project_name = project_name or os.environ.get('ECS_PROJECT')
+    domain_name = domain_name or os.environ.get('ECS_DOMAIN')
+    username = username or os.environ.get('ECS_USERNAME')
+    password = password or os.environ.get('ECS_PASSWORD')
+    if project_name is None:
         project_name = raw_input("Project name [%s]: " % "cn-east-2") or "cn-east-2"
-        self.base_url = "https://ecs.%s.myhuaweicloud.com/" % project_name
-        auth_url = self.base_url.replace("ecs", "iam", 1)
+    if domain_name is None:
         domain_name = raw_input("Domain name [%s]: " % "chris-new") or "chris-new"
+    if username is None:
         username = raw_input("Username [%s]: " % "rht-wshi") or "rht-wshi"
+    if password is None:
         password = getpass.getpass('Password:')
+    return project_name, domain_name, username, password
+
+
+def endpoint_url(project_name, env=os.environ):
+    """ The ECS endpoint of a project: ECS_ENDPOINT, or the public one of its region. """
+    return env.get('ECS_ENDPOINT') or "https://ecs.%s.myhuaweicloud.com/" % project_name.split('_')[0]
+
+
+class ECSApi(ECSSession):
+    def __init__(self, project_name=None, domain_name=None, username=None, password=None):
+
+        # Huawei connection credentials, prompted for when not given
+        project_name, domain_name, username, password = \
+            prompt_credentials(project_name, domain_name, username, password)
+        # Projects are named after their region, sub-projects as <region>_<name>.
+        self.project_name = project_name
+        self.region = project_name.split('_')[0]
+        self.base_url = endpoint_url(project_name)
+        auth_url = self.base_url.replace("ecs", "iam", 1)
 
         # VM creation parameters
         self.keypair = "wshi"
@@ -163,7 +351,10 @@ class ECSApi(ECSSession):
 
         super(ECSApi, self).__init__(auth_url, project_name, domain_name, username, password)
 
-    def make_request(self, endpoint, action, data=None):
+    def make_request(self, endpoint, action, data=None, retry=None):
+        """ Call the endpoint and return the decoded response, raising ECSHTTPError
+        (or ECSThrottledError) unless it answered 200. retry overrides whether network
+        errors are retried; by default only GET and DELETE requests are. """
         functions = {
             'get': self.get,
             'post': self.post,
@@ -171,20 +362,89 @@ class ECSApi(ECSSession):
             'delete': self.delete
         }
         func = functions[action]
+        kwargs = {}
+        if retry is not None:
+            kwargs['retry'] = retry
         if data:
-            json_obj = func(endpoint, data=data)
+            json_obj = func(endpoint, data=data, **kwargs)
         else:
-            json_obj = func(endpoint)
+            json_obj = func(endpoint, **kwargs)
         if self.r.status_code != 200:
-            logging.error("%s %s." % (self.r.status_code, self.r.text))
-            exit(self.r.status_code)
+            raise error_for_response(self.r)
         return json_obj
 
-    def create_ecss(self, data=None):
-        """ This interface is used to create one or more ECSs. """
-        logging.info("Create ECSs")
-        endpoint = urljoin(self.base_url, "/v1/%s/cloudservers" % self.project_id)
-        json_ecs = {
+    def iter_pages(self, endpoint, key, limit=PAGE_LIMIT, prefetch_next=False, stream=False):
+        """ Walk a limit/marker paginated listing lazily, yielding the items of each page.
+        With prefetch_next the following page is downloaded while the caller consumes the current one.
+        With stream each page is parsed incrementally as it downloads instead; the two are exclusive,
+        since the next marker is only known once a streamed page has been consumed. """
+        def pages():
+            sep = '&' if '?' in endpoint else '?'
+            marker = None
+            while True:
+                url = "%s%slimit=%d" % (endpoint, sep, limit)
+                if marker:
+                    url += "&marker=%s" % marker
+                if stream:
+                    seen = {'count': 0, 'last': None}
+                    yield counted(self.stream(url, key), seen)
+                    count, last = seen['count'], seen['last']
+                else:
+                    items = self.make_request(url, 'get')[key]
+                    yield items
+                    count, last = len(items), items and items[-1]
+                if count < limit:
+                    return
+                marker = last['id']
+
+        def counted(items, seen):
+            for item in items:
+                seen['count'] += 1
+                seen['last'] = item
+                yield item
+
+        page_iter = prefetch(pages()) if prefetch_next and not stream else pages()
+        try:
+            for items in page_iter:
+                for item in items:
+                    yield item
+        finally:
+            page_iter.close()
+
+    def fan_out(self, func, server_ids, workers=FANOUT_WORKERS):
+        """ Call func(server_id) for every server over a bounded worker pool. Returns
+        (results, errors): dicts keyed by server ID, in the order of server_ids, holding the
+        return value or the exception raised for that server. """
+        server_ids = list(server_ids)
+        workers = max(min(workers, len(server_ids)), 1)
+        if pool_manager.settings['pool_maxsize'] < workers:
+            pool_manager.configure(pool_maxsize=workers)
+
+        def call(server_id):
+            try:
+                return server_id, func(server_id), None
+            except Exception as e:
+                return server_id, None, e
+
+        pool = ThreadPool(workers)
+        try:
+            outcomes = dict((server_id, (value, error)) for server_id, value, error in
+                            pool.imap_unordered(call, server_ids))
+        finally:
+            pool.terminate()
+        results, errors = OrderedDict(), OrderedDict()
+        for server_id in server_ids:
+            value, error = outcomes[server_id]
+            if error is None:
+                results[server_id] = value
+            else:
+                logging.debug("Query for server %s failed: %r" % (server_id, error))
+                errors[server_id] = error
+        return results, errors
+
+    def default_server_spec(self):
+        """ Return the request body create_ecss submits when no data is given. """
+        return {
             "server": {
                 "availability_zone": self.az,
                 "name": self.vm_name,
@@ -228,8 +488,13 @@ class ECSApi(ECSSession):
                 "count": 1
             }
         }
+
+    def create_ecss(self, data=None):
+        """ This interface is used to create one or more ECSs. """
+        logging.info("Create ECSs")
+        endpoint = urljoin(self.base_url, "/v1/%s/cloudservers" % self.project_id)
         if not data:
-            data = json_ecs
+            data = self.default_server_spec()
         return self.make_request(endpoint, 'post', data=data)
 
     def delete_ecss(self, server_ids):
@@ -244,7 +509,7 @@ class ECSApi(ECSSession):
         }
         for server_id in server_ids:
             data["servers"].append({"id": server_id})
-        return self.make_request(endpoint, 'post', data=data)
+        return self.make_request(endpoint, 'post', data=data, retry=True)
 
     def restart_ecss(self, server_ids):
         """ This interface is used to restart ECSs in batches based on specified ECS IDs. """
@@ -272,7 +537,7 @@ class ECSApi(ECSSession):
         }
         for server_id in server_ids:
             data["os-stop"]["servers"].append({"id": server_id})
-        return self.make_request(endpoint, 'post', data=data)
+        return self.make_request(endpoint, 'post', data=data, retry=True)
 
     def start_ecss(self, server_ids):
         """ This interface is used to start ECSs in batches based on specified ECS IDs. """
@@ -286,7 +551,7 @@ class ECSApi(ECSSession):
         }
         for server_id in server_ids:
             data["os-start"]["servers"].append({"id": server_id})
-        return self.make_request(endpoint, 'post', data=data)
+        return self.make_request(endpoint, 'post', data=data, retry=True)
 
     def query_ecs(self):
         """ This interface is used to query ECS. """
@@ -300,6 +565,23 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v2/%s/servers/detail?name=%s" % (self.project_id, self.vm_name))
         return self.make_request(endpoint, 'get')
 
+    def iter_servers(self, name=None, detail=True, limit=PAGE_LIMIT, prefetch_next=False, stream=False,
+                     models=False, changes_since=None):
+        """ Iterate over all ECSs (optionally filtered by name) page by page.
+        With models (and detail) Server objects are yielded instead of dicts. With changes_since
+        (an ISO 8601 time) only servers changed since then are listed, including deleted
+        ones with status DELETED. """
+        endpoint = urljoin(self.base_url, "/v2/%s/servers%s" % (self.project_id, detail and "/detail" or ""))
+        params = []
+        if name:
+            params.append("name=%s" % name)
+        if changes_since:
+            params.append("changes-since=%s" % changes_since)
+        if params:
+            endpoint += "?" + "&".join(params)
+        servers = self.iter_pages(endpoint, 'servers', limit, prefetch_next, stream)
+        return (Server(server) for server in servers) if models else servers
+
     def modify_ecs_info(self, server_id, name):
         """ This interface is used to modify ECS information. Only the name of the ECS can be modified currently. """
         logging.info("Modify the name of the ECS %s" % server_id)
@@ -335,6 +617,7 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v1/%s/jobs/%s" % (self.project_id, job_id))
         return self.make_request(endpoint, 'get')
 
+    @cached('flavors')
     def list_flavors(self):
         """ This interface is used to query available VM flavors. After receiving the request,
         Nova queries the flavor information from the database using the nova-api process. """
@@ -342,6 +625,11 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v2/%s/flavors" % self.project_id)
         return self.make_request(endpoint, 'get')
 
+    def list_flavor_models(self):
+        """ The flavors of list_flavors as Flavor objects. """
+        return [Flavor(flavor) for flavor in self.list_flavors()['flavors']]
+
+    @cached('images')
     def query_images(self):
         """ This interface is used to query images using search criteria and to display the images in a list. """
         logging.info("Getting list of images")
@@ -349,12 +637,21 @@ class ECSApi(ECSSession):
                            "/v2/cloudimages?__imagetype=shared&__platform=RedHat&sort_key=created_at")
         return self.make_request(endpoint, 'get')
 
+    def iter_images(self, limit=PAGE_LIMIT, prefetch_next=False, models=False):
+        """ Iterate over the images returned by query_images page by page. """
+        endpoint = urljoin(self.base_url,
+                           "/v2/cloudimages?__imagetype=shared&__platform=RedHat&sort_key=created_at")
+        images = self.iter_pages(endpoint, 'images', limit, prefetch_next)
+        return (Image(image) for image in images) if models else images
+
+    @cached('vpcs')
     def query_vpcs(self):
         """ This interface is used to query VPCs using search criteria and to display the VPCs in a list. """
         logging.info("Getting list of VPCs")
         endpoint = urljoin(self.base_url, "/v1/%s/vpcs" % self.project_id)
         return self.make_request(endpoint, 'get')
 
+    @cached('subnets')
     def query_subnets(self, vpc_id):
         """ This interface is used to query subnets using search criteria and to display the subnets in a list. """
         logging.info("Getting list of subnets")
@@ -368,6 +665,12 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v1/%s/publicips" % self.project_id)
         return self.make_request(endpoint, 'get')
 
+    def iter_publicips(self, limit=PAGE_LIMIT, prefetch_next=False):
+        """ Iterate over all elastic IP addresses page by page. """
+        endpoint = urljoin(self.base_url, "/v1/%s/publicips" % self.project_id)
+        return self.iter_pages(endpoint, 'publicips', limit, prefetch_next)
+
+    @cached('security_groups')
     def query_security_groups(self):
         """ This interface is used to query security groups using search criteria
         and to display the security groups in a list. """
@@ -375,6 +678,7 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v1/%s/security-groups" % self.project_id)
         return self.make_request(endpoint, 'get')
 
+    @cached('availability_zones')
     def query_availability_zones(self):
         """ This interface is used to query availability zones (AZs). """
         logging.info("Getting list of availability zones")
@@ -393,14 +697,23 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v3/projects?name=%s" % project_name)
         return self.make_request(endpoint, 'get')
 
-    def query_nics(self, server_id):
-        """ This interface is used to query NIC information about ECSs. """
+    def query_nics(self, server_id, models=False):
+        """ This interface is used to query NIC information about ECSs.
+        With models a list of Interface objects is returned instead of the response. """
         logging.info("Getting NIC information about ECSs")
         endpoint = urljoin(self.base_url, "/v2/%s/servers/%s/os-interface" %
                            (self.project_id, server_id))
-        return self.make_request(endpoint, 'get')
+        j_content = self.make_request(endpoint, 'get')
+        if models:
+            return [Interface(nic) for nic in j_content['interfaceAttachments']]
+        return j_content
 
-    def add_nics(self, server_id, count):
+    def query_nics_many(self, server_ids, workers=FANOUT_WORKERS, models=False):
+        """ query_nics for many ECSs concurrently. Returns (results, errors) keyed by server ID,
+        see fan_out. """
+        return self.fan_out(lambda server_id: self.query_nics(server_id, models), server_ids, workers)
+
+    def add_nics(self, server_id, count, subnet_id=None, security_group_ids=None):
         """ This interface is used to add one or multiple NICs to an ECS. """
         logging.info("Add one or multiple NICs to an ECS")
         endpoint = urljoin(self.base_url, "/v1/%s/cloudservers/%s/nics" %
@@ -409,12 +722,8 @@ class ECSApi(ECSSession):
             "nics": []
         }
         nic = {
-            "subnet_id": self.subnet_id,
-            "security_groups": [
-                {
-                    "id": self.sg_id
-                }
-            ]
+            "subnet_id": subnet_id or self.subnet_id,
+            "security_groups": [{"id": sg_id} for sg_id in security_group_ids or [self.sg_id]]
         }
         for i in range(int(count)):
             data["nics"].append(nic)
@@ -430,7 +739,7 @@ class ECSApi(ECSSession):
         }
         for nic_id in nic_ids:
             data["nics"].append({"id": nic_id})
-        return self.make_request(endpoint, 'post', data=data)
+        return self.make_request(endpoint, 'post', data=data, retry=True)
 
     def query_volumes(self, server_id):
         """ This interface is used to query information about the disks attached to an ECS. """
@@ -439,6 +748,11 @@ class ECSApi(ECSSession):
                            (self.project_id, server_id))
         return self.make_request(endpoint, 'get')
 
+    def query_volumes_many(self, server_ids, workers=FANOUT_WORKERS):
+        """ query_volumes for many ECSs concurrently. Returns (results, errors) keyed by server ID,
+        see fan_out. """
+        return self.fan_out(self.query_volumes, server_ids, workers)
+
     def attach_volume(self, server_id, volume_id, device):
         """ This interface is used to attach a disk to an ECS. """
         logging.info("Attach a disk to an ECS")
@@ -459,14 +773,14 @@ class ECSApi(ECSSession):
                            (self.project_id, server_id, volume_id))
         return self.make_request(endpoint, 'delete')
 
-    def create_evss(self, name, size, vol_type, passthrough=False, count=1):
+    def create_evss(self, name, size, vol_type, passthrough=False, count=1, az=None):
         """ This interface is used to create one or multiple Elastic Volume Service (EVS) disks. """
         logging.info("Create one or multiple Elastic Volume Service (EVS) disks")
         endpoint = urljoin(self.base_url, "/v2/%s/cloudvolumes" % self.project_id)
         data = {
             "volume": {
                 "count": count,
-                "availability_zone": self.az,
+                "availability_zone": az or self.az,
                 "size": int(size),
                 "name": name,
                 "volume_type": vol_type,
@@ -488,6 +802,12 @@ class ECSApi(ECSSession):
         endpoint = urljoin(self.base_url, "/v2/%s/cloudvolumes/detail" % self.project_id)
         return self.make_request(endpoint, 'get')
 
+    def iter_volumes(self, limit=PAGE_LIMIT, prefetch_next=False, stream=False, models=False):
+        """ Iterate over details about all EVS disks page by page. """
+        endpoint = urljoin(self.base_url, "/v2/%s/cloudvolumes/detail" % self.project_id)
+        volumes = self.iter_pages(endpoint, 'volumes', limit, prefetch_next, stream)
+        return (Volume(volume) for volume in volumes) if models else volumes
+
     def query_quota(self):
         logging.info("Getting information about the tenant quota")
         endpoint = urljoin(self.base_url, "/v1/%s/cloudservers/limits" % self.project_id)
@@ -0,0 +1,31 @@
+class ECSError(Exception):
+    """ Base class of the errors raised by ECSApi. """
+
+
+class ECSConnectionError(ECSError):
+    """ The endpoint could not be reached, even after retrying. """
+
+
+class ECSHTTPError(ECSError):
+    """ The endpoint answered with an unexpected status code. """
+
+    def __init__(self, status_code, text, url=None):
+        super(ECSHTTPError, self).__init__("%s %s." % (status_code, text))
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+
+class ECSThrottledError(ECSHTTPError):
+    """ The endpoint kept answering 429/503 after all retries. """
+
+    def __init__(self, status_code, text, url=None, retry_after=None):
+        super(ECSThrottledError, self).__init__(status_code, text, url)
+        self.retry_after = retry_after
+
+
+def error_for_response(r):
+    """ Build the exception matching a failed requests.Response. """
+    if r.status_code in (429, 503):
+        return ECSThrottledError(r.status_code, r.text, r.url, r.headers.get('Retry-After'))
+    return ECSHTTPError(r.status_code, r.text, r.url)
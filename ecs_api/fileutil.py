@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+import tempfile
+import fcntl
+import json
+import os
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """ Hold an advisory lock on `path`.lock so concurrent CLI processes do not race. """
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def load_json(path, default=None):
+    """ Read a JSON file, returning default when it is missing or corrupt. """
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def atomic_write_json(path, obj):
+    """ Write obj to path so readers never observe a partially written file. """
+    atomic_write(path, json.dumps(obj))
+
+
+def atomic_write(path, content):
+    """ Write the string content to path so readers never observe a partially written file. """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,224 @@
+""" Declarative fleets: bring the servers named by a create_ecss spec to the spec's count,
+flavor, data volumes and NICs with as few API calls as possible.
+
+    plan = plan_fleet(api, json.load(open('fleet.json')))
+    for step in plan:
+        print(step.describe())
+    results = execute(api, plan, parallel=8)
+
+A fleet file is the JSON accepted by 'ecs create' (see create.json_spec), or a list of
+them. The servers of a spec are those named like spec["server"]["name"], either exactly or
+with the -0001 style suffix added to servers created in batches.
+
+The plan is made of batched calls: one delete_ecss for the surplus and broken servers, as
+few create_ecss and create_evss calls as the batch limits allow, and per server resize_ecs,
+add_nics and attach_volume calls. Steps run in parallel once the steps they depend on
+(the server's previous change, or the creation of the volume to attach) have succeeded. """
+
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+from bulk import split_count, job_server_ids, MAX_CREATE_COUNT
+from jobs import wait_jobs
+import logging
+import copy
+import re
+
+# Servers per delete_ecss call and disks per create_evss call.
+MAX_DELETE = 1000
+MAX_EVS_COUNT = 100
+
+# Servers in these states are replaced instead of repaired.
+BROKEN = ('ERROR',)
+
+
+class Step(object):
+    """ One API call of a plan. func(api, dependency_results) makes the call and returns
+    its result, e.g. the IDs of the created resources. """
+
+    def __init__(self, action, target, detail, func, depends=()):
+        self.id = None
+        self.action = action
+        self.target = target
+        self.detail = detail
+        self.func = func
+        self.depends = list(depends)
+
+    def describe(self):
+        return {'step': self.id, 'action': self.action, 'target': self.target, 'detail': self.detail,
+                'depends': [step.id for step in self.depends]}
+
+
+def _wait(api, j_content):
+    """ Wait for the job of a call, returning the job or raising if it did not succeed. """
+    if 'job_id' not in j_content:
+        raise RuntimeError("no job was created: %s" % j_content)
+    job = wait_jobs(api, [j_content['job_id']])[j_content['job_id']]
+    if job.get('status') != 'SUCCESS':
+        raise RuntimeError("job %s ended with %s: %s" % (job['job_id'], job.get('status'), job.get('fail_reason')))
+    return job
+
+
+def _sub_entities(job, key):
+    return [sub_job['entities'][key] for sub_job in (job.get('entities') or {}).get('sub_jobs') or []
+            if sub_job.get('status') == 'SUCCESS' and (sub_job.get('entities') or {}).get(key)]
+
+
+def fleet_servers(api, name):
+    pattern = re.compile(r'^%s(-\d+)?$' % re.escape(name))
+    return [server for server in api.iter_servers(name=name)
+            if pattern.match(server['name']) and server.get('status') != 'DELETED']
+
+
+def fixed_ip_count(server):
+    return len([address for addresses in (server.get('addresses') or {}).values() for address in addresses
+                if address.get('OS-EXT-IPS:type') == 'fixed'])
+
+
+def _device(index):
+    """ The device name of the index-th disk of a server, /dev/sda being the system disk;
+    like Linux, the 27th one is /dev/sdaa. """
+    letters = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        letters = 'abcdefghijklmnopqrstuvwxyz'[letter] + letters
+    return '/dev/sd' + letters
+
+
+def _diff(server, spec):
+    """ What server lacks compared with spec: (flavor or None, missing data volume specs, NICs to add). """
+    flavor = spec.get('flavorRef')
+    resize = flavor if flavor and server.get('flavor', {}).get('id') != flavor else None
+    data_volumes = spec.get('data_volumes') or []
+    attached = max(len(server.get('os-extended-volumes:volumes_attached') or []) - 1, 0)
+    missing = data_volumes[attached:]
+    nics = max(len(spec.get('nics') or []) - fixed_ip_count(server), 0)
+    return resize, missing, nics
+
+
+def plan_fleet(api, fleet):
+    """ Compare fleet (a spec or list of specs) with the live servers and return the list of
+    Steps that reconciles them; an empty list means there is nothing to do. """
+    steps = []
+    for fleet_spec in isinstance(fleet, list) and fleet or [fleet]:
+        steps.extend(_plan_spec(api, fleet_spec))
+    for i, step in enumerate(steps):
+        step.id = i + 1
+    return steps
+
+
+def _plan_spec(api, fleet_spec):
+    spec = fleet_spec['server']
+    name = spec['name']
+    count = int(spec.get('count', 1))
+    servers = fleet_servers(api, name)
+    broken = [server for server in servers if server.get('status') in BROKEN]
+    healthy = [(server, _diff(server, spec)) for server in servers if server.get('status') not in BROKEN]
+    # keep the servers that need the fewest changes, the oldest first among equals
+    healthy.sort(key=lambda item: (item[1][0] is not None, len(item[1][1]), item[1][2], item[0].get('created')))
+    keep, surplus = healthy[:count], [server for server, _ in healthy[count:]]
+
+    steps = []
+    doomed = [server['id'] for server in broken + surplus]
+    for i in range(0, len(doomed), MAX_DELETE):
+        batch = doomed[i:i + MAX_DELETE]
+        steps.append(Step('delete_ecss', name, {'servers': batch},
+                          lambda api, deps, batch=batch: _wait(api, api.delete_ecss(batch)) and batch))
+
+    for n in split_count(count - len(keep), MAX_CREATE_COUNT) if count > len(keep) else []:
+        data = copy.deepcopy(fleet_spec)
+        data['server']['count'] = n
+        steps.append(Step('create_ecss', name, {'count': n},
+                          lambda api, deps, data=data: job_server_ids(_wait(api, api.create_ecss(data)))))
+
+    # disks to create, grouped by size and type so that each group is one create_evss call per
+    # MAX_EVS_COUNT disks; each disk is identified by the server and device it is meant for
+    wanted = {}
+    for server, (_, missing, _) in keep:
+        attached = len(server.get('os-extended-volumes:volumes_attached') or [])
+        for i, volume in enumerate(missing):
+            wanted.setdefault((int(volume['size']), volume['volumetype']), []).append(
+                (server['id'], _device(attached + i)))
+    created = {}
+    for (size, vol_type), disks in sorted(wanted.items()):
+        for start in range(0, len(disks), MAX_EVS_COUNT):
+            batch = disks[start:start + MAX_EVS_COUNT]
+            create = Step('create_evss', name, {'size': size, 'volume_type': vol_type, 'count': len(batch)},
+                          lambda api, deps, size=size, vol_type=vol_type, n=len(batch):
+                          _sub_entities(_wait(api, api.create_evss('%s-data' % name, size, vol_type, count=n,
+                                                                   az=spec.get('availability_zone'))),
+                                        'volume_id'))
+            steps.append(create)
+            for i, disk in enumerate(batch):
+                created[disk] = create, i
+
+    # the changes of one server are made one after the other: resize, NICs, then each disk
+    security_groups = [group['id'] for group in spec.get('security_groups') or []] or None
+    subnet_id = (spec.get('nics') or [{}])[-1].get('subnet_id')
+    for server, (resize, missing, nics) in keep:
+        server_id = server['id']
+        chain = []
+        if resize:
+            chain.append(Step('resize_ecs', server_id, {'flavor': resize},
+                              lambda api, deps, server_id=server_id, flavor=resize:
+                              _wait(api, api.resize_ecs(server_id, flavor)) and flavor))
+        if nics:
+            chain.append(Step('add_nics', server_id, {'count': nics},
+                              lambda api, deps, server_id=server_id, nics=nics:
+                              _wait(api, api.add_nics(server_id, nics, subnet_id, security_groups)) and nics))
+        attached = len(server.get('os-extended-volumes:volumes_attached') or [])
+        for i, volume in enumerate(missing):
+            device = _device(attached + i)
+            create, index = created[(server_id, device)]
+            chain.append(Step('attach_volume', server_id, {'device': device, 'size': int(volume['size']),
+                                                           'volume_type': volume['volumetype']},
+                              lambda api, deps, server_id=server_id, device=device, create=create, index=index:
+                              _wait(api, api.attach_volume(server_id, deps[create][index], device)) and device,
+                              [create]))
+        for previous, step in zip(chain, chain[1:]):
+            step.depends.append(previous)
+        steps.extend(chain)
+    return steps
+
+
+def execute(api, steps, parallel=8):
+    """ Run steps in parallel, each once the steps it depends on have succeeded. Steps whose
+    dependencies failed are skipped. Returns {step id: {'status', 'result' or 'error'}}. """
+    outcomes = {}
+    results = {}
+    done = Queue()
+    pool = ThreadPool(parallel)
+    pending = list(steps)
+    running = 0
+
+    def run(step, deps):
+        try:
+            return step, step.func(api, deps), None
+        except Exception as e:
+            return step, None, e
+
+    try:
+        while pending or running:
+            for step in list(pending):
+                if any(dep.id in outcomes and outcomes[dep.id]['status'] != 'SUCCESS' for dep in step.depends):
+                    pending.remove(step)
+                    outcomes[step.id] = {'status': 'SKIPPED', 'error': 'a step it depends on failed'}
+                elif all(dep.id in outcomes for dep in step.depends):
+                    pending.remove(step)
+                    logging.info("Step %d: %s %s" % (step.id, step.action, step.target))
+                    pool.apply_async(run, (step, dict((dep, results[dep.id]) for dep in step.depends)),
+                                     callback=done.put)
+                    running += 1
+            if not running:
+                continue
+            step, result, error = done.get()
+            running -= 1
+            if error is None:
+                results[step.id] = result
+                outcomes[step.id] = {'status': 'SUCCESS', 'result': result}
+            else:
+                logging.error("Step %d (%s %s) failed: %s" % (step.id, step.action, step.target, error))
+                outcomes[step.id] = {'status': 'FAIL', 'error': str(error)}
+    finally:
+        pool.terminate()
+    return outcomes
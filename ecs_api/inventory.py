@@ -0,0 +1,257 @@
+""" Local SQLite index of servers, volumes, attachments, NICs and elastic IPs.
+
+Inventory.sync() refreshes it incrementally: servers are listed with
+changes-since (deleted servers come back with status DELETED), volumes are
+rewritten only when their updated_at moved, and NICs are only fetched again for
+servers that changed. query() answers filtered lookups and joins from the index
+without touching the API. """
+
+from models import Server, Volume
+from fileutil import file_lock
+import sqlite3
+import logging
+import codec
+import time
+import os
+
+inventory_file = os.path.expanduser('~') + '/.ecs_inventory.db'
+
+# An inventory older than this is reported as stale by `ecs query`.
+STALE_AFTER = 900
+
+# Subtracted from the sync start time used as the next changes-since, to cover
+# clock skew between here and the API.
+CLOCK_SKEW = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (
+    id TEXT PRIMARY KEY, name TEXT, status TEXT, flavor TEXT, image TEXT,
+    availability_zone TEXT, key_name TEXT, created TEXT, updated TEXT, raw TEXT);
+CREATE INDEX IF NOT EXISTS servers_name ON servers (name);
+CREATE INDEX IF NOT EXISTS servers_status ON servers (status, availability_zone);
+CREATE TABLE IF NOT EXISTS volumes (
+    id TEXT PRIMARY KEY, name TEXT, size INTEGER, volume_type TEXT, availability_zone TEXT,
+    status TEXT, bootable INTEGER, updated_at TEXT, raw TEXT);
+CREATE INDEX IF NOT EXISTS volumes_type ON volumes (volume_type);
+CREATE TABLE IF NOT EXISTS attachments (volume_id TEXT, server_id TEXT, device TEXT);
+CREATE INDEX IF NOT EXISTS attachments_server ON attachments (server_id);
+CREATE INDEX IF NOT EXISTS attachments_volume ON attachments (volume_id);
+CREATE TABLE IF NOT EXISTS nics (
+    port_id TEXT PRIMARY KEY, server_id TEXT, ip_address TEXT, mac_addr TEXT, net_id TEXT,
+    subnet_id TEXT, port_state TEXT);
+CREATE INDEX IF NOT EXISTS nics_server ON nics (server_id);
+CREATE INDEX IF NOT EXISTS nics_ip ON nics (ip_address);
+CREATE TABLE IF NOT EXISTS publicips (
+    id TEXT PRIMARY KEY, public_ip_address TEXT, private_ip_address TEXT, status TEXT, port_id TEXT);
+CREATE INDEX IF NOT EXISTS publicips_port ON publicips (port_id);
+CREATE TABLE IF NOT EXISTS sync_state (resource TEXT PRIMARY KEY, synced_at REAL, since TEXT);
+"""
+
+# For each queryable resource: the select, the columns shown by the tabular output
+# formats, and the accepted filters as SQL conditions taking one GLOB pattern.
+RESOURCES = {
+    'servers': (
+        "SELECT s.id, s.name, s.status, s.flavor, s.availability_zone, s.updated FROM servers s",
+        [("ID", "id"), ("Name", "name"), ("Status", "status"), ("Flavor", "flavor"),
+         ("AZ", "availability_zone"), ("Updated", "updated")],
+        {
+            'id': "s.id GLOB ?",
+            'name': "s.name GLOB ?",
+            'status': "s.status GLOB ?",
+            'flavor': "s.flavor GLOB ?",
+            'image': "s.image GLOB ?",
+            'az': "s.availability_zone GLOB ?",
+            'key_name': "s.key_name GLOB ?",
+            'volume': "EXISTS (SELECT 1 FROM attachments a WHERE a.server_id = s.id AND a.volume_id GLOB ?)",
+            'volume_type': "EXISTS (SELECT 1 FROM attachments a JOIN volumes v ON v.id = a.volume_id "
+                           "WHERE a.server_id = s.id AND v.volume_type GLOB ?)",
+            'ip': "EXISTS (SELECT 1 FROM nics n WHERE n.server_id = s.id AND n.ip_address GLOB ?)",
+            'eip': "EXISTS (SELECT 1 FROM nics n JOIN publicips p ON p.port_id = n.port_id "
+                   "WHERE n.server_id = s.id AND p.public_ip_address GLOB ?)",
+        }),
+    'volumes': (
+        "SELECT v.id, v.name, v.size, v.volume_type, v.availability_zone, v.status, "
+        "(SELECT group_concat(a.server_id) FROM attachments a WHERE a.volume_id = v.id) AS servers "
+        "FROM volumes v",
+        [("ID", "id"), ("Name", "name"), ("Size", "size"), ("Type", "volume_type"),
+         ("AZ", "availability_zone"), ("Status", "status"), ("Servers", "servers")],
+        {
+            'id': "v.id GLOB ?",
+            'name': "v.name GLOB ?",
+            'status': "v.status GLOB ?",
+            'volume_type': "v.volume_type GLOB ?",
+            'az': "v.availability_zone GLOB ?",
+            'server': "EXISTS (SELECT 1 FROM attachments a WHERE a.volume_id = v.id AND a.server_id GLOB ?)",
+            'server_name': "EXISTS (SELECT 1 FROM attachments a JOIN servers s ON s.id = a.server_id "
+                           "WHERE a.volume_id = v.id AND s.name GLOB ?)",
+        }),
+    'nics': (
+        "SELECT n.server_id, s.name AS server_name, n.port_id, n.ip_address, n.mac_addr, n.port_state "
+        "FROM nics n LEFT JOIN servers s ON s.id = n.server_id",
+        [("Server", "server_id"), ("Server Name", "server_name"), ("ID", "port_id"),
+         ("IP Address", "ip_address"), ("MAC", "mac_addr"), ("State", "port_state")],
+        {
+            'server': "n.server_id GLOB ?",
+            'server_name': "s.name GLOB ?",
+            'ip': "n.ip_address GLOB ?",
+            'subnet': "n.subnet_id GLOB ?",
+            'state': "n.port_state GLOB ?",
+        }),
+    'eips': (
+        "SELECT p.id, p.public_ip_address, p.private_ip_address, p.status, n.server_id "
+        "FROM publicips p LEFT JOIN nics n ON n.port_id = p.port_id",
+        [("ID", "id"), ("Public IP Address", "public_ip_address"), ("Private IP Address", "private_ip_address"),
+         ("Status", "status"), ("Server", "server_id")],
+        {
+            'ip': "p.public_ip_address GLOB ?",
+            'private_ip': "p.private_ip_address GLOB ?",
+            'status': "p.status GLOB ?",
+            'server': "n.server_id GLOB ?",
+        }),
+}
+
+
+def _isotime(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+class Inventory(object):
+    def __init__(self, path=inventory_file):
+        self.path = path
+        # creating the schema concurrently fails with "database schema has changed"
+        with file_lock(path):
+            exists = os.path.exists(path)
+            self.db = sqlite3.connect(path)
+            self.db.row_factory = sqlite3.Row
+            self.db.executescript(SCHEMA)
+            if not exists:
+                os.chmod(path, 0o600)
+
+    def close(self):
+        self.db.close()
+
+    def state(self, resource):
+        """ Return (synced_at, since) for resource, (None, None) before its first sync. """
+        row = self.db.execute("SELECT synced_at, since FROM sync_state WHERE resource = ?", (resource,)).fetchone()
+        return (row['synced_at'], row['since']) if row else (None, None)
+
+    def _mark(self, resource, synced_at, since=None):
+        self.db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (resource, synced_at, since))
+
+    def synced_at(self):
+        """ Time of the oldest per-resource sync, None if anything was never synced. """
+        times = [self.state(resource)[0] for resource in ('servers', 'volumes', 'nics', 'publicips')]
+        return None if None in times else min(times)
+
+    def sync(self, api, full=False, workers=8):
+        """ Bring the index up to date and return the number of rows written per resource. """
+        changed = self.sync_servers(api, full)
+        counts = {'servers': len(changed)}
+        counts['volumes'] = self.sync_volumes(api)
+        counts['nics'] = self.sync_nics(api, changed, workers)
+        counts['publicips'] = self.sync_publicips(api)
+        return counts
+
+    def sync_servers(self, api, full=False):
+        """ Fetch servers changed since the last sync (all of them with full) and return
+        the IDs of those added or updated. """
+        started = time.time()
+        _, since = self.state('servers')
+        if full:
+            since = None
+        changed, seen, deleted = [], set(), []
+        with self.db:
+            for j_server in api.iter_servers(changes_since=since, stream=True):
+                if j_server.get('status') == 'DELETED':
+                    deleted.append(j_server['id'])
+                    continue
+                server = Server(j_server, keep_raw=False)
+                seen.add(server.id)
+                changed.append(server.id)
+                self.db.execute("INSERT OR REPLACE INTO servers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (server.id, server.name, server.status, server.flavor, server.image,
+                                 server.availability_zone, server.key_name, server.created, server.updated,
+                                 codec.dumps(j_server)))
+            if since is None:
+                # A complete listing: anything not in it is gone.
+                deleted.extend(row[0] for row in self.db.execute("SELECT id FROM servers")
+                               if row[0] not in seen)
+            for server_id in deleted:
+                self.db.execute("DELETE FROM servers WHERE id = ?", (server_id,))
+                self.db.execute("DELETE FROM nics WHERE server_id = ?", (server_id,))
+            self._mark('servers', started, _isotime(started - CLOCK_SKEW))
+        logging.info("Synced %d changed and %d deleted servers" % (len(changed), len(deleted)))
+        return changed
+
+    def sync_volumes(self, api):
+        """ Rewrite the volumes whose updated_at changed and drop those that are gone.
+        The EVS listing has no changes-since filter, so it is always read in full. """
+        started = time.time()
+        known = dict(self.db.execute("SELECT id, updated_at FROM volumes").fetchall())
+        written = 0
+        with self.db:
+            for j_volume in api.iter_volumes(stream=True):
+                volume_id = j_volume['id']
+                if volume_id in known and known.pop(volume_id) == j_volume.get('updated_at'):
+                    continue
+                known.pop(volume_id, None)
+                volume = Volume(j_volume, keep_raw=False)
+                self.db.execute("INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (volume.id, volume.name, volume.size, volume.volume_type,
+                                 volume.availability_zone, volume.status, volume.bootable, volume.updated_at,
+                                 codec.dumps(j_volume)))
+                self.db.execute("DELETE FROM attachments WHERE volume_id = ?", (volume.id,))
+                self.db.executemany("INSERT INTO attachments VALUES (?, ?, ?)",
+                                    [(volume.id, server_id, device) for server_id, device in volume.attachments])
+                written += 1
+            for volume_id in known:
+                self.db.execute("DELETE FROM volumes WHERE id = ?", (volume_id,))
+                self.db.execute("DELETE FROM attachments WHERE volume_id = ?", (volume_id,))
+            self._mark('volumes', started)
+        logging.info("Synced %d changed and %d deleted volumes" % (written, len(known)))
+        return written
+
+    def sync_nics(self, api, server_ids, workers=8):
+        """ Refresh the NICs of the given servers concurrently. A server whose NICs cannot
+        be read keeps its previous rows. """
+        started = time.time()
+        written = 0
+        results, errors = api.query_nics_many(server_ids, workers, models=True)
+        for server_id, error in errors.items():
+            logging.warning("Cannot read NICs of server %s: %s" % (server_id, error))
+        with self.db:
+            for server_id, nics in results.items():
+                self.db.execute("DELETE FROM nics WHERE server_id = ?", (server_id,))
+                self.db.executemany("INSERT OR REPLACE INTO nics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(nic.port_id, server_id, nic.ip_address, nic.mac_addr, nic.net_id,
+                                      nic.subnet_id, nic.port_state) for nic in nics])
+                written += len(nics)
+            self._mark('nics', started)
+        return written
+
+    def sync_publicips(self, api):
+        """ Elastic IPs are few, so they are simply replaced. """
+        started = time.time()
+        rows = [(p['id'], p.get('public_ip_address'), p.get('private_ip_address'), p.get('status'),
+                 p.get('port_id')) for p in api.iter_publicips()]
+        with self.db:
+            self.db.execute("DELETE FROM publicips")
+            self.db.executemany("INSERT INTO publicips VALUES (?, ?, ?, ?, ?)", rows)
+            self._mark('publicips', started)
+        return len(rows)
+
+    def query(self, resource, filters=None):
+        """ Return an iterator over the rows of resource ('servers', 'volumes', 'nics' or 'eips') as dicts.
+        filters maps filter names to GLOB patterns, e.g. {'name': 'avocado_cloud*'}. """
+        select, _, conditions = RESOURCES[resource]
+        clauses, params = [], []
+        for name, pattern in sorted((filters or {}).items()):
+            if name not in conditions:
+                raise ValueError("Unknown %s filter '%s', use one of: %s" %
+                               (resource, name, ', '.join(sorted(conditions))))
+            clauses.append(conditions[name])
+            params.append(pattern)
+        sql = select
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return (dict(zip(row.keys(), row)) for row in self.db.execute(sql, params))
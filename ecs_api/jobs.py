@@ -0,0 +1,115 @@
+import heapq
+import logging
+import random
+import time
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+from ratelimit import TokenBucket
+
+JOB_DONE = ('SUCCESS', 'FAIL')
+
+
+def _poll(api, job_id):
+    try:
+        return job_id, api.query_task_status(job_id), None
+    except Exception as e:
+        return job_id, None, e
+
+
+class JobWaiter(object):
+    """ Track many task IDs at once and poll them concurrently until they finish.
+
+    Each job is polled on its own schedule: the delay grows by `backoff` while its
+    status stays the same and drops back to `interval` when it changes. All polls
+    share a global budget of `budget` requests per second. on_status, if given, is called
+    with (job_id, j_content) for every successful poll, e.g. to trace the job phases. """
+
+    def __init__(self, api, workers=8, budget=10, interval=2.0, max_interval=30.0, backoff=1.5,
+                 timeout=3600, max_errors=5, on_status=None):
+        self.api = api
+        self.on_status = on_status
+        self.workers = workers
+        self.bucket = TokenBucket(budget)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.jobs = {}
+        self.schedule = []
+
+    def add(self, job_id):
+        """ Start tracking a task ID. """
+        if job_id in self.jobs:
+            return
+        self.jobs[job_id] = {'status': None, 'delay': self.interval, 'errors': 0, 'started': time.time()}
+        heapq.heappush(self.schedule, (time.time(), job_id))
+
+    def _reschedule(self, job_id, status):
+        job = self.jobs[job_id]
+        if status != job['status']:
+            job['status'] = status
+            job['delay'] = self.interval
+        else:
+            job['delay'] = min(job['delay'] * self.backoff, self.max_interval)
+        delay = job['delay'] * random.uniform(0.9, 1.1)
+        heapq.heappush(self.schedule, (time.time() + delay, job_id))
+
+    def wait(self):
+        """ Generator yielding (job_id, j_content) as soon as each job reaches SUCCESS or FAIL.
+        Jobs that exceed the timeout or keep failing to poll are reported with status
+        TIMEOUT or ERROR. """
+        results = Queue()
+        pool = ThreadPool(self.workers)
+        inflight = 0
+        try:
+            while self.schedule or inflight:
+                now = time.time()
+                while self.schedule and self.schedule[0][0] <= now and inflight < self.workers:
+                    _, job_id = heapq.heappop(self.schedule)
+                    if now - self.jobs[job_id]['started'] > self.timeout:
+                        del self.jobs[job_id]
+                        yield job_id, {'job_id': job_id, 'status': 'TIMEOUT'}
+                        continue
+                    self.bucket.acquire()
+                    pool.apply_async(_poll, (self.api, job_id), callback=results.put)
+                    inflight += 1
+
+                block = self.schedule[0][0] - time.time() if self.schedule else None
+                if inflight >= self.workers or block is None:
+                    block = self.max_interval
+                try:
+                    job_id, j_content, error = results.get(timeout=max(block, 0.01))
+                except Empty:
+                    continue
+                inflight -= 1
+
+                job = self.jobs[job_id]
+                if error is not None:
+                    job['errors'] += 1
+                    logging.debug("Polling task %s failed: %r" % (job_id, error))
+                    if job['errors'] >= self.max_errors:
+                        del self.jobs[job_id]
+                        yield job_id, {'job_id': job_id, 'status': 'ERROR', 'error': str(error)}
+                    else:
+                        self._reschedule(job_id, job['status'])
+                    continue
+
+                if self.on_status:
+                    self.on_status(job_id, j_content)
+                status = j_content.get('status')
+                if status in JOB_DONE:
+                    del self.jobs[job_id]
+                    yield job_id, j_content
+                else:
+                    self._reschedule(job_id, status)
+        finally:
+            pool.terminate()
+
+
+def wait_jobs(api, job_ids, **kwargs):
+    """ Wait for all job_ids and return {job_id: j_content}. """
+    waiter = JobWaiter(api, **kwargs)
+    for job_id in job_ids:
+        waiter.add(job_id)
+    return dict(waiter.wait())
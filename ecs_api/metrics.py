@@ -0,0 +1,288 @@
+""" Per-endpoint request metrics: counts, status codes, retries, bytes and latency histograms.
+
+Every request sent through send_request is recorded here under its method and endpoint
+template, the URL path with project and resource IDs replaced by {project_id} and {id}:
+
+    from metrics import metrics
+    metrics.snapshot()          # {'GET /v1/{project_id}/cloudservers/detail': {...}, ...}
+    metrics.summary()           # table as printed by 'ecs --stats'
+    metrics.write('ecs.prom')   # Prometheus text format; any other extension writes JSON
+
+Latencies are recorded per attempt:
+  connect  opening a new TCP/TLS connection, DNS resolution included; 0 on a kept-alive one
+  ttfb     from the connection being ready until the response headers arrived
+  total    the whole attempt, body download included (headers only for streamed responses)
+"""
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.compat import urlparse
+from fileutil import atomic_write
+import threading
+import logging
+import codec
+import time
+import re
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PHASES = ('connect', 'ttfb', 'total')
+
+ID_RE = re.compile(r'^([0-9a-f]{32}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$', re.I)
+VERSION_RE = re.compile(r'^v\d+(\.\d+)?$')
+
+
+def endpoint_template(url):
+    """ The path of url with IDs replaced, e.g. /v1/{project_id}/cloudservers/{id}/os-interface. """
+    segments = urlparse(url).path.split('/')
+    for i, segment in enumerate(segments):
+        if ID_RE.match(segment):
+            segments[i] = i and VERSION_RE.match(segments[i - 1]) and '{project_id}' or '{id}'
+    return '/'.join(segments)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding quantile q, None without observations. """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(zip(BUCKETS + ('+Inf',), self.counts))}
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.retries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = dict((phase, Histogram()) for phase in PHASES)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'statuses': dict(self.statuses),
+            'retries': self.retries,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'latency': dict((phase, histogram.to_dict()) for phase, histogram in self.latency.items()),
+        }
+
+
+class Metrics(object):
+    """ Process-wide, thread-safe store of request metrics. Hooks added with add_hook() are
+    called with the dict of every recorded attempt, e.g. to feed another monitoring system. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.hooks = []
+        self._local = threading.local()
+        self._timer = None
+
+    def _stats(self, method, url):
+        key = (method.upper(), endpoint_template(url))
+        stats = self.endpoints.get(key)
+        if stats is None:
+            stats = self.endpoints[key] = EndpointStats()
+        return stats
+
+    def start_attempt(self):
+        """ Called before each attempt; connections opened by this thread are timed from here on. """
+        self._local.connect = 0.0
+
+    def connected(self, seconds):
+        self._local.connect = getattr(self._local, 'connect', 0.0) + seconds
+
+    def record(self, method, url, status, bytes_out=0, bytes_in=0, ttfb=None, total=None, retry=False):
+        """ Record one attempt. status is the HTTP status code or 'error' for a network failure,
+        retry whether another attempt follows. """
+        connect = getattr(self._local, 'connect', 0.0)
+        if ttfb is not None:
+            ttfb = max(ttfb - connect, 0)
+        with self.lock:
+            stats = self._stats(method, url)
+            stats.count += 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.retries += retry and 1 or 0
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            for phase, seconds in (('connect', connect), ('ttfb', ttfb), ('total', total)):
+                if seconds is not None:
+                    stats.latency[phase].observe(seconds)
+        if self.hooks:
+            attempt = {'method': method.upper(), 'endpoint': endpoint_template(url), 'status': status,
+                       'retry': retry, 'bytes_out': bytes_out, 'bytes_in': bytes_in,
+                       'connect': connect, 'ttfb': ttfb, 'total': total}
+            for hook in list(self.hooks):
+                try:
+                    hook(attempt)
+                except Exception:
+                    logging.exception("Metrics hook %r failed" % hook)
+
+    def add_bytes_in(self, method, url, count):
+        """ Account for body bytes read after the attempt was recorded, i.e. of streamed responses. """
+        with self.lock:
+            self._stats(method, url).bytes_in += count
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def snapshot(self):
+        """ {'<METHOD> <endpoint template>': {count, statuses, retries, bytes_in, bytes_out, latency}} """
+        with self.lock:
+            return dict(('%s %s' % key, stats.to_dict()) for key, stats in self.endpoints.items())
+
+    def summary(self):
+        """ One line per endpoint, ordered by the total time spent on it. """
+        with self.lock:
+            items = sorted(self.endpoints.items(), key=lambda item: -item[1].latency['total'].sum)
+            lines = ['%-7s %-48s %6s %7s %10s %10s %9s %9s %9s  %s' % (
+                'Method', 'Endpoint', 'Count', 'Retries', 'Bytes in', 'Bytes out',
+                'Mean ms', 'p50 ms', 'p99 ms', 'Statuses')]
+            for (method, template), stats in items:
+                total = stats.latency['total']
+                mean = total.count and total.sum / total.count * 1000 or 0
+                lines.append('%-7s %-48s %6d %7d %10d %10d %9.1f %9s %9s  %s' % (
+                    method, template, stats.count, stats.retries, stats.bytes_in, stats.bytes_out, mean,
+                    _bound_ms(total.quantile(0.5)), _bound_ms(total.quantile(0.99)),
+                    ' '.join('%s:%d' % item for item in sorted(stats.statuses.items()))))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return codec.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def sample(name, labels, value):
+            lines.append('%s{%s} %s' % (name, ','.join('%s="%s"' % label for label in labels), value))
+
+        with self.lock:
+            items = [((('method', method), ('endpoint', template)), stats)
+                     for (method, template), stats in sorted(self.endpoints.items())]
+            header('ecs_requests_total', 'counter', 'Request attempts by status code.')
+            for labels, stats in items:
+                for status, count in sorted(stats.statuses.items()):
+                    sample('ecs_requests_total', labels + (('status', status),), count)
+            for name, attr, help_text in (('ecs_request_retries_total', 'retries', 'Attempts followed by a retry.'),
+                                          ('ecs_request_bytes_in_total', 'bytes_in', 'Response body bytes.'),
+                                          ('ecs_request_bytes_out_total', 'bytes_out', 'Request body bytes.')):
+                header(name, 'counter', help_text)
+                for labels, stats in items:
+                    sample(name, labels, getattr(stats, attr))
+            for phase in PHASES:
+                name = 'ecs_request_%s_seconds' % phase
+                header(name, 'histogram', 'Request %s latency.' % phase)
+                for labels, stats in items:
+                    histogram, cumulative = stats.latency[phase], 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        sample(name + '_bucket', labels + (('le', bound),), cumulative)
+                    sample(name + '_sum', labels, histogram.sum)
+                    sample(name + '_count', labels, histogram.count)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, fmt=None):
+        """ Dump the metrics to path as 'prometheus' or 'json'; by default Prometheus text
+        for *.prom files and JSON otherwise. """
+        fmt = fmt or (path.endswith('.prom') and 'prometheus' or 'json')
+        content = fmt == 'prometheus' and self.to_prometheus() or self.to_json()
+        atomic_write(path, content)
+
+    def write_periodically(self, path, interval=60, fmt=None):
+        """ Rewrite the dump every interval seconds from a daemon thread, for long-running harnesses. """
+        def run():
+            try:
+                self.write(path, fmt)
+            except (IOError, OSError) as e:
+                logging.warning("Writing metrics to %s failed: %s" % (path, e))
+            self._timer = threading.Timer(interval, run)
+            self._timer.daemon = True
+            self._timer.start()
+        self.stop_periodic_write()
+        self._timer = threading.Timer(interval, run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop_periodic_write(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def _bound_ms(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return '>%d' % (BUCKETS[-1] * 1000)
+    return '<=%d' % (seconds * 1000)
+
+
+metrics = Metrics()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.time()
+        try:
+            HTTPConnection.connect(self)
+        finally:
+            metrics.connected(time.time() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.time()
+        try:
+            HTTPSConnection.connect(self)
+        finally:
+            metrics.connected(time.time() - start)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+def instrument_adapter(adapter):
+    """ Make the connection pools of a requests HTTPAdapter time new connections. """
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool,
+    }
@@ -0,0 +1,148 @@
+""" Compact typed views of ECS resources.
+
+Each model keeps the handful of fields scripts actually look at in __slots__, with
+values that repeat across a large inventory (status, flavor, availability zone,
+...) interned so thousands of servers share one string object. The full JSON
+object is kept as a compact serialized string and only decoded when `raw` is
+read; pass keep_raw=False to drop it altogether. """
+
+import codec
+
+_strings = {}
+
+
+def intern_string(value):
+    """ Return the canonical copy of a repeated str or unicode value. """
+    if value is None:
+        return None
+    return _strings.setdefault(value, value)
+
+
+def _first(items, key):
+    for item in items or ():
+        if key in item:
+            return item[key]
+    return None
+
+
+class Model(object):
+    __slots__ = ('_raw',)
+
+    def __init__(self, j_content, keep_raw=True):
+        self._raw = codec.dumps(j_content) if keep_raw else None
+        self._load(j_content)
+
+    def _load(self, j_content):
+        raise NotImplementedError
+
+    @property
+    def raw(self):
+        """ The JSON object this model was built from, decoded on each access. """
+        if self._raw is None:
+            return None
+        return codec.loads(self._raw)
+
+    def get(self, key, default=None):
+        """ dict-style access, so models can be passed to the output writers. Model fields
+        are returned directly, other keys are looked up in the raw JSON. """
+        if key in self.__slots__:
+            return getattr(self, key)
+        raw = self.raw
+        return default if raw is None else raw.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, ' '.join('%s=%r' % (name, getattr(self, name))
+                                                           for name in self.__slots__[:3]))
+
+
+class Server(Model):
+    """ An entry of servers/detail. """
+    __slots__ = ('id', 'name', 'status', 'flavor', 'image', 'availability_zone', 'key_name',
+                 'created', 'updated', 'fixed_ips', 'floating_ips', 'volume_ids')
+
+    def _load(self, j_content):
+        self.id = j_content['id']
+        self.name = j_content.get('name')
+        self.status = intern_string(j_content.get('status'))
+        self.flavor = intern_string((j_content.get('flavor') or {}).get('id'))
+        self.image = intern_string((j_content.get('image') or {}).get('id'))
+        self.availability_zone = intern_string(j_content.get('OS-EXT-AZ:availability_zone'))
+        self.key_name = intern_string(j_content.get('key_name'))
+        self.created = j_content.get('created')
+        self.updated = j_content.get('updated')
+        fixed, floating = [], []
+        for addresses in (j_content.get('addresses') or {}).values():
+            for address in addresses:
+                if address.get('OS-EXT-IPS:type') == 'floating':
+                    floating.append(address['addr'])
+                else:
+                    fixed.append(address['addr'])
+        self.fixed_ips = tuple(fixed)
+        self.floating_ips = tuple(floating)
+        self.volume_ids = tuple(v['id'] for v in j_content.get('os-extended-volumes:volumes_attached') or ())
+
+
+class Volume(Model):
+    """ An entry of cloudvolumes/detail. `attachments` holds (server_id, device) pairs. """
+    __slots__ = ('id', 'name', 'size', 'volume_type', 'availability_zone', 'status', 'bootable',
+                 'created_at', 'updated_at', 'attachments')
+
+    def _load(self, j_content):
+        self.id = j_content['id']
+        self.name = j_content.get('name')
+        self.size = j_content.get('size')
+        self.volume_type = intern_string(j_content.get('volume_type'))
+        self.availability_zone = intern_string(j_content.get('availability_zone'))
+        self.status = intern_string(j_content.get('status'))
+        self.bootable = j_content.get('bootable') in (True, 'true')
+        self.created_at = j_content.get('created_at')
+        self.updated_at = j_content.get('updated_at')
+        self.attachments = tuple((a.get('server_id'), intern_string(a.get('device')))
+                                 for a in j_content.get('attachments') or ())
+
+    @property
+    def server_ids(self):
+        return tuple(server_id for server_id, _ in self.attachments)
+
+
+class Interface(Model):
+    """ An entry of a server's os-interface listing. """
+    __slots__ = ('port_id', 'net_id', 'mac_addr', 'port_state', 'ip_address', 'subnet_id')
+
+    def _load(self, j_content):
+        self.port_id = j_content['port_id']
+        self.net_id = intern_string(j_content.get('net_id'))
+        self.mac_addr = j_content.get('mac_addr')
+        self.port_state = intern_string(j_content.get('port_state'))
+        self.ip_address = _first(j_content.get('fixed_ips'), 'ip_address')
+        self.subnet_id = intern_string(_first(j_content.get('fixed_ips'), 'subnet_id'))
+
+
+class Flavor(Model):
+    __slots__ = ('id', 'name', 'vcpus', 'ram', 'disk')
+
+    def _load(self, j_content):
+        self.id = intern_string(j_content['id'])
+        self.name = intern_string(j_content.get('name'))
+        # The flavors API returns vcpus and disk as strings.
+        self.vcpus = int(j_content.get('vcpus') or 0)
+        self.ram = int(j_content.get('ram') or 0)
+        self.disk = int(j_content.get('disk') or 0)
+
+
+class Image(Model):
+    __slots__ = ('id', 'name', 'status', 'os_version', 'min_disk', 'created_at')
+
+    def _load(self, j_content):
+        self.id = intern_string(j_content['id'])
+        self.name = j_content.get('name')
+        self.status = intern_string(j_content.get('status'))
+        self.os_version = intern_string(j_content.get('__os_version'))
+        self.min_disk = j_content.get('min_disk')
+        self.created_at = j_content.get('created_at')
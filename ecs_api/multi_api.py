@@ -0,0 +1,95 @@
+""" Run the same query against several regions/projects at once.
+
+    api = MultiScopeApi(['cn-east-2', 'cn-north-1', 'cn-north-1_test'])
+    servers, errors = api.servers()        # one list, each server tagged with region/project
+
+Every scope is an ECSApi with its own scoped token; tokens are requested and queries
+run concurrently, so a global inventory takes about as long as the slowest region. """
+
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from ecs_api import ECSApi, prompt_credentials
+from pool import pool_manager
+import logging
+
+
+class MultiScopeApi(object):
+    def __init__(self, projects, domain_name=None, username=None, password=None, workers=None):
+        if not projects:
+            raise ValueError("At least one project is required")
+        _, domain_name, username, password = prompt_credentials(projects[0], domain_name, username, password)
+        self.projects = list(projects)
+        self.workers = workers or len(self.projects)
+        # one connection pool per regional ECS and IAM endpoint; the default number covers a
+        # few regions, more only grow it, mounting a larger pool once
+        hosts = 2 * len(set(project.split('_')[0] for project in self.projects))
+        if pool_manager.settings['pool_connections'] < hosts:
+            pool_manager.configure(pool_connections=hosts)
+        self.pool = ThreadPool(self.workers)
+        # projects that could not be authenticated end up in self.errors
+        self.apis, self.errors = self._run(lambda project: ECSApi(project, domain_name, username, password),
+                                           self.projects)
+
+    def _run(self, func, projects):
+        def call(project):
+            try:
+                return project, func(project), None
+            except Exception as e:
+                return project, None, e
+        outcomes = dict((project, (value, error)) for project, value, error in
+                        self.pool.imap_unordered(call, projects))
+        results, errors = OrderedDict(), OrderedDict()
+        for project in projects:
+            value, error = outcomes[project]
+            if error is None:
+                results[project] = value
+            else:
+                logging.debug("Query in project %s failed: %r" % (project, error))
+                errors[project] = error
+        return results, errors
+
+    def fan_out(self, func):
+        """ Call func(api) for the ECSApi of every project concurrently. Returns (results, errors),
+        dicts keyed by project name; projects that could not be authenticated are in errors. """
+        results, errors = self._run(lambda project: func(self.apis[project]), list(self.apis))
+        errors.update(self.errors)
+        return results, errors
+
+    def call(self, method, *args, **kwargs):
+        """ Call an ECSApi method in every project, e.g. call('query_quota'). """
+        return self.fan_out(lambda api: getattr(api, method)(*args, **kwargs))
+
+    def list(self, method, **kwargs):
+        """ Call an ECSApi iter_* method in every project and merge the records into a single
+        list, each tagged with 'region' and 'project'. Returns (records, errors). """
+        def collect(api):
+            return [dict(record, region=api.region, project=api.project_name)
+                    for record in getattr(api, method)(**kwargs)]
+        results, errors = self.fan_out(collect)
+        return [record for records in results.values() for record in records], errors
+
+    def servers(self, name=None):
+        return self.list('iter_servers', name=name)
+
+    def volumes(self):
+        return self.list('iter_volumes')
+
+    def publicips(self):
+        return self.list('iter_publicips')
+
+    def quotas(self):
+        """ The absolute limits of every project, as one record per project. """
+        results, errors = self.call('query_quota')
+        records = [dict(j_content['absolute'], region=self.apis[project].region, project=project)
+                   for project, j_content in results.items()]
+        return records, errors
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
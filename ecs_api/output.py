@@ -0,0 +1,181 @@
+import codec
+import json
+import csv
+
+FORMATS = ('table', 'ndjson', 'csv', 'json')
+
+# Number of rows the table renderer looks at to size its columns before it starts
+# writing, about one screenful; later rows are streamed with the same widths.
+TABLE_SIZING_ROWS = 50
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _plain(record):
+    """ The JSON object behind a record, which may be a dict or a models.Model. """
+    return record if type(record) is dict else record.raw
+
+
+def _getter(path):
+    """ Compile a dotted path such as 'fixed_ips.0.ip_address' into a function of
+    (record, row number); the path '#' stands for the row number itself. """
+    if path == '#':
+        return lambda record, index: index
+    if '.' not in path:
+        return lambda record, index: record.get(path)
+    parts = [int(part) if part.isdigit() else part for part in path.split('.')]
+
+    def get(record, index):
+        value = record
+        for part in parts:
+            try:
+                value = value[part]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value
+    return get
+
+
+def _text(value):
+    if type(value) is unicode:
+        return value
+    if value is None:
+        return u''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+
+class RecordWriter(object):
+    """ Writes records one by one as they become available. `columns` is a list of
+    (header, path) pairs selecting the fields shown by the tabular formats. """
+
+    def __init__(self, fp, columns=None):
+        self.fp = fp
+        self.columns = columns or []
+        self.getters = [_getter(path) for _, path in self.columns]
+        # Plain top-level keys, the common case, are fetched with a single map().
+        self.keys = None
+        if all('.' not in path and path != '#' for _, path in self.columns):
+            self.keys = [path for _, path in self.columns]
+        self.count = 0
+
+    def row(self, record):
+        if self.keys is not None:
+            values = map(record.get, self.keys)
+        else:
+            index = self.count
+            values = [get(record, index) for get in self.getters]
+        return [value if type(value) is unicode else _text(value) for value in values]
+
+    def write(self, record):
+        self._write(record)
+        self.count += 1
+        # rows show up as they are produced, even when stdout is a pipe
+        self.fp.flush()
+
+    def writerows(self, records):
+        """ Write every record of an iterable (or generator) as it is produced. """
+        for record in records:
+            self.write(record)
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        self.fp.flush()
+
+
+class NDJSONWriter(RecordWriter):
+    """ One compact JSON document per line, holding the whole record. """
+
+    def _write(self, record):
+        self.fp.write(_encode(codec.dumps(_plain(record))) + '\n')
+
+
+class JSONWriter(RecordWriter):
+    """ Every record pretty printed, the historical output of the info commands. """
+
+    def _write(self, record):
+        self.fp.write(_encode(json.dumps(_plain(record), indent=4, sort_keys=True)) + '\n')
+
+
+class CSVWriter(RecordWriter):
+    def __init__(self, fp, columns=None):
+        super(CSVWriter, self).__init__(fp, columns)
+        self.writer = csv.writer(fp)
+        self.writer.writerow([header for header, _ in self.columns])
+
+    def _write(self, record):
+        self.writer.writerow([_encode(cell) for cell in self.row(record)])
+
+
+class TableWriter(RecordWriter):
+    """ Aligned columns. Widths are computed in a single pass over the first
+    TABLE_SIZING_ROWS rows, which are then written together with the header;
+    subsequent rows are written immediately using those widths. """
+
+    def __init__(self, fp, columns=None, sizing_rows=TABLE_SIZING_ROWS):
+        super(TableWriter, self).__init__(fp, columns)
+        self.sizing_rows = sizing_rows
+        self.pending = []
+        self.formatter = None
+
+    def _flush_pending(self):
+        widths = [len(header) for header, _ in self.columns]
+        for row in self.pending:
+            widths = [max(w, len(cell)) for w, cell in zip(widths, row)]
+        # The last column is not padded, so lines carry no trailing blanks.
+        self.formatter = u'  '.join([u'%%-%ds' % w for w in widths[:-1]] + [u'%s'])
+        lines = [self.formatter % tuple(header for header, _ in self.columns)]
+        lines.extend(self.formatter % tuple(row) for row in self.pending)
+        self.fp.write(_encode(u'\n'.join(lines) + u'\n'))
+        self.pending = []
+
+    def _write(self, record):
+        row = self.row(record)
+        if self.formatter:
+            self.fp.write(_encode(self.formatter % tuple(row) + u'\n'))
+            return
+        self.pending.append(row)
+        if len(self.pending) >= self.sizing_rows:
+            self._flush_pending()
+
+    def writerows(self, records):
+        records = iter(records)
+        for record in records:
+            self.write(record)
+            if self.formatter:
+                break
+        if not self.formatter:
+            return
+        # Once the widths are known rows go straight out, with lookups hoisted out of the loop.
+        formatter = self.formatter + u'\n'
+        write = self.fp.write
+        flush = self.fp.flush
+        row = self.row
+        for record in records:
+            write((formatter % tuple(row(record))).encode('utf-8'))
+            flush()
+            self.count += 1
+
+    def close(self):
+        if self.formatter is None and self.pending:
+            self._flush_pending()
+        super(TableWriter, self).close()
+
+
+WRITERS = {
+    'table': TableWriter,
+    'ndjson': NDJSONWriter,
+    'csv': CSVWriter,
+    'json': JSONWriter,
+}
+
+
+def make_writer(fmt, fp, columns=None):
+    return WRITERS[fmt](fp, columns)
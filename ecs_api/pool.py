@@ -0,0 +1,102 @@
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import instrument_adapter
+
+# Connections kept per host by default: the largest number of concurrent requests made by
+# the built-in worker pools (AsyncECSSession, ReadinessWaiter), so that none of them has to
+# grow the pool.
+MAX_WORKERS = 32
+
+
+class PoolManager(object):
+    """ Process-wide HTTP connection pool shared by every ECSSession and the token functions.
+
+    pool_connections is the number of hosts to keep pools for, pool_maxsize the number of
+    connections kept per host and pool_block whether callers wait for a free connection
+    instead of opening an extra, discarded one. """
+
+    def __init__(self, pool_connections=10, pool_maxsize=MAX_WORKERS, pool_block=False, keep_alive=True):
+        self.lock = threading.Lock()
+        self.settings = {
+            'pool_connections': pool_connections,
+            'pool_maxsize': pool_maxsize,
+            'pool_block': pool_block,
+            'keep_alive': keep_alive,
+        }
+        self._session = None
+        self._adapter = None
+
+    def _mount(self):
+        settings = self.settings
+        self._adapter = HTTPAdapter(pool_connections=settings['pool_connections'],
+                                    pool_maxsize=settings['pool_maxsize'],
+                                    pool_block=settings['pool_block'])
+        instrument_adapter(self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        if settings['keep_alive']:
+            self._session.headers.pop('Connection', None)
+        else:
+            self._session.headers['Connection'] = 'close'
+
+    def configure(self, **settings):
+        """ Change pool settings. A changed pool is mounted as a new adapter, dropping the
+        kept-alive connections, so that callers only grow it when the default is too small. """
+        with self.lock:
+            unknown = set(settings) - set(self.settings)
+            if unknown:
+                raise TypeError("Unknown pool settings: %s" % ', '.join(sorted(unknown)))
+            if all(self.settings[k] == v for k, v in settings.items()):
+                return
+            self.settings.update(settings)
+            if self._session is None:
+                return
+            logging.debug("Rebuilding connection pool with %s" % self.settings)
+            self._adapter.close()
+            self._mount()
+
+    def session(self):
+        """ Return the shared requests.Session, creating it on first use. """
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    self._session = requests.Session()
+                    self._mount()
+        return self._session
+
+    def stats(self):
+        """ Return per-host {'requests', 'connections', 'hits', 'misses'}. A miss is a request
+        that had to open a new connection, a hit one served by a kept-alive connection. """
+        result = {}
+        if self._adapter is None:
+            return result
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = "%s://%s:%s" % (pool.scheme, pool.host, pool.port)
+            result[host] = {
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'hits': max(pool.num_requests - pool.num_connections, 0),
+                'misses': pool.num_connections,
+            }
+        return result
+
+    def close(self):
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                self._adapter = None
+
+
+pool_manager = PoolManager()
+
+
+def get_session():
+    """ Shortcut for pool_manager.session(). """
+    return pool_manager.session()
@@ -0,0 +1,92 @@
+from email.utils import parsedate_tz, mktime_tz
+import threading
+import time
+
+
+class TokenBucket(object):
+    """ Token bucket allowing `rate` acquisitions per second with bursts of up to `burst`. """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def try_acquire(self, tokens=1):
+        """ Take tokens if available. Return 0 on success or the seconds to wait otherwise. """
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """ Block until tokens are available. """
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """ Withhold tokens for `seconds`, e.g. after the server asked us to slow down. """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+# Requests per second and burst allowed for each endpoint class.
+DEFAULT_LIMITS = {
+    'iam': (5, 10),
+    'query': (20, 40),
+    'action': (10, 20),
+}
+
+
+class RateLimiter(object):
+    """ One token bucket per endpoint class: 'iam' for token requests, 'query' for reads
+    and 'action' for requests that change state. """
+
+    def __init__(self, limits=None):
+        self.buckets = {}
+        for endpoint_class, (qps, burst) in dict(DEFAULT_LIMITS, **(limits or {})).items():
+            self.configure(endpoint_class, qps, burst)
+
+    def configure(self, endpoint_class, qps, burst=None):
+        self.buckets[endpoint_class] = TokenBucket(qps, burst)
+
+    def acquire(self, endpoint_class):
+        self.buckets[endpoint_class].acquire()
+
+    def penalize(self, endpoint_class, seconds):
+        self.buckets[endpoint_class].penalize(seconds)
+
+
+def endpoint_class(method, url):
+    if '/v3/auth/tokens' in url:
+        return 'iam'
+    return method.upper() == 'GET' and 'query' or 'action'
+
+
+def parse_retry_after(value, default=1.0):
+    """ Seconds to wait according to a Retry-After header (delta-seconds or HTTP-date). """
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(mktime_tz(parsedate_tz(value)) - time.time(), 0)
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+rate_limiter = RateLimiter()
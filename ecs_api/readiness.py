@@ -0,0 +1,116 @@
+""" Wait for new servers to become usable: ACTIVE and accepting TCP connections (SSH).
+
+    waiter = ReadinessWaiter(api)
+    for server_id, result in waiter.wait(server_ids):   # in the order they become ready
+        run_tests(result['address'])
+
+The status of all servers is polled with one server listing per interval, however many
+servers are waited for, and the port of every ACTIVE server is probed concurrently, each
+probe with its own timeout. """
+
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+import logging
+import socket
+import time
+
+SERVER_FAILED = ('ERROR', 'DELETED')
+
+
+def server_address(server, floating=True):
+    """ The floating (EIP) address of server, or with floating=False its first fixed one. """
+    wanted = floating and 'floating' or 'fixed'
+    for addresses in (server.get('addresses') or {}).values():
+        for address in addresses:
+            if address.get('OS-EXT-IPS:type') == wanted and address.get('version', 4) == 4:
+                return address['addr']
+    return None
+
+
+def probe(address, port, timeout):
+    """ Whether a TCP connection to address:port can be made within timeout seconds. """
+    try:
+        sock = socket.create_connection((address, port), timeout)
+    except (socket.error, socket.timeout):
+        return False
+    sock.close()
+    return True
+
+
+class ReadinessWaiter(object):
+    """ Track many server IDs and release each one as soon as it is ready.
+
+    A server is ready when it is ACTIVE, has an address (its EIP, or with floating=False
+    its fixed IP) and accepts a TCP connection on `port`. Unreachable servers are probed
+    again on the next interval. port=None skips the probe. """
+
+    def __init__(self, api, port=22, floating=True, interval=5.0, probe_timeout=3.0, timeout=1800,
+                 workers=32, name=None):
+        self.api = api
+        self.port = port
+        self.floating = floating
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.timeout = timeout
+        self.workers = workers
+        # narrows the listing to servers with this name, e.g. the name of the create spec
+        self.name = name
+
+    def _probe(self, server_id, address):
+        return server_id, address, probe(address, self.port, self.probe_timeout)
+
+    def wait(self, server_ids):
+        """ Generator yielding (server_id, result) as soon as each server is ready, where
+        result is {'status': 'READY', 'address', 'elapsed'}. Servers that fail or are not
+        ready within the timeout are reported with status ERROR or TIMEOUT at the end. """
+        started = time.time()
+        waiting = dict((server_id, None) for server_id in server_ids)
+        probing = set()
+        results = Queue()
+        pool = ThreadPool(self.workers)
+        try:
+            next_poll = started
+            while waiting:
+                now = time.time()
+                if now - started > self.timeout:
+                    break
+                if now >= next_poll:
+                    next_poll = now + self.interval
+                    for server in self.api.iter_servers(name=self.name):
+                        server_id = server['id']
+                        if server_id not in waiting:
+                            continue
+                        waiting[server_id] = server.get('status')
+                        if server.get('status') in SERVER_FAILED:
+                            del waiting[server_id]
+                            yield server_id, {'status': 'ERROR', 'server_status': server.get('status'),
+                                              'elapsed': time.time() - started}
+                            continue
+                        address = server_address(server, self.floating)
+                        if server.get('status') != 'ACTIVE' or not address or server_id in probing:
+                            continue
+                        if self.port is None:
+                            del waiting[server_id]
+                            yield server_id, {'status': 'READY', 'address': address, 'elapsed': time.time() - started}
+                            continue
+                        probing.add(server_id)
+                        pool.apply_async(self._probe, (server_id, address), callback=results.put)
+                try:
+                    server_id, address, reachable = results.get(timeout=max(next_poll - time.time(), 0.01))
+                except Empty:
+                    continue
+                probing.discard(server_id)
+                if reachable and server_id in waiting:
+                    del waiting[server_id]
+                    yield server_id, {'status': 'READY', 'address': address, 'elapsed': time.time() - started}
+                else:
+                    logging.debug("%s:%s of server %s is not reachable yet" % (address, self.port, server_id))
+            for server_id, status in sorted(waiting.items()):
+                yield server_id, {'status': 'TIMEOUT', 'server_status': status, 'elapsed': time.time() - started}
+        finally:
+            pool.terminate()
+
+
+def wait_ready(api, server_ids, **kwargs):
+    """ Wait for all server_ids and return {server_id: result}. """
+    return dict(ReadinessWaiter(api, **kwargs).wait(server_ids))
@@ -0,0 +1,156 @@
+""" Incremental parsing of large listing responses.
+
+iter_array() yields the elements of one top-level array (e.g. "servers") of a JSON
+document while its body is still being downloaded, holding only the current element
+in memory. ijson is used when installed; otherwise a small scanner built on
+json.JSONDecoder.raw_decode does the same job. """
+
+from decimal import Decimal
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class _ChunkReader(object):
+    """ Minimal file-like wrapper over an iterable of byte chunks, for ijson. """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _ijson_use_float():
+    """ Whether ijson (3.1 and later) can yield floats instead of Decimals. """
+    try:
+        return isinstance(next(ijson.items(_ChunkReader(['[0.5]']), 'item', use_float=True)), float)
+    except TypeError:
+        return False
+
+
+IJSON_USE_FLOAT = ijson is not None and _ijson_use_float()
+
+
+def _floats(value):
+    """ value with the Decimals older ijson versions yield for non-integers made floats,
+    which the codecs can encode. """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, dict):
+        return dict((k, _floats(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [_floats(v) for v in value]
+    return value
+
+
+def _find_array(buf, key, state):
+    """ Scan buf from state['pos'] for `"key": [` at nesting depth one. Returns the index
+    after the '[' or None when more data is needed; state carries the scanner position. """
+    pos, depth = state['pos'], state['depth']
+    n = len(buf)
+    while pos < n:
+        c = buf[pos]
+        if c == '"':
+            end = pos + 1
+            while True:
+                end = buf.find('"', end)
+                if end < 0:
+                    state['pos'], state['depth'] = pos, depth
+                    return None
+                backslashes = 0
+                while buf[end - 1 - backslashes] == '\\':
+                    backslashes += 1
+                if backslashes % 2 == 0:
+                    break
+                end += 1
+            if depth == 1 and buf[pos + 1:end] == key:
+                colon = end + 1
+                while colon < n and buf[colon] in WHITESPACE + ':':
+                    colon += 1
+                if colon >= n:
+                    state['pos'], state['depth'] = pos, depth
+                    return None
+                if buf[colon] == '[':
+                    return colon + 1
+            pos = end + 1
+            continue
+        if c in '{[':
+            depth += 1
+        elif c in '}]':
+            depth -= 1
+        pos += 1
+    state['pos'], state['depth'] = pos, depth
+    return None
+
+
+def _iter_array_fallback(chunks, key):
+    chunks = iter(chunks)
+    buf = ''
+    state = {'pos': 0, 'depth': 0}
+    start = None
+    for chunk in chunks:
+        buf += chunk
+        start = _find_array(buf, key, state)
+        if start is not None:
+            break
+    if start is None:
+        return
+    buf = buf[start:]
+    pos = 0
+    exhausted = False
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE + ',':
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos >= len(buf):
+                raise ValueError("need more data")
+            item, end = _decoder.raw_decode(buf, pos)
+            # A number or literal is only complete once a delimiter follows it.
+            if not exhausted and not isinstance(item, (dict, list, basestring)) and \
+                    (end == len(buf) or buf[end] not in WHITESPACE + ',]'):
+                raise ValueError("need more data")
+        except ValueError:
+            if exhausted:
+                raise
+            try:
+                buf = buf[pos:] + next(chunks)
+            except StopIteration:
+                exhausted = True
+                buf = buf[pos:]
+            pos = 0
+            continue
+        yield item
+        pos = end
+        # Drop consumed input now and then so the buffer stays the size of a few elements.
+        if pos > 65536:
+            buf = buf[pos:]
+            pos = 0
+
+
+def iter_array(chunks, key):
+    """ Yield the elements of the top-level array `key` from an iterable of byte chunks. """
+    if IJSON_USE_FLOAT:
+        return ijson.items(_ChunkReader(chunks), key + '.item', use_float=True)
+    if ijson is not None:
+        return (_floats(item) for item in ijson.items(_ChunkReader(chunks), key + '.item'))
+    return _iter_array_fallback(chunks, key)
@@ -0,0 +1,120 @@
+from datetime import datetime
+from fileutil import file_lock, load_json, atomic_write_json
+import threading
+import atexit
+import hashlib
+import calendar
+import logging
+import time
+
+
+def parse_expires_at(expires_at):
+    """ Convert an IAM expires_at timestamp (UTC) into seconds since the epoch. """
+    return calendar.timegm(datetime.strptime(expires_at, '%Y-%m-%dT%H:%M:%S.%fZ').timetuple())
+
+
+class TokenCache(object):
+    """ Tokens keyed by (auth_url, domain, project, user).
+
+    Tokens are kept in memory for the life of the process and persisted to `path`
+    under a file lock, so parallel CLI processes sharing a home directory reuse one
+    token instead of all requesting their own. A token is considered stale
+    `refresh_margin` seconds before it expires; with `background` enabled it is
+    renewed by a timer thread before that happens.
+
+    Requests for different identities are made concurrently: each identity has its
+    own thread lock and lock file, and the shared file is only locked to merge the
+    new token in. """
+
+    def __init__(self, path, fetch, refresh_margin=600, background=True):
+        self.path = path
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self.tokens = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # Stop the refresh timers before interpreter shutdown tears down the modules they use.
+        atexit.register(self.cancel)
+
+    @staticmethod
+    def key(auth_url, project_name, domain_name, username):
+        return '|'.join([auth_url, domain_name, project_name, username])
+
+    def _fresh(self, j_token):
+        return j_token and parse_expires_at(j_token['expires_at']) - self.refresh_margin > time.time()
+
+    def _load(self):
+        j_tokens = load_json(self.path, {})
+        # Files written by older versions hold a single unkeyed token.
+        if 'token' in j_tokens:
+            return {}
+        return j_tokens
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def _key_lock_path(self, key):
+        return '%s.%s' % (self.path, hashlib.md5(key.encode('utf-8')).hexdigest()[:12])
+
+    def get(self, auth_url, project_name, domain_name, username, password, force=False):
+        """ Return a valid {'token', 'expires_at', 'project_id'} for the identity, requesting a
+        new token from IAM only when neither memory nor disk holds a fresh one. With force a
+        new token is always requested, e.g. after the old one was rejected with a 401. """
+        key = self.key(auth_url, project_name, domain_name, username)
+        j_token = self.tokens.get(key)
+        if not force and self._fresh(j_token):
+            return j_token
+        with self._key_lock(key):
+            j_token = self.tokens.get(key)
+            if not force and self._fresh(j_token):
+                return j_token
+            with file_lock(self._key_lock_path(key)):
+                j_token = self._load().get(key)
+                if force and j_token and j_token['token'] == self.tokens.get(key, {}).get('token'):
+                    j_token = None
+                if not self._fresh(j_token):
+                    j_token = self.fetch(auth_url, project_name, domain_name, username, password)
+                    with file_lock(self.path):
+                        j_tokens = dict((k, v) for k, v in self._load().items() if self._fresh(v))
+                        j_tokens[key] = j_token
+                        atomic_write_json(self.path, j_tokens)
+            self.tokens[key] = j_token
+        if self.background:
+            self._schedule(key, j_token, (auth_url, project_name, domain_name, username, password))
+        return j_token
+
+    def invalidate(self, auth_url, project_name, domain_name, username):
+        """ Forget the in-memory token of an identity. """
+        self.tokens.pop(self.key(auth_url, project_name, domain_name, username), None)
+
+    def cancel(self):
+        """ Stop all background refresh timers and wait for their threads to exit. """
+        timers = list(self.timers.values())
+        for timer in timers:
+            timer.cancel()
+        for timer in timers:
+            if timer is not threading.current_thread():
+                timer.join(1)
+
+    def _schedule(self, key, j_token, identity):
+        timer = self.timers.get(key)
+        if timer and timer.j_token is j_token:
+            return
+        if timer:
+            timer.cancel()
+        delay = max(parse_expires_at(j_token['expires_at']) - self.refresh_margin - time.time(), 0) + 1
+        timer = threading.Timer(delay, self._refresh, identity)
+        timer.daemon = True
+        timer.j_token = j_token
+        self.timers[key] = timer
+        timer.start()
+
+    def _refresh(self, *identity):
+        logging.debug("Refreshing token ahead of expiry")
+        try:
+            self.get(*identity)
+        except Exception:
+            logging.error("Background token refresh failed")
@@ -0,0 +1,202 @@
+""" Provisioning timelines: where the time goes between submitting a create request and
+having a usable server.
+
+    tracer = ProvisionTracer()
+    bulk_create(api, spec, count=500, tracer=tracer)   # records submit and job phases
+    tracer.follow(api)                                  # records BUILD -> ACTIVE and the EIP
+    tracer.write('timeline.json')
+    tracer.write_chrome_trace('timeline.trace')         # open in chrome://tracing or Perfetto
+
+Each server is tied to the creation job it was submitted under. The marks of a server, in
+seconds since the tracer was created, are:
+  submit_start, submit_end  the create_ecss call of its batch
+  job_running               the job was first seen RUNNING (INIT before that: queued)
+  job_done                  the job was first seen SUCCESS or FAIL
+  server_build              the server was first seen in BUILD
+  server_active             the server was first seen ACTIVE
+  eip_bound                 the server was first seen with a floating IP
+Job and server states are sampled by polling, so marks are late by up to one poll interval.
+"""
+
+from collections import OrderedDict
+from jobs import JOB_DONE
+import threading
+import logging
+import codec
+import time
+
+# Phases of a server timeline, as (name, start mark, end mark).
+PHASES = (
+    ('submit', 'submit_start', 'submit_end'),
+    ('job_queued', 'submit_end', 'job_running'),
+    ('job_running', 'job_running', 'job_done'),
+    ('boot', 'job_done', 'server_active'),
+    ('eip', 'server_active', 'eip_bound'),
+)
+
+SERVER_DONE = ('ACTIVE', 'ERROR', 'DELETED')
+
+
+def has_eip(server):
+    return any(address.get('OS-EXT-IPS:type') == 'floating'
+               for addresses in (server.get('addresses') or {}).values() for address in addresses)
+
+
+class ProvisionTracer(object):
+    """ Collects the marks of every job and server. The submitted/job_status/server_status
+    callbacks are thread-safe, so a tracer can be shared by concurrent submitters. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.time()
+        self.jobs = OrderedDict()
+        self.servers = OrderedDict()
+
+    def _now(self):
+        return time.time() - self.origin
+
+    def submitted(self, job_id, count, start, end):
+        """ A create_ecss call for count servers made between the times start and end
+        (time.time() values) was accepted as job_id. """
+        with self.lock:
+            self.jobs[job_id] = {'job_id': job_id, 'count': count, 'servers': [],
+                                 'marks': {'submit_start': start - self.origin, 'submit_end': end - self.origin}}
+
+    def job_status(self, job_id, j_content):
+        """ Feed every polled task status; suitable as JobWaiter's on_status. """
+        now = self._now()
+        status = j_content.get('status')
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            marks = job['marks']
+            if status == 'RUNNING' or status in JOB_DONE:
+                marks.setdefault('job_running', now)
+            if status in JOB_DONE:
+                marks.setdefault('job_done', now)
+                job['status'] = status
+            # sub-jobs carry the server IDs, while the job runs or once it is done
+            for sub_job in (j_content.get('entities') or {}).get('sub_jobs') or []:
+                server_id = (sub_job.get('entities') or {}).get('server_id')
+                if server_id and server_id not in self.servers:
+                    self.servers[server_id] = {'server_id': server_id, 'job_id': job_id, 'marks': {}}
+                    job['servers'].append(server_id)
+
+    def server_status(self, server):
+        """ Feed a server record from a listing or detail query. """
+        now = self._now()
+        with self.lock:
+            trace = self.servers.get(server['id'])
+            if trace is None:
+                return
+            marks = trace['marks']
+            trace['status'] = server.get('status')
+            if server.get('status') == 'BUILD':
+                marks.setdefault('server_build', now)
+            elif server.get('status') == 'ACTIVE':
+                marks.setdefault('server_active', now)
+            if has_eip(server):
+                marks.setdefault('eip_bound', now)
+
+    def pending(self, wait_eip=True):
+        """ IDs of the servers that are not usable (ACTIVE, with an EIP if wait_eip) yet. """
+        with self.lock:
+            return [server_id for server_id, trace in self.servers.items()
+                    if trace.get('status') not in SERVER_DONE or
+                    (wait_eip and trace.get('status') == 'ACTIVE' and 'eip_bound' not in trace['marks'])]
+
+    def follow(self, api, wait_eip=True, interval=2.0, timeout=1800, name=None):
+        """ Poll the server listing, one listing per interval, until every traced server is
+        ACTIVE (and has an EIP with wait_eip), failed, or timeout seconds have passed.
+        name narrows the listing to the servers of the spec. Returns the IDs still pending. """
+        deadline = time.time() + timeout
+        while True:
+            pending = set(self.pending(wait_eip))
+            if not pending or time.time() > deadline:
+                return sorted(pending)
+            seen = set()
+            for server in api.iter_servers(name=name):
+                if server['id'] in pending:
+                    self.server_status(server)
+                    seen.add(server['id'])
+            for server_id in pending - seen:
+                # deleted after a failed sub-job, or not listed yet
+                logging.debug("Server %s not found in the listing" % server_id)
+            time.sleep(interval)
+
+    def timelines(self):
+        """ One record per server: its job, marks and phase durations, ordered by server ID
+        within submission order. """
+        records = []
+        with self.lock:
+            for job in self.jobs.values():
+                for server_id in job['servers']:
+                    trace = self.servers[server_id]
+                    marks = dict(job['marks'], **trace['marks'])
+                    phases = OrderedDict()
+                    for phase, start, end in PHASES:
+                        if start in marks and end in marks:
+                            phases[phase] = max(marks[end] - marks[start], 0)
+                    if 'submit_start' in marks and ('eip_bound' in marks or 'server_active' in marks):
+                        phases['total'] = max(marks.get('eip_bound', 0), marks['server_active']) - marks['submit_start']
+                    records.append({'server_id': server_id, 'job_id': job['job_id'],
+                                    'status': trace.get('status'), 'marks': marks, 'phases': phases})
+        return records
+
+    def summary(self):
+        """ {phase: {'count', 'p50', 'p90', 'max'}} over all servers, in seconds. """
+        durations = OrderedDict((phase, []) for phase, _, _ in PHASES + (('total', None, None),))
+        for record in self.timelines():
+            for phase, seconds in record['phases'].items():
+                durations[phase].append(seconds)
+        result = OrderedDict()
+        for phase, values in durations.items():
+            if values:
+                values.sort()
+                result[phase] = {'count': len(values), 'p50': values[len(values) // 2],
+                                 'p90': values[min(int(len(values) * 0.9), len(values) - 1)], 'max': values[-1]}
+        return result
+
+    def to_json(self):
+        return {'origin': self.origin, 'jobs': list(self.jobs.values()), 'servers': self.timelines(),
+                'summary': self.summary()}
+
+    def to_chrome_trace(self):
+        """ Trace Event Format: one row per job with its submit/queued/running spans and one
+        row per server with its complete timeline. """
+        events = []
+
+        def span(pid, tid, name, start, end, args=None):
+            events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': int(start * 1e6),
+                           'dur': int(max(end - start, 0) * 1e6), 'args': args or {}})
+
+        def label(pid, tid, name):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'jobs'}})
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 2, 'args': {'name': 'servers'}})
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for tid, job in enumerate(jobs):
+            label(1, tid, 'job %s' % job['job_id'])
+            marks = job['marks']
+            for phase, start, end in PHASES[:3]:
+                if start in marks and end in marks:
+                    span(1, tid, phase, marks[start], marks[end], {'job_id': job['job_id'], 'count': job['count']})
+        for tid, record in enumerate(self.timelines()):
+            label(2, tid, 'server %s' % record['server_id'])
+            marks = record['marks']
+            for phase, start, end in PHASES:
+                if start in marks and end in marks:
+                    span(2, tid, phase, marks[start], marks[end],
+                         {'server_id': record['server_id'], 'job_id': record['job_id']})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as fp:
+            fp.write(codec.dumps(self.to_json()))
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as fp:
+            fp.write(codec.dumps(self.to_chrome_trace()))
@@ -0,0 +1,313 @@
+""" Warm pools of pre-provisioned ECSs, so that a test gets a server in seconds instead of
+waiting minutes for create_ecss.
+
+    pool = WarmPool(api)
+    pool.define('rhel7', spec, size=5, mode='stopped')
+    pool.maintain()                    # create the servers (blocking)
+    server = pool.lease('rhel7')       # {'id': ..., 'pool': 'rhel7', ...}
+    ...
+    pool.release(server['id'])         # recycled and handed out again
+    pool.replenish_async()             # recycle and top up in a background thread
+
+A pool keeps `size` servers of its create_ecss spec idle, either running or stopped (cheaper,
+started when leased). Released servers are restarted (running pools) or stopped (stopped
+pools) and reused, or with recycle='rebuild' deleted and replaced by new ones.
+
+The state is kept in ~/.ecs_pool.json under a file lock, so several processes can lease
+from and maintain the same pools. """
+
+from fileutil import file_lock, load_json, atomic_write_json
+from errors import ECSError
+from coalesce import batch_action, responses
+from bulk import bulk_create
+from jobs import wait_jobs
+import threading
+import logging
+import time
+import os
+
+pool_file = os.path.expanduser('~') + '/.ecs_pool.json'
+pool_log = os.path.expanduser('~') + '/.ecs_pool.log'
+
+MODES = ('running', 'stopped')
+RECYCLE = ('reuse', 'rebuild')
+
+# Seconds after which a create or recycle claimed by a process that did not finish it
+# is considered abandoned.
+CLAIM_TIMEOUT = 3600
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class WarmPool(object):
+    def __init__(self, api, path=None):
+        self.api = api
+        self.path = path or pool_file
+
+    def _load(self):
+        state = load_json(self.path) or {}
+        state.setdefault('pools', {})
+        state.setdefault('servers', {})
+        return state
+
+    def _update(self, func):
+        """ Apply func to the state under the file lock, save it and return func's result. """
+        with file_lock(self.path):
+            state = self._load()
+            result = func(state)
+            atomic_write_json(self.path, state)
+        return result
+
+    def _claims(self, state, name):
+        """ Drop abandoned creates of pool name and return the number of servers still being created. """
+        pool = state['pools'][name]
+        now = time.time()
+        pool['creating'] = [claim for claim in pool.get('creating', [])
+                            if _alive(claim['pid']) and now - claim['since'] < CLAIM_TIMEOUT]
+        for server in state['servers'].values():
+            if server['state'] == 'recycling' and (not _alive(server['pid']) or now - server['since'] > CLAIM_TIMEOUT):
+                server['state'] = 'released'
+        return sum(claim['count'] for claim in pool['creating'])
+
+    def define(self, name, spec, size, mode='running', recycle='reuse'):
+        """ Create or change pool name; spec is the create_ecss request body. """
+        if mode not in MODES:
+            raise ValueError("Unknown pool mode '%s', use one of: %s" % (mode, ', '.join(MODES)))
+        if recycle not in RECYCLE:
+            raise ValueError("Unknown recycle policy '%s', use one of: %s" % (recycle, ', '.join(RECYCLE)))
+
+        def define(state):
+            pool = state['pools'].setdefault(name, {'creating': []})
+            pool.update({'spec': spec, 'size': int(size), 'mode': mode, 'recycle': recycle})
+        self._update(define)
+
+    def remove(self, name):
+        """ Forget pool name and delete its idle servers; leased ones are deleted on release. """
+        def remove(state):
+            if name not in state['pools']:
+                raise ValueError("No pool named '%s'" % name)
+            del state['pools'][name]
+            idle = [server_id for server_id, server in state['servers'].items()
+                    if server['pool'] == name and server['state'] in ('ready', 'released')]
+            for server_id in idle:
+                del state['servers'][server_id]
+            return idle
+        idle = self._update(remove)
+        if idle:
+            self.api.delete_ecss(idle)
+        return idle
+
+    def status(self):
+        """ One record per pool with its settings and the number of servers in each state. """
+        state = self._load()
+        records = []
+        for name, pool in sorted(state['pools'].items()):
+            counts = dict((s, 0) for s in ('ready', 'leased', 'released', 'recycling'))
+            for server in state['servers'].values():
+                if server['pool'] == name:
+                    counts[server['state']] += 1
+            counts['creating'] = sum(claim['count'] for claim in pool.get('creating', []))
+            records.append(dict(counts, name=name, size=pool['size'], mode=pool['mode'], recycle=pool['recycle']))
+        return records
+
+    def lease(self, name, timeout=0, interval=2.0, holder=None):
+        """ Take a ready server of pool name, starting it first in a stopped pool. Waits up to
+        timeout seconds for one to become ready (run maintain() or replenish_async() to make
+        that happen) and raises LookupError if there is none. Returns the server record. """
+        deadline = time.time() + timeout
+
+        def take(state):
+            if name not in state['pools']:
+                raise ValueError("No pool named '%s'" % name)
+            ready = sorted((server['since'], server_id) for server_id, server in state['servers'].items()
+                           if server['pool'] == name and server['state'] == 'ready')
+            if not ready:
+                return None
+            server_id = ready[0][1]
+            server = state['servers'][server_id]
+            server.update({'state': 'leased', 'since': time.time(), 'holder': holder or os.getpid()})
+            return dict(server, id=server_id), state['pools'][name]['mode']
+
+        while True:
+            taken = self._update(take)
+            if taken is not None:
+                break
+            if time.time() >= deadline:
+                raise LookupError("No ready server in pool '%s'" % name)
+            time.sleep(interval)
+        server, mode = taken
+        if mode == 'stopped':
+            logging.info("Starting leased server %s" % server['id'])
+            try:
+                started = self._wait(self.api.start_ecss([server['id']]))
+            except Exception:
+                # hand it back to be replaced rather than leaving it leased forever
+                self.release(server['id'], rebuild=True)
+                raise
+            if not started:
+                self.release(server['id'], rebuild=True)
+                raise ECSError("Starting server %s of pool '%s' failed" % (server['id'], name))
+        return server
+
+    def release(self, server_id, rebuild=False):
+        """ Hand a leased server back; it is recycled by the next maintain(). """
+        def release(state):
+            server = state['servers'].get(server_id)
+            if server is None:
+                raise ValueError("Server %s does not belong to a pool" % server_id)
+            server.update({'state': 'released', 'since': time.time(), 'rebuild': rebuild})
+        self._update(release)
+
+    def _wait(self, j_content):
+        """ Wait for the job of an action and return whether it succeeded. """
+        if 'job_id' not in j_content:
+            return False
+        return wait_jobs(self.api, [j_content['job_id']])[j_content['job_id']].get('status') == 'SUCCESS'
+
+    def _recycle(self, name=None):
+        def claim(state):
+            claimed = {}
+            for server_id, server in state['servers'].items():
+                if server['state'] == 'released' and (name is None or server['pool'] == name):
+                    pool = state['pools'].get(server['pool'])
+                    rebuild = pool is None or server.get('rebuild') or pool['recycle'] == 'rebuild'
+                    claimed[server_id] = rebuild and 'delete' or pool['mode']
+                    server.update({'state': 'recycling', 'since': time.time(), 'pid': os.getpid()})
+            return claimed
+        claimed = self._update(claim)
+        deleted = [server_id for server_id, action in claimed.items() if action == 'delete']
+        for mode, action in (('running', 'restart'), ('stopped', 'stop')):
+            server_ids = [server_id for server_id, claimed_action in claimed.items() if claimed_action == mode]
+            if not server_ids:
+                continue
+            logging.info("Recycling %d servers with %s" % (len(server_ids), action))
+            results = batch_action(self.api, action, server_ids, wait=True)
+            ready = set(server_id for server_id, result in results.items()
+                        if result.successful() and result.get().get('status') == 'SUCCESS')
+            if ready:
+                self._set_state(ready, 'ready')
+            # reset failed, do not hand the servers out again
+            deleted.extend(server_id for server_id in server_ids if server_id not in ready)
+        if deleted:
+            logging.info("Deleting %d released servers" % len(deleted))
+            responses(batch_action(self.api, 'delete', deleted))
+            self._forget(deleted)
+        return len(claimed)
+
+    def _set_state(self, server_ids, new_state):
+        def set_state(state):
+            for server_id in server_ids:
+                if server_id in state['servers']:
+                    state['servers'][server_id].update({'state': new_state, 'since': time.time()})
+        self._update(set_state)
+
+    def _forget(self, server_ids):
+        def forget(state):
+            for server_id in server_ids:
+                state['servers'].pop(server_id, None)
+        self._update(forget)
+
+    def _replenish(self, name):
+        claim_id = '%d-%f' % (os.getpid(), time.time())
+
+        def plan(state):
+            pool = state.get('pools', {}).get(name)
+            if pool is None:
+                return None
+            creating = self._claims(state, name)
+            servers = [(server['since'], server_id) for server_id, server in state['servers'].items()
+                       if server['pool'] == name and server['state'] in ('ready', 'released', 'recycling')]
+            deficit = pool['size'] - len(servers) - creating
+            if deficit > 0:
+                pool['creating'].append({'id': claim_id, 'count': deficit, 'pid': os.getpid(), 'since': time.time()})
+                return pool, deficit, []
+            # shrink: drop the surplus of ready servers, newest first
+            surplus = [server_id for _, server_id in sorted(servers, reverse=True)
+                       if state['servers'][server_id]['state'] == 'ready'][:-deficit]
+            for server_id in surplus:
+                del state['servers'][server_id]
+            return pool, 0, surplus
+
+        planned = self._update(plan)
+        if planned is None:
+            return 0
+        pool, deficit, surplus = planned
+        if surplus:
+            logging.info("Deleting %d surplus servers of pool %s" % (len(surplus), name))
+            self.api.delete_ecss(surplus)
+        if not deficit:
+            return 0
+        logging.info("Creating %d servers for pool %s" % (deficit, name))
+        server_ids = []
+        try:
+            created = bulk_create(self.api, pool['spec'], deficit)['server_ids']
+            if created and pool['mode'] == 'stopped':
+                try:
+                    stopped = self._wait(self.api.stop_ecss(created))
+                except Exception:
+                    stopped = False
+                    logging.exception("Stopping new servers of pool %s failed" % name)
+                if not stopped:
+                    logging.error("Stopping new servers of pool %s failed, deleting them" % name)
+                    self.api.delete_ecss(created)
+                    created = []
+            server_ids = created
+        finally:
+            # the claim goes in any case, the servers only once they are in the pool's mode
+            def register(state):
+                if name in state['pools']:
+                    state['pools'][name]['creating'] = [claim for claim in state['pools'][name]['creating']
+                                                        if claim['id'] != claim_id]
+                for server_id in server_ids:
+                    state['servers'][server_id] = {'pool': name, 'state': 'ready', 'since': time.time()}
+            self._update(register)
+        return len(server_ids)
+
+    def maintain(self, name=None):
+        """ Recycle released servers and create or delete servers until every pool (or pool
+        name) has its size. Returns {'recycled', 'created'}. """
+        recycled = self._recycle(name)
+        names = name and [name] or sorted(self._load()['pools'])
+        created = sum(self._replenish(n) for n in names)
+        return {'recycled': recycled, 'created': created}
+
+    def replenish_async(self, name=None):
+        """ Run maintain() in a daemon thread and return the thread. """
+        def run():
+            try:
+                self.maintain(name)
+            except Exception:
+                logging.exception("Maintaining the warm pool failed")
+        thread = threading.Thread(target=run, name='ecs-warmpool')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def maintain_in_background(self, name=None):
+        """ Fork a detached process running maintain(), which outlives the calling CLI process. """
+        credentials = self.api.identity[1:]
+        pid = os.fork()
+        if pid:
+            return pid
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        logging.getLogger().handlers = []
+        logging.basicConfig(filename=pool_log, level=logging.INFO,
+                            format='%(asctime)s %(levelname)s %(message)s')
+        try:
+            # connections and token timers are not shared with the parent
+            from pool import pool_manager
+            from ecs_api import ECSApi
+            pool_manager.close()
+            WarmPool(ECSApi(*credentials), self.path).maintain(name)
+        except Exception:
+            logging.exception("Maintaining the warm pool failed")
+        os._exit(0)
@@ -0,0 +1,11 @@
+""" Imported first by every test: puts the ecs_api modules and the fake cloud on the path
+and points HOME, where the caches and state files live, at a scratch directory. """
+
+import tempfile
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.join(ROOT, 'ecs_api') not in sys.path:
+    sys.path[:0] = [os.path.join(ROOT, 'ecs_api'), os.path.join(ROOT, 'benchmarks')]
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='ecs-test-home-')
@@ -0,0 +1,168 @@
+""" The agent runs forwarded commands with the client's working directory, environment
+and output streams, several at a time. """
+
+from multiprocessing.pool import ThreadPool
+import subprocess
+import threading
+import tempfile
+import unittest
+import shutil
+import json
+import sys
+import os
+
+from support import ROOT
+from fakecloud import FakeCloud, FakeServer
+from agent import AgentServer, agent_socket
+from ecs_api import ECSApi
+
+
+class AgentTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer(FakeCloud(servers=3)).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+        cls.path = agent_socket
+        cls.server = AgentServer(ECSApi(), cls.path)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def setUp(self):
+        # the agent and the client each run in their own directory
+        self.cwd = os.getcwd()
+        self.agent_dir = tempfile.mkdtemp(prefix='ecs-test-agent-dir-')
+        self.client_dir = tempfile.mkdtemp(prefix='ecs-test-client-')
+        os.chdir(self.agent_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.agent_dir)
+        shutil.rmtree(self.client_dir)
+
+    def ecs(self, *argv, **variables):
+        """ Run the ecs CLI in client_dir, without credentials (but those in variables) so
+        that it has to forward. """
+        env = dict((name, value) for name, value in os.environ.items() if not name.startswith('ECS_'))
+        env.update({'PYTHONPATH': ROOT, 'ECS_PROJECTS': 'cn-east-2'}, **variables)
+        process = subprocess.Popen([sys.executable, '-c', 'import sys; from ecs_api.ecs import main; main(sys.argv)']
+                                   + list(argv), cwd=self.client_dir, env=env, stdin=open(os.devnull),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        return process.returncode, stdout, stderr
+
+    def test_relative_paths_resolve_in_client_directory(self):
+        rc, _, stderr = self.ecs('create', 'spec')
+        self.assertEqual(rc, 0, stderr)
+        with open(os.path.join(self.client_dir, 'ecs_json')) as fp:
+            json_ecs = json.load(fp)
+        self.assertFalse(os.path.exists(os.path.join(self.agent_dir, 'ecs_json')))
+
+        json_ecs['server']['name'] = 'relative'
+        with open(os.path.join(self.client_dir, 'fleet.json'), 'w') as fp:
+            json.dump(json_ecs, fp)
+        rc, stdout, stderr = self.ecs('apply', '--plan', 'fleet.json')
+        self.assertEqual(rc, 0, stderr)
+        self.assertIn('create_ecss', stdout)
+
+    def test_create_rejects_parallel_without_count(self):
+        reply = self.server.run(['create', '--parallel', '8', 'fleet.json'], self.client_dir, {})
+        self.assertEqual(reply['rc'], 1)
+        self.assertIn('--parallel requires --count', reply['stdout'])
+
+    def test_client_environment_is_forwarded(self):
+        rc, _, stderr = self.ecs('multi-list', 'quotas')
+        self.assertEqual(rc, 0, stderr)
+
+    def test_long_running_commands_run_locally(self):
+        served = self.server.served
+        for argv in (['wait', 'x'], ['task-status', '--wait', 'x'], ['pool', 'lease', 'p'], ['create', 'f.json']):
+            rc, _, _ = self.ecs(*argv)
+            # without credentials, the local run fails at the prompt
+            self.assertNotEqual(rc, 0)
+        self.assertEqual(self.server.served, served)
+
+    def test_other_tenants_run_locally(self):
+        served = self.server.served
+        rc, stdout, _ = self.ecs('flavors', ECS_PROJECT='eu-west-0', ECS_ENDPOINT='http://127.0.0.1:1/')
+        self.assertNotEqual(rc, 0)
+        self.assertNotIn('s1.medium', stdout)
+        self.assertEqual(self.server.served, served)
+
+    def test_foreign_identity(self):
+        self.assertIsNone(self.server.foreign_identity({}))
+        self.assertIsNone(self.server.foreign_identity(self.fake.env()))
+        for name, value in (('ECS_PROJECT', 'eu-west-0'), ('ECS_ENDPOINT', 'http://127.0.0.1:1/'),
+                            ('ECS_USERNAME', 'someone-else'), ('ECS_PASSWORD', 'other')):
+            env = dict(self.fake.env(), **{name: value})
+            self.assertEqual(self.server.foreign_identity(env), name)
+            self.assertIn('refused', self.server.run(['flavors'], self.client_dir, env))
+
+    def test_status_without_agent_fails(self):
+        rc, stdout, _ = self.ecs('agent', 'status', HOME=self.client_dir)
+        self.assertEqual(rc, 1)
+        self.assertIn('ecs agent is not running', stdout)
+        rc, stdout, _ = self.ecs('agent', 'status')
+        self.assertEqual(rc, 0)
+        self.assertEqual(json.loads(stdout)['pid'], os.getpid())
+
+    def test_usage_names_the_forwarded_command(self):
+        reply = self.server.run(['stop'], self.client_dir, {})
+        self.assertEqual(reply['rc'], 1)
+        self.assertIn("'ecs stop' requires at least 1 argument", reply['stderr'])
+        self.assertIn('Usage: ecs stop', reply['stdout'])
+
+    def test_concurrent_actions_share_calls(self):
+        server_ids = [server['id'] for server in self.server.api.iter_servers(detail=False)]
+        calls = self.server.coalescer.calls
+        pool = ThreadPool(len(server_ids))
+        try:
+            replies = pool.map(lambda server_id: self.server.run(['stop', server_id], self.client_dir, {}),
+                               server_ids)
+        finally:
+            pool.terminate()
+        job_ids = set(json.loads(reply['stdout'])['job_id'] for reply in replies)
+        self.assertLess(len(job_ids), len(server_ids))
+        self.assertEqual(self.server.coalescer.calls - calls, len(job_ids))
+
+    def test_client_environment(self):
+        reply = self.server.run(['multi-list', 'quotas'], self.client_dir, {})
+        self.assertEqual(reply['rc'], 1)
+        self.assertIn('No projects given', reply['stderr'])
+        reply = self.server.run(['multi-list', 'quotas'], self.client_dir, {'ECS_PROJECTS': 'cn-east-2'})
+        self.assertEqual(reply['rc'], 0, reply['stderr'])
+
+    def test_stderr_is_returned(self):
+        reply = self.server.run(['query', 'servers'], self.client_dir, {})
+        self.assertIn('Inventory has not been synced yet', reply['stderr'])
+        self.assertNotIn('Inventory', reply['stdout'])
+
+    def test_concurrent_commands_keep_their_output(self):
+        dirs = [tempfile.mkdtemp(dir=self.client_dir) for _ in range(8)]
+        commands = [(['create', 'spec'], d) for d in dirs] + [(['query', 'servers'], self.client_dir)] * 8
+        pool = ThreadPool(len(commands))
+        try:
+            replies = pool.map(lambda command: self.server.run(command[0], command[1], {}), commands)
+        finally:
+            pool.terminate()
+        for (argv, _), reply in zip(commands, replies):
+            self.assertEqual(reply['rc'], 0, reply['stderr'])
+            if argv[0] == 'query':
+                self.assertEqual(reply['stderr'].count('Inventory has not been synced yet'), 1)
+            else:
+                self.assertEqual(reply['stderr'], '')
+        for d in dirs:
+            self.assertTrue(os.path.exists(os.path.join(d, 'ecs_json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+""" The metadata cache keys on every argument, hands out copies, saves once and merges
+with the entries other processes saved. """
+
+import tempfile
+import unittest
+import shutil
+import os
+
+import support  # noqa: F401
+from cache import MetadataCache, cached
+import cache
+
+
+class Api(object):
+    base_url = 'https://ecs.example/'
+    project_id = 'p'
+
+    def __init__(self):
+        self.calls = []
+
+    @cached('flavors')
+    def flavors(self, az=None, detail=False):
+        self.calls.append((az, detail))
+        return [{'id': 's3.small', 'az': az, 'detail': detail}]
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ecs-test-cache-')
+        self.saved = cache.metadata_cache
+        cache.metadata_cache = MetadataCache(os.path.join(self.tmp, 'cache'))
+
+    def tearDown(self):
+        cache.metadata_cache = self.saved
+        shutil.rmtree(self.tmp)
+
+    def test_keyword_arguments_are_part_of_the_key(self):
+        api = Api()
+        self.assertEqual(api.flavors(detail=True)[0]['detail'], True)
+        self.assertEqual(api.flavors(detail=False)[0]['detail'], False)
+        self.assertEqual(api.flavors(detail=True)[0]['detail'], True)
+        self.assertEqual(api.flavors('az1')[0]['az'], 'az1')
+        self.assertEqual(api.calls, [(None, True), (None, False), ('az1', False)])
+
+    def test_callers_get_copies(self):
+        api = Api()
+        api.flavors()[0]['id'] = 'changed'
+        api.flavors()[0]['id'] = 'changed again'
+        self.assertEqual(api.flavors()[0]['id'], 's3.small')
+
+    def test_saved_once(self):
+        api = Api()
+        for az in ('az1', 'az2', 'az3'):
+            api.flavors(az)
+        self.assertFalse(os.path.exists(cache.metadata_cache.path))
+        cache.metadata_cache.save()
+        reloaded = MetadataCache(cache.metadata_cache.path)
+        reloaded._ensure_loaded()
+        self.assertEqual(len(reloaded.entries), 3)
+
+    def test_concurrent_saves_merge(self):
+        path = cache.metadata_cache.path
+        first, second = MetadataCache(path), MetadataCache(path)
+        first.put('flavors', 'flavors|shared', 'first')
+        first.put('flavors', 'flavors|stale', 'first')
+        first.save()
+        second.put('images', 'images|second', 'second')
+        second.put('flavors', 'flavors|shared', 'second')
+        first.put('vpcs', 'vpcs|first', 'first')
+        first.invalidate('flavors')
+        # each save keeps the entries of the other process; the latest expiry wins, so only
+        # the flavors entry first invalidated and nobody saved again stays dropped
+        second.save()
+        first.save()
+        reloaded = MetadataCache(path)
+        reloaded._ensure_loaded()
+        self.assertEqual(dict((key, value) for key, (_, value) in reloaded.entries.items()),
+                         {'flavors|shared': 'second', 'images|second': 'second', 'vpcs|first': 'first'})
+
+
+if __name__ == '__main__':
+    unittest.main()
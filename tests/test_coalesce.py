@@ -0,0 +1,38 @@
+""" Batched server actions are split into calls of MAX_BATCH servers. """
+
+import unittest
+import os
+
+import support  # noqa: F401
+from fakecloud import FakeCloud, FakeServer
+from coalesce import batch_action, responses, MAX_BATCH
+from ecs_api import ECSApi
+
+
+class BatchActionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer(FakeCloud(servers=MAX_BATCH * 2 + 10, job_duration=0)).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+        cls.api = ECSApi()
+        cls.server_ids = [server['id'] for server in cls.api.iter_servers(detail=False)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def test_split_into_batches(self):
+        results = batch_action(self.api, 'stop', self.server_ids)
+        self.assertEqual(list(results), self.server_ids)
+        self.assertEqual(len(set(j_content['job_id'] for j_content in responses(results))), 3)
+
+    def test_wait_for_jobs(self):
+        results = batch_action(self.api, 'start', self.server_ids[:5], wait=True)
+        self.assertEqual(set(result.get()['status'] for result in results.values()), set(['SUCCESS']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+""" plan_fleet and execute against the fake cloud: a spec is reconciled with few calls,
+and a reconciled fleet plans nothing. """
+
+import unittest
+import copy
+import os
+
+import support  # noqa: F401
+from fakecloud import FakeCloud, FakeServer, FLAVORS
+from fleet import plan_fleet, execute, fleet_servers, _device
+from ecs_api import ECSApi
+
+
+class FleetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cloud = FakeCloud(job_duration=0)
+        cls.fake = FakeServer(cls.cloud).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+        cls.api = ECSApi()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def spec(self, name, count):
+        spec = copy.deepcopy(self.api.default_server_spec())
+        spec['server'].update({'name': name, 'count': count, 'flavorRef': FLAVORS[0]})
+        return spec
+
+    def plan(self, spec):
+        return [(step.action, step.detail) for step in plan_fleet(self.api, spec)]
+
+    def apply(self, spec):
+        steps = plan_fleet(self.api, spec)
+        outcomes = execute(self.api, steps, parallel=4)
+        self.assertEqual(set(outcome['status'] for outcome in outcomes.values()), set(['SUCCESS']), outcomes)
+        self.assertEqual(plan_fleet(self.api, spec), [])
+
+    def test_create_then_nothing_to_do(self):
+        spec = self.spec('create', 3)
+        self.assertEqual(self.plan(spec), [('create_ecss', {'count': 3})])
+        self.apply(spec)
+        self.assertEqual(len(fleet_servers(self.api, 'create')), 3)
+
+    def test_shrink_keeps_the_oldest(self):
+        spec = self.spec('shrink', 3)
+        self.apply(spec)
+        servers = sorted(fleet_servers(self.api, 'shrink'), key=lambda server: server['created'])
+        spec['server']['count'] = 1
+        steps = plan_fleet(self.api, spec)
+        self.assertEqual([step.action for step in steps], ['delete_ecss'])
+        self.assertNotIn(servers[0]['id'], steps[0].detail['servers'])
+        self.apply(spec)
+
+    def test_resize_and_add_nics(self):
+        spec = self.spec('change', 2)
+        self.apply(spec)
+        spec['server']['flavorRef'] = FLAVORS[1]
+        spec['server']['nics'] = spec['server']['nics'] * 2
+        steps = plan_fleet(self.api, spec)
+        self.assertEqual(sorted(step.action for step in steps), ['add_nics'] * 2 + ['resize_ecs'] * 2)
+        # the NICs of a server are added after its resize
+        for step in steps:
+            if step.action == 'add_nics':
+                self.assertEqual([dep.action for dep in step.depends], ['resize_ecs'])
+                self.assertEqual(step.depends[0].target, step.target)
+        self.apply(spec)
+
+    def test_missing_data_volumes(self):
+        spec = self.spec('disks', 2)
+        self.apply(spec)
+        spec['server']['data_volumes'] = spec['server']['data_volumes'] + [{'volumetype': 'SSD', 'size': 20}] * 2
+        steps = plan_fleet(self.api, spec)
+        # one create_evss call for the four disks, then one attach per disk
+        self.assertEqual(sorted(step.action for step in steps), ['attach_volume'] * 4 + ['create_evss'])
+        create = [step for step in steps if step.action == 'create_evss'][0]
+        self.assertEqual(create.detail, {'size': 20, 'volume_type': 'SSD', 'count': 4})
+        self.apply(spec)
+
+    def test_device_names(self):
+        self.assertEqual([_device(i) for i in (0, 1, 25, 26, 27, 51, 52, 701, 702)],
+                         ['/dev/sda', '/dev/sdb', '/dev/sdz', '/dev/sdaa', '/dev/sdab', '/dev/sdaz', '/dev/sdba',
+                          '/dev/sdzz', '/dev/sdaaa'])
+
+    def test_broken_servers_are_replaced(self):
+        spec = self.spec('broken', 2)
+        self.apply(spec)
+        broken = fleet_servers(self.api, 'broken')[0]['id']
+        with self.cloud.lock:
+            self.cloud.servers[broken]['status'] = 'ERROR'
+        self.assertEqual(self.plan(spec), [('delete_ecss', {'servers': [broken]}), ('create_ecss', {'count': 1})])
+        self.apply(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
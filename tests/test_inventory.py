@@ -0,0 +1,106 @@
+""" Syncing the inventory twice against the fake cloud only rewrites what changed, drops
+what was deleted, and answers filtered queries from the index. """
+
+import tempfile
+import unittest
+import shutil
+import os
+
+import support  # noqa: F401
+from fakecloud import FakeCloud, FakeServer
+from inventory import Inventory
+from ecs_api import ECSApi
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeServer(FakeCloud(servers=6, volumes=12, publicips=2, job_duration=0)).start()
+        self.cloud = self.fake.cloud
+        self.saved_env = dict(os.environ)
+        os.environ.update(self.fake.env())
+        self.api = ECSApi()
+        self.tmp = tempfile.mkdtemp(prefix='ecs-test-inventory-')
+        self.inventory = Inventory(os.path.join(self.tmp, 'inventory.db'))
+
+    def tearDown(self):
+        self.inventory.close()
+        shutil.rmtree(self.tmp)
+        self.fake.stop()
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+
+    def ids(self, resource, **filters):
+        key = 'port_id' if resource == 'nics' else 'id'
+        return sorted(row[key] for row in self.inventory.query(resource, filters))
+
+    def test_second_sync_is_incremental(self):
+        self.assertIsNone(self.inventory.synced_at())
+        self.assertEqual(self.inventory.sync(self.api), {'servers': 6, 'volumes': 12, 'nics': 6, 'publicips': 2})
+        self.assertIsNotNone(self.inventory.synced_at())
+        self.assertEqual(self.inventory.sync(self.api), {'servers': 0, 'volumes': 0, 'nics': 0, 'publicips': 2})
+
+        server_ids = sorted(self.cloud.servers)
+        self.api.modify_ecs_info(server_ids[0], 'renamed')
+        with self.cloud.lock:
+            volume = self.cloud.volumes[sorted(self.cloud.volumes)[0]]
+            volume['updated_at'] = '2017-03-02T09:00:00.000000'
+            volume['volume_type'] = 'GPSSD'
+        # only the changed server is listed and has its NICs read again
+        self.assertEqual(self.inventory.sync(self.api), {'servers': 1, 'volumes': 1, 'nics': 1, 'publicips': 2})
+        self.assertEqual(self.ids('servers', name='renamed'), [server_ids[0]])
+        self.assertEqual(self.ids('volumes', volume_type='GPSSD'), [volume['id']])
+        self.assertEqual(len(self.ids('servers')), 6)
+
+    def test_deleted_servers_and_volumes_are_dropped(self):
+        self.inventory.sync(self.api)
+        server_ids = sorted(self.cloud.servers)
+        volume_ids = sorted(self.cloud.volumes)
+        self.api.delete_ecss(server_ids[:2])
+        with self.cloud.lock:
+            self.cloud.advance()
+            del self.cloud.volumes[volume_ids[-1]]
+            self.cloud._changed('volumes')
+        counts = self.inventory.sync(self.api)
+        self.assertEqual(counts['servers'], 0)
+        self.assertEqual(self.ids('servers'), server_ids[2:])
+        self.assertEqual(self.ids('nics', server=server_ids[0]), [])
+        self.assertNotIn(volume_ids[-1], self.ids('volumes'))
+        # delete_ecss deletes their volumes too
+        self.assertEqual(self.ids('volumes', server=server_ids[0]), [])
+
+    def test_full_sync_drops_servers_missing_from_the_listing(self):
+        self.inventory.sync(self.api)
+        with self.cloud.lock:
+            # gone without a DELETED record, which changes-since cannot see
+            gone = sorted(self.cloud.servers)[-1]
+            del self.cloud.servers[gone]
+            self.cloud._changed('servers')
+        self.inventory.sync(self.api)
+        self.assertIn(gone, self.ids('servers'))
+        self.assertEqual(self.inventory.sync(self.api, full=True)['servers'], 5)
+        self.assertNotIn(gone, self.ids('servers'))
+
+    def test_query_filters(self):
+        self.inventory.sync(self.api)
+        servers = sorted(self.cloud.servers.values(), key=lambda server: server['id'])
+        self.assertEqual(self.ids('servers', name='avocado_cloud-000[12]'), [servers[1]['id'], servers[2]['id']])
+        self.assertEqual(self.ids('servers', status='SHUTOFF', az='cn-east-2b'), [servers[1]['id'], servers[4]['id']])
+        # joins through the attachments, volumes, NICs and elastic IPs
+        volume = self.cloud.volumes[sorted(self.cloud.volumes)[1]]
+        attached_to = volume['attachments'][0]['server_id']
+        self.assertEqual(self.ids('servers', volume=volume['id']), [attached_to])
+        self.assertEqual(self.ids('volumes', server=attached_to), sorted(
+            v['id'] for v in self.cloud.volumes.values() if any(a['server_id'] == attached_to
+                                                                for a in v['attachments'])))
+        self.assertIn(attached_to, self.ids('servers', volume_type=volume['volume_type']))
+        address = self.cloud.nics[servers[3]['id']][0]['fixed_ips'][0]['ip_address']
+        self.assertEqual(self.ids('servers', ip=address), [servers[3]['id']])
+        eip = sorted(self.cloud.publicips.values(), key=lambda p: p['id'])[0]
+        self.assertEqual(self.ids('servers', eip=eip['public_ip_address']), [servers[0]['id']])
+        self.assertEqual([row['server_id'] for row in self.inventory.query('eips', {'ip': eip['public_ip_address']})],
+                         [servers[0]['id']])
+        self.assertRaises(ValueError, self.inventory.query, 'servers', {'size': '*'})
+
+
+if __name__ == '__main__':
+    unittest.main()
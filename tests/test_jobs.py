@@ -0,0 +1,130 @@
+""" The job waiter's poll schedule, backoff, budget and per-job failures, on a fake clock. """
+
+from Queue import Queue, Empty
+import unittest
+
+import support  # noqa: F401
+from test_ratelimit import FakeClock
+from jobs import JobWaiter
+import ratelimit
+import jobs
+
+
+class SyncPool(object):
+    """ Stands in for ThreadPool: runs each call at once, so that an empty result queue
+    means no poll is in flight. """
+
+    def __init__(self, workers):
+        pass
+
+    def apply_async(self, func, args, callback):
+        callback(func(*args))
+
+    def terminate(self):
+        pass
+
+
+class FakeQueue(Queue):
+    """ A result queue on the fake clock: waiting on it while empty moves time forward. """
+
+    def __init__(self, clock):
+        Queue.__init__(self)
+        self.clock = clock
+
+    def get(self, block=True, timeout=None):
+        if self.empty():
+            self.clock.sleep(timeout)
+            raise Empty
+        return Queue.get(self, block, timeout)
+
+
+class NoJitter(object):
+    @staticmethod
+    def uniform(a, b):
+        return (a + b) / 2.0
+
+
+class FakeApi(object):
+    """ Answers each poll of a job with the next of its scripted statuses, raising the
+    exceptions among them. """
+
+    def __init__(self, clock, **statuses):
+        self.clock = clock
+        self.statuses = statuses
+        self.polls = {}
+
+    def query_task_status(self, job_id):
+        self.polls.setdefault(job_id, []).append(self.clock.now)
+        status = self.statuses[job_id].pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return {'job_id': job_id, 'status': status}
+
+
+class JobWaiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = jobs.time, jobs.random, jobs.ThreadPool, jobs.Queue, ratelimit.time
+        jobs.time = ratelimit.time = self.clock
+        jobs.random = NoJitter
+        jobs.ThreadPool = SyncPool
+        jobs.Queue = lambda: FakeQueue(self.clock)
+
+    def tearDown(self):
+        jobs.time, jobs.random, jobs.ThreadPool, jobs.Queue, ratelimit.time = self.saved
+
+    def wait(self, api, **kwargs):
+        kwargs.setdefault('budget', 1024)
+        waiter = JobWaiter(api, interval=2, max_interval=8, backoff=1.5, **kwargs)
+        for job_id in sorted(api.statuses):
+            waiter.add(job_id)
+        return list(waiter.wait())
+
+    def offsets(self, api, job_id):
+        return [t - api.polls[job_id][0] for t in api.polls[job_id]]
+
+    def test_backoff_until_capped(self):
+        api = FakeApi(self.clock, a=['RUNNING'] * 6 + ['SUCCESS'])
+        self.assertEqual(self.wait(api), [('a', {'job_id': 'a', 'status': 'SUCCESS'})])
+        # delays 2, 3, 4.5, 6.75, then capped at 8
+        self.assertEqual(self.offsets(api, 'a'), [0, 2, 5, 9.5, 16.25, 24.25, 32.25])
+
+    def test_status_change_resets_the_delay(self):
+        api = FakeApi(self.clock, a=['INIT', 'INIT', 'RUNNING', 'RUNNING', 'FAIL'])
+        self.assertEqual(self.wait(api)[0][1]['status'], 'FAIL')
+        self.assertEqual(self.offsets(api, 'a'), [0, 2, 5, 7, 10])
+
+    def test_jobs_complete_in_schedule_order(self):
+        api = FakeApi(self.clock, a=['RUNNING'] * 3 + ['SUCCESS'], b=['RUNNING', 'SUCCESS'],
+                      c=['SUCCESS'])
+        self.assertEqual([job_id for job_id, _ in self.wait(api)], ['c', 'b', 'a'])
+        self.assertEqual(self.offsets(api, 'a'), [0, 2, 5, 9.5])
+        self.assertEqual(self.offsets(api, 'b'), [0, 2])
+
+    def test_polls_share_the_budget(self):
+        api = FakeApi(self.clock, a=['SUCCESS'], b=['SUCCESS'], c=['SUCCESS'])
+        start = self.clock.now
+        self.wait(api, budget=1)
+        self.assertEqual([api.polls[job_id][0] - start for job_id in 'abc'], [0, 1, 2])
+
+    def test_poll_errors_are_reported_per_job(self):
+        api = FakeApi(self.clock, a=['RUNNING', ValueError('gone'), 'SUCCESS'],
+                      b=[ValueError('broken')] * 3)
+        results = dict(self.wait(api, max_errors=3))
+        self.assertEqual(results['a']['status'], 'SUCCESS')
+        self.assertEqual(results['b'], {'job_id': 'b', 'status': 'ERROR', 'error': 'broken'})
+        # an error keeps the status, so the delay grows
+        self.assertEqual(self.offsets(api, 'a'), [0, 2, 5])
+        self.assertEqual(len(api.polls['b']), 3)
+
+    def test_timeout(self):
+        api = FakeApi(self.clock, a=['RUNNING'] * 10, b=['RUNNING', 'SUCCESS'])
+        results = dict(self.wait(api, timeout=10))
+        self.assertEqual(results['a'], {'job_id': 'a', 'status': 'TIMEOUT'})
+        self.assertEqual(results['b']['status'], 'SUCCESS')
+        # polled at 0, 2, 5 and 9.5; the next one, due at 16.25, finds the job timed out
+        self.assertEqual(self.offsets(api, 'a'), [0, 2, 5, 9.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
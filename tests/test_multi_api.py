@@ -0,0 +1,88 @@
+""" Each scope of a MultiScopeApi uses its own token, and its results and failures stay
+its own. """
+
+import unittest
+import os
+
+import support  # noqa: F401
+from fakecloud import FakeCloud, FakeServer, FakeError
+from multi_api import MultiScopeApi
+from pool import pool_manager
+
+PROJECTS = ['cn-east-2', 'cn-north-1', 'cn-north-1_test']
+
+
+class ScopedCloud(FakeCloud):
+    """ Refuses tokens for the eu-bad project and records the tokens requests are made with. """
+
+    def __init__(self, **kwargs):
+        FakeCloud.__init__(self, **kwargs)
+        self.used = set()
+
+    def issue_token(self, body):
+        if body['auth']['scope']['project']['name'] == 'eu-bad':
+            raise FakeError(401, 'IAM.0002', 'Project eu-bad does not exist')
+        return FakeCloud.issue_token(self, body)
+
+    def check_token(self, token):
+        FakeCloud.check_token(self, token)
+        with self.lock:
+            self.used.add(token)
+
+
+class MultiScopeApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer(ScopedCloud(servers=2)).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def test_scoped_tokens(self):
+        with MultiScopeApi(PROJECTS) as api:
+            self.assertEqual(list(api.apis), PROJECTS)
+            tokens = [api.apis[project].token for project in PROJECTS]
+            self.assertEqual(len(set(tokens)), len(PROJECTS))
+            for project, token in zip(PROJECTS, tokens):
+                self.assertEqual(self.fake.cloud.tokens[token][1], project)
+            self.fake.cloud.used.clear()
+            servers, errors = api.servers()
+        self.assertEqual(errors, {})
+        self.assertEqual(self.fake.cloud.used, set(tokens))
+        self.assertEqual(sorted((s['project'], s['region']) for s in servers),
+                         sorted((project, project.split('_')[0]) for project in PROJECTS for _ in range(2)))
+
+    def test_failures_stay_in_their_scope(self):
+        with MultiScopeApi(PROJECTS + ['eu-bad']) as api:
+            self.assertEqual(list(api.errors), ['eu-bad'])
+
+            def quota(scope):
+                if scope.project_name == 'cn-north-1':
+                    raise ValueError("quota unavailable")
+                return scope.project_name
+            results, errors = api.fan_out(quota)
+        self.assertEqual(dict(results), {'cn-east-2': 'cn-east-2', 'cn-north-1_test': 'cn-north-1_test'})
+        self.assertEqual(list(errors), ['cn-north-1', 'eu-bad'])
+        self.assertIsInstance(errors['cn-north-1'], ValueError)
+
+    def test_pool_only_grows(self):
+        adapter = pool_manager.session() and pool_manager._adapter
+        connections = pool_manager.settings['pool_connections']
+        MultiScopeApi(PROJECTS).close()
+        self.assertIs(pool_manager._adapter, adapter)
+        regions = ['region-%d' % i for i in range(connections)]
+        try:
+            MultiScopeApi(regions).close()
+            self.assertEqual(pool_manager.settings['pool_connections'], 2 * len(regions))
+            self.assertIsNot(pool_manager._adapter, adapter)
+        finally:
+            pool_manager.configure(pool_connections=connections)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+""" The table writer streams rows once its sizing window is full. """
+
+from StringIO import StringIO
+import unittest
+
+import support  # noqa: F401
+from output import TableWriter, TABLE_SIZING_ROWS
+
+
+class TableWriterTest(unittest.TestCase):
+    def test_rows_are_written_while_the_source_runs(self):
+        fp = StringIO()
+        writer = TableWriter(fp, [("ID", "id"), ("Name", "name")])
+        seen = []
+
+        def records():
+            for i in range(TABLE_SIZING_ROWS + 10):
+                seen.append(fp.getvalue().count('\n'))
+                yield {'id': str(i), 'name': 'server-%d' % i}
+
+        writer.writerows(records())
+        writer.close()
+        # nothing before the window is full, then the header and every row so far
+        self.assertEqual(seen[:TABLE_SIZING_ROWS], [0] * TABLE_SIZING_ROWS)
+        self.assertEqual(seen[TABLE_SIZING_ROWS:], range(TABLE_SIZING_ROWS + 1, TABLE_SIZING_ROWS + 11))
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(len(lines), TABLE_SIZING_ROWS + 11)
+        self.assertEqual(lines[0].split(), ["ID", "Name"])
+
+    def test_short_tables_are_written_on_close(self):
+        fp = StringIO()
+        writer = TableWriter(fp, [("ID", "id")])
+        writer.writerows([{'id': 'a'}, {'id': 'bb'}])
+        self.assertEqual(fp.getvalue(), '')
+        writer.close()
+        self.assertEqual(fp.getvalue(), 'ID\na\nbb\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
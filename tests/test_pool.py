@@ -0,0 +1,68 @@
+""" The shared connection pool is sized for the built-in workers and rebuilt when its settings change. """
+
+from multiprocessing.pool import ThreadPool
+import unittest
+import inspect
+
+import support  # noqa: F401
+from fakecloud import FakeServer
+from pool import PoolManager, MAX_WORKERS
+from async_api import AsyncECSSession
+
+
+class PoolManagerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def get(self, manager, count, workers):
+        pool = ThreadPool(workers)
+        try:
+            pool.map(lambda _: manager.session().get(self.fake.url + 'v3/projects').close(), range(count))
+        finally:
+            pool.terminate()
+        return manager.stats().values()[0]
+
+    def test_default_fits_the_built_in_workers(self):
+        workers = inspect.getargspec(AsyncECSSession.__init__).defaults[-1]
+        self.assertGreaterEqual(MAX_WORKERS, workers)
+        self.assertEqual(PoolManager().settings['pool_maxsize'], MAX_WORKERS)
+
+    def test_growing_mounts_a_larger_pool(self):
+        manager = PoolManager(pool_maxsize=2)
+        self.get(manager, 4, 1)
+        adapter = manager._adapter
+        manager.configure(pool_maxsize=8)
+        self.assertIsNot(manager._adapter, adapter)
+        self.assertIs(manager.session().get_adapter(self.fake.url), manager._adapter)
+        # up to 8 concurrent requests get a kept connection each
+        self.get(manager, 64, 8)
+        pools = manager._adapter.poolmanager.pools
+        pool = pools.get(pools.keys()[0])
+        self.assertEqual(pool.pool.maxsize, 8)
+        self.assertLessEqual(pool.num_connections, 8)
+        manager.close()
+
+    def test_unchanged_settings_keep_the_pool(self):
+        manager = PoolManager(pool_maxsize=2)
+        self.get(manager, 1, 1)
+        adapter = manager._adapter
+        manager.configure(pool_maxsize=2)
+        self.assertIs(manager._adapter, adapter)
+        manager.close()
+
+    def test_other_changes_rebuild(self):
+        manager = PoolManager(pool_maxsize=2)
+        self.get(manager, 1, 1)
+        adapter = manager._adapter
+        manager.configure(pool_maxsize=1)
+        self.assertIsNot(manager._adapter, adapter)
+        manager.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+""" prefetch() stops its thread and closes the source once the caller stops iterating. """
+
+import threading
+import unittest
+
+import support  # noqa: F401
+from ecs_api import prefetch
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.closed = threading.Event()
+        self.produced = []
+
+    def pages(self, count):
+        try:
+            for i in range(count):
+                self.produced.append(i)
+                yield i
+        finally:
+            self.closed.set()
+
+    def test_yields_every_item(self):
+        self.assertEqual(list(prefetch(self.pages(5))), range(5))
+        self.assertTrue(self.closed.wait(5))
+
+    def test_early_stop_closes_the_source(self):
+        items = prefetch(self.pages(1000), poll=0.01)
+        self.assertEqual(next(items), 0)
+        items.close()
+        self.assertTrue(self.closed.wait(5))
+        # no more than the item queued and the one waiting to be put
+        self.assertLessEqual(len(self.produced), 3)
+
+    def test_errors_reach_the_caller(self):
+        def pages():
+            yield 1
+            raise ValueError("page 2")
+        items = prefetch(pages())
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
+
+
+if __name__ == '__main__':
+    unittest.main()
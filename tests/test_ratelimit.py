@@ -0,0 +1,103 @@
+""" Token buckets and Retry-After parsing, on a fake clock. """
+
+from email.utils import formatdate
+import unittest
+
+import support  # noqa: F401
+from ratelimit import TokenBucket, RateLimiter, endpoint_class, parse_retry_after
+import ratelimit
+
+
+class FakeClock(object):
+    """ Stands in for the time module: sleep() moves time() forward. The tests use
+    rates and delays that are exact in binary, so that token counts compare equal. """
+
+    def __init__(self, now=1048576.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = ratelimit.time
+        ratelimit.time = self.clock
+
+    def tearDown(self):
+        ratelimit.time = self.saved
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(8, burst=4)
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [0] * 4)
+        self.assertEqual(bucket.try_acquire(), 0.125)
+        self.clock.now += 0.125
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0.125)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(10, burst=5)
+        for _ in range(5):
+            bucket.try_acquire()
+        self.clock.now += 60
+        self.assertEqual([bucket.try_acquire() for _ in range(5)], [0] * 5)
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_default_burst(self):
+        self.assertEqual(TokenBucket(20).capacity, 20)
+        self.assertEqual(TokenBucket(0.5).capacity, 1)
+
+    def test_acquire_sleeps_until_tokens(self):
+        bucket = TokenBucket(4, burst=1)
+        start = self.clock.now
+        for _ in range(5):
+            bucket.acquire()
+        self.assertEqual(self.clock.now - start, 1.0)
+        self.assertEqual(len(self.clock.slept), 4)
+
+    def test_penalize(self):
+        bucket = TokenBucket(8, burst=8)
+        bucket.penalize(2)
+        # the tokens left are dropped and two seconds' worth are owed
+        self.assertEqual(bucket.try_acquire(), 2.125)
+        self.clock.now += 2.125
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_rate_limiter_classes(self):
+        limiter = RateLimiter({'query': (1, 1)})
+        self.assertEqual(limiter.buckets['query'].capacity, 1)
+        self.assertEqual(limiter.buckets['action'].rate, ratelimit.DEFAULT_LIMITS['action'][0])
+        limiter.acquire('query')
+        limiter.acquire('query')
+        self.assertEqual(self.clock.slept, [1.0])
+
+    def test_endpoint_class(self):
+        self.assertEqual(endpoint_class('POST', 'https://iam.example/v3/auth/tokens'), 'iam')
+        self.assertEqual(endpoint_class('get', 'https://ecs.example/v1/p/cloudservers/detail'), 'query')
+        self.assertEqual(endpoint_class('DELETE', 'https://ecs.example/v1/p/cloudservers/x'), 'action')
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('3'), 3)
+        self.assertEqual(parse_retry_after('0.5'), 0.5)
+        self.assertEqual(parse_retry_after('-4'), 0)
+
+    def test_http_date(self):
+        self.assertAlmostEqual(parse_retry_after(formatdate(ratelimit.time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(parse_retry_after(formatdate(ratelimit.time.time() - 30, usegmt=True)), 0)
+
+    def test_missing_or_invalid(self):
+        self.assertEqual(parse_retry_after(None), 1.0)
+        self.assertEqual(parse_retry_after('', 2.5), 2.5)
+        self.assertEqual(parse_retry_after('soon', 7), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
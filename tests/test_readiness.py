@@ -0,0 +1,91 @@
+""" The readiness waiter reports READY, ERROR and TIMEOUT rows, and `ecs wait` exits 1
+when any server is not ready. """
+
+import subprocess
+import unittest
+import json
+import sys
+import os
+
+from support import ROOT
+from fakecloud import FakeCloud, FakeServer
+from readiness import ReadinessWaiter
+from ecs_api import ECSApi
+import readiness
+
+
+class ReadinessTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # synthetic servers are ACTIVE, SHUTOFF and BUILD in turn, each with an EIP
+        cls.fake = FakeServer(FakeCloud(servers=4)).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+        cls.api = ECSApi()
+        with cls.fake.cloud.lock:
+            cls.active, cls.shutoff, cls.build, cls.failed = sorted(cls.fake.cloud.servers)
+            cls.fake.cloud.servers[cls.failed]['status'] = 'ERROR'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def setUp(self):
+        self.saved_probe = readiness.probe
+
+    def tearDown(self):
+        readiness.probe = self.saved_probe
+
+    def wait(self, server_ids, **kwargs):
+        waiter = ReadinessWaiter(self.api, interval=0.05, timeout=0.3, **kwargs)
+        return list(waiter.wait(server_ids))
+
+    def test_ready_error_and_timeout(self):
+        results = self.wait([self.build, self.failed, self.active, 'missing'], port=None)
+        self.assertEqual([(server_id, result['status']) for server_id, result in results],
+                         [(self.active, 'READY'), (self.failed, 'ERROR'), (self.build, 'TIMEOUT'),
+                          ('missing', 'TIMEOUT')])
+        results = dict(results)
+        self.assertEqual(results[self.failed]['server_status'], 'ERROR')
+        self.assertEqual(results[self.build]['server_status'], 'BUILD')
+        self.assertIsNone(results['missing']['server_status'])
+        self.assertTrue(results[self.active]['address'].startswith('122.112.'))
+        self.assertGreaterEqual(results[self.build]['elapsed'], 0.3)
+
+    def test_unreachable_servers_time_out(self):
+        probed = []
+
+        def probe(address, port, timeout):
+            probed.append((address, port))
+            return False
+        readiness.probe = probe
+        results = self.wait([self.active], port=2222, floating=False)
+        self.assertEqual(results[0][1]['status'], 'TIMEOUT')
+        self.assertEqual(results[0][1]['server_status'], 'ACTIVE')
+        # probed again on every interval, on the fixed IP
+        self.assertGreater(len(probed), 1)
+        self.assertTrue(all(address.startswith('192.168.') and port == 2222 for address, port in probed))
+
+    def test_reachable_servers_are_ready(self):
+        readiness.probe = lambda address, port, timeout: True
+        results = self.wait([self.active, self.shutoff])
+        self.assertEqual([result['status'] for _, result in results], ['READY', 'TIMEOUT'])
+
+    def test_wait_command_fails_on_timeout(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        process = subprocess.Popen([sys.executable, '-c', 'import sys; from ecs_api.ecs import main; main(sys.argv)',
+                                    'wait', '--no-probe', '--timeout', '0.3', '--interval', '0.05',
+                                    self.active, self.shutoff], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 1, stderr)
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        self.assertEqual([(row['id'], row['status']) for row in rows],
+                         [(self.active, 'READY'), (self.shutoff, 'TIMEOUT')])
+        self.assertIn('1 ECSs did not become ready: %s' % self.shutoff, stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
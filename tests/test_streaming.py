@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+""" iter_array gives the same elements with ijson and with the raw_decode scanner, however
+the body is cut into chunks. """
+
+from decimal import Decimal
+import unittest
+import json
+
+import support  # noqa: F401
+import streaming
+import codec
+
+FIXTURE = json.dumps({
+    "count": 4,
+    "meta": {"servers": ["not", "this", "one"], "note": "\"servers\": [1, 2]"},
+    "servers": [
+        {"id": "a", "name": "with \"quotes\" and \\ backslash", "ratio": 0.25, "ram": 4096, "tags": []},
+        {"id": "b", "name": u"café 中文", "ratio": -1.5e-3, "ok": True, "gone": None},
+        {"id": "c", "nested": {"list": [[1, 2.5], {"k": "]}"}]}, "ratio": 12345678.875},
+        {"id": "d", "name": ",]}{[", "ok": False, "big": 10 ** 20},
+    ],
+    "links": [{"href": "next"}],
+}, indent=1)
+
+EXPECTED = json.loads(FIXTURE)['servers']
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterArrayTest(unittest.TestCase):
+    def check(self, iter_array, data):
+        for size in range(1, len(data) + 1):
+            items = list(iter_array(chunked(data, size), 'servers'))
+            self.assertEqual(items, EXPECTED, "chunks of %d bytes" % size)
+            # the elements can be encoded again, e.g. for ndjson output
+            self.assertEqual(json.loads(codec.dumps(items)), EXPECTED)
+
+    def test_fallback(self):
+        self.check(streaming._iter_array_fallback, FIXTURE)
+
+    def test_fallback_multibyte_split(self):
+        data = json.dumps({"servers": [{"name": u"中文"}]}, ensure_ascii=False).encode('utf-8')
+        for size in range(1, len(data) + 1):
+            items = list(streaming._iter_array_fallback(chunked(data, size), 'servers'))
+            self.assertEqual(items, [{"name": u"中文"}])
+
+    def test_fallback_missing_key(self):
+        self.assertEqual(list(streaming._iter_array_fallback(chunked(FIXTURE, 7), 'volumes')), [])
+
+    @unittest.skipIf(streaming.ijson is None, "ijson is not installed")
+    def test_ijson(self):
+        self.check(streaming.iter_array, FIXTURE)
+        for item in streaming.iter_array([FIXTURE], 'servers'):
+            self.assertNotIn(Decimal, [type(value) for value in item.values()])
+
+    def test_decimals_become_floats(self):
+        item = {"ratio": Decimal('0.25'), "list": [Decimal('1.5'), 2, {"x": Decimal('-3.125')}], "name": "a"}
+        self.assertEqual(streaming._floats(item), {"ratio": 0.25, "list": [1.5, 2, {"x": -3.125}], "name": "a"})
+        self.assertIs(type(streaming._floats(item)["ratio"]), float)
+
+
+if __name__ == '__main__':
+    unittest.main()
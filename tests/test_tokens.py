@@ -0,0 +1,126 @@
+""" Tokens are shared through a keyed, locked file, renewed ahead of expiry and requested
+again when the cloud rejects them. """
+
+import tempfile
+import unittest
+import shutil
+import os
+
+import support  # noqa: F401
+from test_ratelimit import FakeClock
+from fakecloud import FakeServer
+from tokens import TokenCache, parse_expires_at
+from ecs_api import ECSApi, request_token, token_cache
+import tokens
+
+
+class TokenCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer().start()
+        cls.auth_url = cls.fake.url + 'v3/auth/tokens'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ecs-test-tokens-')
+        self.path = os.path.join(self.tmp, 'tokens')
+        self.fetched = []
+        self.clock = FakeClock()
+        self.saved = tokens.time
+        tokens.time = self.clock
+
+    def tearDown(self):
+        tokens.time = self.saved
+        shutil.rmtree(self.tmp)
+
+    def fetch(self, *identity):
+        self.fetched.append(identity[1])
+        return request_token(*identity)
+
+    def cache(self, **kwargs):
+        """ A token cache as another process sharing the home directory would have. """
+        kwargs.setdefault('background', False)
+        return TokenCache(self.path, self.fetch, **kwargs)
+
+    def get(self, cache, project='cn-east-2', **kwargs):
+        return cache.get(self.auth_url, project, 'fake', 'fake', 'fake', **kwargs)
+
+    def test_identities_share_one_keyed_file(self):
+        first = self.cache()
+        east, north = self.get(first), self.get(first, 'cn-north-1')
+        self.assertNotEqual(east['token'], north['token'])
+        self.assertEqual(self.get(first), east)
+        # another process reuses both tokens from the file
+        second = self.cache()
+        self.assertEqual(self.get(second), east)
+        self.assertEqual(self.get(second, 'cn-north-1'), north)
+        self.assertEqual(self.fetched, ['cn-east-2', 'cn-north-1'])
+        for project in ('cn-east-2', 'cn-north-1'):
+            key = TokenCache.key(self.auth_url, project, 'fake', 'fake')
+            self.assertTrue(os.path.exists(first._key_lock_path(key) + '.lock'))
+
+    def test_unkeyed_files_are_ignored(self):
+        with open(self.path, 'w') as fp:
+            fp.write('{"token": "old", "expires_at": "2999-01-01T00:00:00.000000Z", "project_id": "p"}')
+        self.assertNotEqual(self.get(self.cache())['token'], 'old')
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_refreshed_ahead_of_expiry(self):
+        cache = self.cache(refresh_margin=512)
+        j_token = self.get(cache)
+        expires = parse_expires_at(j_token['expires_at'])
+        self.clock.now = expires - 513
+        self.assertEqual(self.get(cache), j_token)
+        self.clock.now = expires - 511
+        self.assertNotEqual(self.get(cache)['token'], j_token['token'])
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_background_refresh_is_scheduled_before_the_margin(self):
+        cache = self.cache(refresh_margin=512, background=True)
+        try:
+            j_token = self.get(cache)
+            timer = cache.timers[TokenCache.key(self.auth_url, 'cn-east-2', 'fake', 'fake')]
+            self.assertEqual(timer.interval, parse_expires_at(j_token['expires_at']) - 512 - self.clock.now + 1)
+            # the same token does not schedule another refresh
+            self.get(cache)
+            self.assertIs(cache.timers.values()[0], timer)
+        finally:
+            cache.cancel()
+
+    def test_force_reuses_a_token_renewed_by_another_process(self):
+        first, second = self.cache(), self.cache()
+        rejected = self.get(first)
+        self.get(second)
+        renewed = self.get(second, force=True)
+        self.assertNotEqual(renewed['token'], rejected['token'])
+        # first's token was rejected too, but second already saved a new one
+        self.assertEqual(self.get(first, force=True), renewed)
+        self.assertEqual(len(self.fetched), 2)
+
+
+class TokenRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeServer().start()
+        self.saved_env = dict(os.environ)
+        os.environ.update(self.fake.env())
+
+    def tearDown(self):
+        self.fake.stop()
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+
+    def test_rejected_token_is_renewed(self):
+        api = ECSApi()
+        rejected = api.token
+        with self.fake.cloud.lock:
+            del self.fake.cloud.tokens[rejected]
+        self.assertEqual(list(api.iter_servers()), [])
+        self.assertNotEqual(api.token, rejected)
+        self.assertEqual(token_cache.get(*api.identity)['token'], api.token)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+""" Provisioning timelines and their Chrome trace export, on a fake clock. """
+
+import tempfile
+import unittest
+import shutil
+import json
+import os
+
+import support  # noqa: F401
+from test_ratelimit import FakeClock
+from tracing import ProvisionTracer, PHASES
+import tracing
+
+FLOATING = {'net': [{'addr': '192.168.0.2', 'OS-EXT-IPS:type': 'fixed'},
+                    {'addr': '122.112.0.2', 'OS-EXT-IPS:type': 'floating'}]}
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = tracing.time
+        tracing.time = self.clock
+        self.tracer = ProvisionTracer()
+
+    def tearDown(self):
+        tracing.time = self.saved
+
+    def job(self, status, *server_ids):
+        return {'status': status, 'entities': {'sub_jobs': [{'entities': {'server_id': server_id}}
+                                                            for server_id in server_ids]}}
+
+    def provision(self):
+        """ Two servers created by one job: submitted in 1s, queued 2s, running 4s, booted
+        in 8s and 16s, and the first one bound to its EIP 0.5s later. """
+        origin = self.tracer.origin
+        self.tracer.submitted('job-1', 2, origin, origin + 1)
+        self.clock.now += 3
+        self.tracer.job_status('job-1', self.job('RUNNING', 's1'))
+        self.tracer.job_status('job-1', self.job('RUNNING', 's1'))
+        self.clock.now += 4
+        self.tracer.job_status('job-1', self.job('SUCCESS', 's1', 's2'))
+        self.tracer.server_status({'id': 's1', 'status': 'BUILD'})
+        self.tracer.server_status({'id': 'unknown', 'status': 'ACTIVE'})
+        self.clock.now += 8
+        self.tracer.server_status({'id': 's1', 'status': 'ACTIVE'})
+        self.clock.now += 0.5
+        self.tracer.server_status({'id': 's1', 'status': 'ACTIVE', 'addresses': FLOATING})
+        self.clock.now += 7.5
+        self.tracer.server_status({'id': 's2', 'status': 'ACTIVE'})
+
+    def test_timelines(self):
+        self.provision()
+        s1, s2 = self.tracer.timelines()
+        self.assertEqual(s1['phases'], {'submit': 1, 'job_queued': 2, 'job_running': 4, 'boot': 8, 'eip': 0.5,
+                                        'total': 15.5})
+        self.assertEqual(s1['marks']['server_build'], 7)
+        self.assertEqual(s2['phases']['boot'], 16)
+        self.assertNotIn('eip', s2['phases'])
+        self.assertEqual(self.tracer.pending(), ['s2'])
+        self.assertEqual(self.tracer.pending(wait_eip=False), [])
+        self.assertEqual(self.tracer.summary()['boot'], {'count': 2, 'p50': 16, 'p90': 16, 'max': 16})
+
+    def test_chrome_trace(self):
+        self.provision()
+        trace = self.tracer.to_chrome_trace()
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        events = trace['traceEvents']
+        metadata = [(e['name'], e['pid'], e['args']['name']) for e in events if e['ph'] == 'M']
+        self.assertEqual(metadata, [('process_name', 1, 'jobs'), ('process_name', 2, 'servers'),
+                                    ('thread_name', 1, 'job job-1'), ('thread_name', 2, 'server s1'),
+                                    ('thread_name', 2, 'server s2')])
+        spans = [e for e in events if e['ph'] == 'X']
+        for span in spans:
+            # complete events, in integer microseconds
+            self.assertTrue(isinstance(span['ts'], int) and isinstance(span['dur'], int))
+        jobs = [(e['name'], e['ts'], e['dur']) for e in spans if e['pid'] == 1]
+        self.assertEqual(jobs, [('submit', 0, 1000000), ('job_queued', 1000000, 2000000),
+                                ('job_running', 3000000, 4000000)])
+        s1 = [(e['name'], e['ts'], e['dur']) for e in spans if e['pid'] == 2 and e['tid'] == 0]
+        self.assertEqual([name for name, _, _ in s1], [phase for phase, _, _ in PHASES])
+        self.assertEqual(s1[-2:], [('boot', 7000000, 8000000), ('eip', 15000000, 500000)])
+        self.assertEqual([e['args'] for e in spans if e['pid'] == 2 and e['tid'] == 1][0],
+                         {'server_id': 's2', 'job_id': 'job-1'})
+
+    def test_written_files_are_json(self):
+        self.provision()
+        tmp = tempfile.mkdtemp(prefix='ecs-test-tracing-')
+        try:
+            self.tracer.write(os.path.join(tmp, 'timeline.json'))
+            self.tracer.write_chrome_trace(os.path.join(tmp, 'timeline.trace'))
+            with open(os.path.join(tmp, 'timeline.json')) as fp:
+                timeline = json.load(fp)
+            with open(os.path.join(tmp, 'timeline.trace')) as fp:
+                trace = json.load(fp)
+        finally:
+            shutil.rmtree(tmp)
+        self.assertEqual([server['server_id'] for server in timeline['servers']], ['s1', 's2'])
+        self.assertEqual(timeline['summary']['total']['count'], 2)
+        self.assertEqual(len(trace['traceEvents']), len(self.tracer.to_chrome_trace()['traceEvents']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+""" Warm pool lease/release state machine, against the fake cloud. """
+
+import tempfile
+import unittest
+import shutil
+import os
+
+import support  # noqa: F401
+from fakecloud import FakeCloud, FakeServer
+from warmpool import WarmPool
+from bulk import bulk_create
+import warmpool
+from ecs_api import ECSApi
+
+
+class WarmPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeServer(FakeCloud(job_duration=0)).start()
+        cls.saved_env = dict(os.environ)
+        os.environ.update(cls.fake.env())
+        cls.api = ECSApi()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        os.environ.clear()
+        os.environ.update(cls.saved_env)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='ecs-test-pool-')
+        self.pool = WarmPool(self.api, os.path.join(self.tmp, 'pool.json'))
+        self.patched = []
+
+    def tearDown(self):
+        for name in self.patched:
+            delattr(self.api, name)
+        shutil.rmtree(self.tmp)
+
+    def patch(self, name, func):
+        """ Replace an ECSApi method of the shared api for this test. """
+        setattr(self.api, name, func)
+        self.patched.append(name)
+
+    def broken(self, *args, **kwargs):
+        raise RuntimeError("injected")
+
+    def define(self, name, size=2, mode='running', recycle='reuse'):
+        spec = self.api.default_server_spec()
+        spec['server']['name'] = name
+        self.pool.define(name, spec, size, mode, recycle)
+
+    def states(self, name):
+        return sorted(server['state'] for server in self.pool._load()['servers'].values() if server['pool'] == name)
+
+    def status(self, server_id):
+        with self.fake.cloud.lock:
+            return self.fake.cloud.servers[server_id]['status']
+
+    def test_maintain_fills_the_pool(self):
+        self.define('fill', size=3)
+        self.assertEqual(self.pool.maintain('fill'), {'recycled': 0, 'created': 3})
+        self.assertEqual(self.states('fill'), ['ready'] * 3)
+        self.assertEqual(self.pool.maintain('fill'), {'recycled': 0, 'created': 0})
+        status = self.pool.status()[0]
+        self.assertEqual((status['name'], status['ready'], status['creating']), ('fill', 3, 0))
+
+    def test_lease_release_recycle(self):
+        self.define('cycle', size=2)
+        self.pool.maintain('cycle')
+        first = self.pool.lease('cycle', holder='test')
+        self.assertEqual((first['pool'], first['state'], first['holder']), ('cycle', 'leased', 'test'))
+        second = self.pool.lease('cycle')
+        self.assertNotEqual(first['id'], second['id'])
+        self.assertRaises(LookupError, self.pool.lease, 'cycle')
+        self.assertEqual(self.states('cycle'), ['leased', 'leased'])
+
+        self.pool.release(first['id'])
+        self.assertEqual(self.states('cycle'), ['leased', 'released'])
+        # released servers are not handed out before they are recycled
+        self.assertRaises(LookupError, self.pool.lease, 'cycle')
+        # size counts idle servers: the recycled one and a new one replace the two leased
+        self.assertEqual(self.pool.maintain('cycle'), {'recycled': 1, 'created': 1})
+        self.assertEqual(self.states('cycle'), ['leased', 'ready', 'ready'])
+        self.assertEqual(self.pool._load()['servers'][first['id']]['state'], 'ready')
+        self.assertEqual(self.status(first['id']), 'ACTIVE')
+
+    def test_rebuild_replaces_the_server(self):
+        self.define('rebuild', size=1)
+        self.pool.maintain('rebuild')
+        server = self.pool.lease('rebuild')
+        self.pool.release(server['id'], rebuild=True)
+        self.assertEqual(self.pool.maintain('rebuild'), {'recycled': 1, 'created': 1})
+        replacement = self.pool.lease('rebuild')
+        self.assertNotEqual(replacement['id'], server['id'])
+        self.assertNotIn(server['id'], self.fake.cloud.servers)
+
+    def test_stopped_pool_starts_on_lease(self):
+        self.define('cold', size=1, mode='stopped')
+        self.pool.maintain('cold')
+        server_id = list(self.pool._load()['servers'])[0]
+        self.assertEqual(self.status(server_id), 'SHUTOFF')
+        self.assertEqual(self.pool.lease('cold')['id'], server_id)
+        self.assertEqual(self.status(server_id), 'ACTIVE')
+        self.pool.release(server_id)
+        self.pool.maintain('cold')
+        self.assertEqual(self.status(server_id), 'SHUTOFF')
+        self.assertEqual(self.states('cold'), ['ready'])
+
+    def test_shrink_and_remove(self):
+        self.define('shrink', size=3)
+        self.pool.maintain('shrink')
+        leased = self.pool.lease('shrink')
+        self.define('shrink', size=1)
+        self.assertEqual(self.pool.maintain('shrink'), {'recycled': 0, 'created': 0})
+        # the surplus idle server is deleted, the leased one stays out of the count
+        self.assertEqual(self.states('shrink'), ['leased', 'ready'])
+        self.pool.release(leased['id'])
+        idle = self.pool.remove('shrink')
+        self.assertEqual(len(idle), 2)
+        self.assertIn(leased['id'], idle)
+        self.assertEqual(self.pool.status(), [])
+        # servers are deleted by a job of the fake cloud, which completes as it is polled
+        self.fake.cloud.advance()
+        self.assertFalse(set(idle) & set(self.fake.cloud.servers))
+
+    def test_unknown_pool_and_server(self):
+        self.assertRaises(ValueError, self.pool.lease, 'nope')
+        self.assertRaises(ValueError, self.pool.release, 'not-a-pool-server')
+        self.assertRaises(ValueError, self.pool.remove, 'nope')
+        self.assertRaises(ValueError, self.pool.define, 'bad', {}, 1, mode='warm')
+
+    def test_abandoned_claims_are_dropped(self):
+        self.define('abandoned', size=1)
+
+        def abandon(state):
+            state['pools']['abandoned']['creating'].append({'id': 'x', 'count': 1, 'pid': 2 ** 22 + 1,
+                                                            'since': 0})
+        self.pool._update(abandon)
+        self.assertEqual(self.pool.maintain('abandoned'), {'recycled': 0, 'created': 1})
+
+    def test_failed_create_drops_claim(self):
+        self.define('create-fails')
+        warmpool.bulk_create = self.broken
+        try:
+            self.assertRaises(RuntimeError, self.pool.maintain, 'create-fails')
+        finally:
+            warmpool.bulk_create = bulk_create
+        self.assertEqual(self.pool._load()['pools']['create-fails']['creating'], [])
+        self.assertEqual(self.states('create-fails'), [])
+
+    def test_failed_stop_registers_nothing(self):
+        self.define('stop-fails', mode='stopped')
+        self.patch('stop_ecss', self.broken)
+        self.assertEqual(self.pool.maintain('stop-fails'), {'recycled': 0, 'created': 0})
+        self.assertEqual(self.pool._load()['pools']['stop-fails']['creating'], [])
+        self.assertEqual(self.states('stop-fails'), [])
+
+    def test_failed_start_releases_lease(self):
+        self.define('start-fails', size=1, mode='stopped')
+        self.pool.maintain('start-fails')
+        self.assertEqual(self.states('start-fails'), ['ready'])
+        self.patch('start_ecss', self.broken)
+        self.assertRaises(RuntimeError, self.pool.lease, 'start-fails')
+        servers = self.pool._load()['servers'].values()
+        self.assertEqual([(server['state'], server['rebuild']) for server in servers], [('released', True)])
+
+
+if __name__ == '__main__':
+    unittest.main()